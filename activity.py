@@ -0,0 +1,215 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+# Профиль пользователя, каким он записан в БД
+Profile = namedtuple('Profile', ['username', 'full_name', 'position'])
+
+# Нет строки в users - первый визит пишется сразу (на users ссылаются оценки)
+MISSING = object()
+
+FLUSH_ACTIVITY = """
+    UPDATE users AS u SET
+        last_activity = v.last_activity,
+        username = CASE WHEN v.changed THEN v.username ELSE u.username END,
+        full_name = CASE WHEN v.changed THEN v.full_name ELSE u.full_name END,
+        position = COALESCE(u.position, v.position)
+    FROM (VALUES %s) AS v (telegram_id, username, full_name, position, last_activity, changed)
+    WHERE u.telegram_id = v.telegram_id
+"""
+FLUSH_TEMPLATE = "(%s::bigint, %s::text, %s::text, %s::text, %s::timestamp, %s::boolean)"
+
+
+class ActivityTracker:
+    """Последняя активность и профили пользователей с отложенной записью
+
+    Визиты копятся в памяти и пишутся в users одним UPDATE раз в flush_interval.
+    Имя и username обновляются, только если отличаются от записанных в БД.
+    """
+
+    def __init__(self, pool, connect=None, flush_interval=30.0, max_profiles=100000):
+        self.pool = pool
+        # Соединение для запросов из обработчиков (в асинхронном режиме - asyncpg)
+        self.connect = connect or pool.connection
+        self.flush_interval = flush_interval
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # telegram_id -> Profile (LRU)
+        self._profiles = OrderedDict()
+        # telegram_id -> [username, full_name, position, last_activity, changed]
+        self._pending = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.touches = 0
+        self.inserts = 0
+        self.profile_changes = 0
+        self.flushed = 0
+        self.flushes = 0
+        self._flush_total = 0.0
+        self._flush_max = 0.0
+
+    @classmethod
+    def from_env(cls, pool, connect=None):
+        """Создает трекер по переменным окружения"""
+        return cls(
+            pool,
+            connect=connect,
+            flush_interval=float(os.getenv('ACTIVITY_FLUSH_INTERVAL', 30)),
+            max_profiles=int(os.getenv('ACTIVITY_MAX_PROFILES', 100000))
+        )
+
+    def _cached(self, telegram_id):
+        with self._lock:
+            profile = self._profiles.get(telegram_id)
+            if profile is not None:
+                self._profiles.move_to_end(telegram_id)
+            return profile
+
+    def _remember(self, telegram_id, profile):
+        with self._lock:
+            self._profiles[telegram_id] = profile
+            self._profiles.move_to_end(telegram_id)
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def get_profile(self, telegram_id):
+        """Профиль пользователя из памяти или из БД; None, если пользователя нет"""
+        profile = self._cached(telegram_id)
+        if profile is None:
+            with self.connect() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT username, full_name, position FROM users WHERE telegram_id = %s",
+                        (telegram_id,)
+                    )
+                    row = cur.fetchone()
+            profile = Profile(*row) if row else MISSING
+            self._remember(telegram_id, profile)
+        return None if profile is MISSING else profile
+
+    def get_position(self, telegram_id):
+        profile = self.get_profile(telegram_id)
+        return profile.position if profile else None
+
+    def touch(self, telegram_id, username, full_name, position=None):
+        """Отмечает визит пользователя"""
+        with self._lock:
+            self.touches += 1
+        profile = self.get_profile(telegram_id)
+
+        if profile is None:
+            self._insert(telegram_id, username, full_name, position)
+            return
+
+        changed = (username, full_name) != (profile.username, profile.full_name)
+        new_position = position if profile.position is None else None
+        if changed or new_position:
+            self._remember(telegram_id, Profile(username, full_name, profile.position or position))
+        with self._lock:
+            if changed:
+                self.profile_changes += 1
+            pending = self._pending.get(telegram_id)
+            if pending is None:
+                self._pending[telegram_id] = [username, full_name, new_position, datetime.now(), changed]
+            else:
+                pending[0:4] = [username, full_name, new_position or pending[2], datetime.now()]
+                pending[4] = pending[4] or changed
+
+    def _insert(self, telegram_id, username, full_name, position):
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """INSERT INTO users (telegram_id, username, full_name, position)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (telegram_id) DO UPDATE
+                    SET username = EXCLUDED.username,
+                        full_name = EXCLUDED.full_name,
+                        position = COALESCE(users.position, EXCLUDED.position),
+                        last_activity = CURRENT_TIMESTAMP
+                    RETURNING position""",
+                    (telegram_id, username, full_name, position)
+                )
+                stored_position = cur.fetchone()[0]
+        self._remember(telegram_id, Profile(username, full_name, stored_position))
+        with self._lock:
+            self.inserts += 1
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='activity-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Останавливает фоновую запись и сохраняет накопленные визиты"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Пишет накопленные визиты одним UPDATE"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            rows = [(telegram_id, *values) for telegram_id, values in pending.items()]
+            started = time.monotonic()
+            try:
+                with self.pool.connection() as conn:
+                    with conn.cursor() as cur:
+                        execute_values(cur, FLUSH_ACTIVITY, rows, template=FLUSH_TEMPLATE, page_size=1000)
+            except Exception as e:
+                logger.error(f"Ошибка записи активности {len(rows)} пользователей: {e}")
+                self._requeue(pending)
+                return 0
+
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.flushed += len(rows)
+                self.flushes += 1
+                self._flush_total += elapsed
+                self._flush_max = max(self._flush_max, elapsed)
+            return len(rows)
+
+    def _requeue(self, pending):
+        """Возвращает незаписанные визиты; более новые данные из очереди важнее"""
+        with self._lock:
+            for telegram_id, values in pending.items():
+                newer = self._pending.get(telegram_id)
+                if newer is None:
+                    self._pending[telegram_id] = values
+                else:
+                    newer[2] = newer[2] or values[2]
+                    newer[4] = newer[4] or values[4]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'profiles': len(self._profiles),
+                'pending': len(self._pending),
+                'touches': self.touches,
+                'inserts': self.inserts,
+                'profile_changes': self.profile_changes,
+                'flushed': self.flushed,
+                'flushes': self.flushes,
+                'flush_avg_ms': round(self._flush_total / self.flushes * 1000, 2) if self.flushes else 0.0,
+                'flush_max_ms': round(self._flush_max * 1000, 2)
+            }
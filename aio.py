@@ -0,0 +1,83 @@
+"""Мост между синхронными обработчиками бота и asyncio
+
+Обработчики написаны один раз в синхронном стиле. В асинхронном режиме каждый апдейт
+обрабатывается в отдельном greenlet: когда обработчик доходит до ввода-вывода
+(Bot API, PostgreSQL, Redis), await_only() передает корутину в цикл событий и
+переключается обратно, когда результат готов. Поток на апдейт не нужен.
+"""
+import sys
+
+import greenlet
+
+
+class _AsyncioGreenlet(greenlet.greenlet):
+    """Greenlet обработки апдейта, которому разрешено ждать корутины"""
+
+    def __init__(self, fn, driver):
+        super().__init__(fn, driver)
+        self.driver = driver
+
+
+def in_async_context():
+    """True, если код выполняется внутри greenlet_spawn()"""
+    return isinstance(greenlet.getcurrent(), _AsyncioGreenlet)
+
+
+def await_only(awaitable):
+    """Дожидается корутины из синхронного кода, запущенного через greenlet_spawn()"""
+    current = greenlet.getcurrent()
+    if not isinstance(current, _AsyncioGreenlet):
+        raise RuntimeError("await_only() вызван вне greenlet_spawn()")
+    # Отдаем корутину циклу событий; сюда вернется ее результат или исключение
+    return current.driver.switch(awaitable)
+
+
+async def greenlet_spawn(fn, *args, **kwargs):
+    """Выполняет синхронную функцию, ожидая все корутины, переданные в await_only()"""
+    context = _AsyncioGreenlet(fn, greenlet.getcurrent())
+    result = context.switch(*args, **kwargs)
+    while not context.dead:
+        try:
+            value = await result
+        except BaseException:
+            result = context.throw(*sys.exc_info())
+        else:
+            result = context.switch(value)
+    return result
+
+
+class AsyncAwareClient:
+    """Синхронный клиент (redis-py), который в асинхронном режиме подменяется асинхронным
+
+    Компоненты, которые вызываются и из обработчиков, и из фоновых потоков, работают с
+    одним объектом: внутри greenlet_spawn() вызовы идут в асинхронный клиент
+    (redis.asyncio) через await_only(), в остальных потоках - в синхронный.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.async_client = None
+
+    def use_async(self, async_client):
+        self.async_client = async_client
+
+    def __getattr__(self, name):
+        if self.async_client is None or not in_async_context():
+            return getattr(self.client, name)
+        if name == 'pipeline':
+            return lambda *args, **kwargs: _AsyncPipeline(self.async_client.pipeline(*args, **kwargs))
+        method = getattr(self.async_client, name)
+        return lambda *args, **kwargs: await_only(method(*args, **kwargs))
+
+
+class _AsyncPipeline:
+    """Пакет redis.asyncio: команды копятся синхронно, execute() ожидается через await_only()"""
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+
+    def __getattr__(self, name):
+        return getattr(self.pipe, name)
+
+    def execute(self, *args, **kwargs):
+        return await_only(self.pipe.execute(*args, **kwargs))
@@ -0,0 +1,73 @@
+"""Асинхронный режим бота (BOT_RUNTIME=async)
+
+Апдейты получает AsyncTeleBot, каждый апдейт обрабатывается отдельной задачей asyncio.
+Маршрутизация, middleware и обработчики - те же, что у синхронного TeleBot: они
+выполняются в greenlet (см. aio.py), а Bot API, asyncpg и redis.asyncio ожидаются
+через цикл событий. Один процесс держит тысячи апдейтов в работе без потока на каждый.
+"""
+import asyncio
+import logging
+
+from telebot.async_telebot import AsyncTeleBot
+
+from aio import greenlet_spawn
+
+logger = logging.getLogger(__name__)
+
+
+async def run_async(bot, api, token, db_async_pool, sessions=None, redis_async_client=None,
+                    redis_clients=(), concurrency=1000, poll_timeout=20):
+    """Получает апдейты long polling'ом и обрабатывает их конкурентно до остановки
+
+    redis_clients - обертки AsyncAwareClient, которые в обработчиках должны идти через redis.asyncio.
+    """
+    async_bot = AsyncTeleBot(token)
+    api.use_async(async_bot)
+    if redis_async_client is not None:
+        if hasattr(sessions, 'use_async'):
+            sessions.use_async(redis_async_client)
+        for client in redis_clients:
+            client.use_async(redis_async_client)
+    await db_async_pool.open()
+
+    # Обработчики вызываются напрямую в greenlet задачи, без пула потоков TeleBot
+    bot.threaded = False
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    async def process(update):
+        try:
+            await greenlet_spawn(bot.process_new_updates, [update])
+        except Exception as e:
+            logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+        finally:
+            semaphore.release()
+
+    await async_bot.delete_webhook()
+    logger.info(f"Асинхронный режим запущен, одновременно обрабатывается до {concurrency} апдейтов")
+    offset = None
+    try:
+        while True:
+            try:
+                updates = await async_bot.get_updates(offset=offset, timeout=poll_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка получения апдейтов: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                # Ограничиваем число апдейтов в работе: при перегрузке перестаем забирать новые
+                await semaphore.acquire()
+                task = asyncio.create_task(process(update))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+    finally:
+        if tasks:
+            logger.info(f"Дожидаемся обработки {len(tasks)} апдейтов")
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await db_async_pool.close()
+        if redis_async_client is not None:
+            await redis_async_client.close()
+        await async_bot.close_session()
@@ -1,11 +1,37 @@
 import os
+import time
+import signal
+import asyncio
+import threading
 import logging
 import random
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import telebot
-from telebot import types
-import psycopg2
-import redis
+from telebot import types, apihelper, asyncio_helper
+from telebot.handler_backends import BaseMiddleware
+from db import get_db_connection, on_query, pool as db_pool, async_pool as db_async_pool
+from aio import AsyncAwareClient
+from catalog import CatalogCache
+from session import create_session_store
+from navstate import NavState, NavigationStore
+from callback_codec import CallbackCodec, Int, Choice, Digits
+from webhook import run_webhook
+from sharding import UpdateStreams, UpdateDispatcher, ShardWorker
+from telegram_api import TelegramApi, resolve
+from outbound import OutboundDispatcher, PRIORITY_NAMES
+from async_runtime import run_async
+from router import CallbackRouter
+from menus import MenuRegistry, PrebuiltMarkup
+from recommendations import RecommendationIndex, ROLE_CATEGORIES
+from ratings import RatingWriter
+from activity import ActivityTracker
+from inline import InlineResultCache
+from broadcast import BroadcastEngine, next_course_start
+from support import SupportDesk
+from faq import FaqIndex, DeflectionStats, PendingQuestions, load_faq, QUESTION, SUGGESTED, DEFLECTED, ESCALATED, UNMATCHED, EXPIRED
+from profiling import UpdateProfiler, CPROFILE, SAMPLE
+from metrics import MetricsRegistry, MetricsServer, TimedRedis, TimedAsyncRedis, cached, timing_observer
 
 # Настройка логирования
 logging.basicConfig(
@@ -17,38 +43,160 @@ logger = logging.getLogger(__name__)
 # Загрузка переменных окружения
 load_dotenv()
 
+# Другой адрес Bot API (локальный Bot API сервер или tools/fake_bot_api.py)
+if os.getenv('TELEGRAM_API_URL'):
+    apihelper.API_URL = asyncio_helper.API_URL = os.getenv('TELEGRAM_API_URL').rstrip('/') + '/bot{0}/{1}'
+
+# Метрики в формате Prometheus (GET /metrics на METRICS_PORT)
+metrics = MetricsRegistry(prefix='educationbot_')
+update_duration = metrics.histogram(
+    'update_duration_seconds', 'Время обработки апдейта по маршруту', ['type', 'route']
+)
+updates_total = metrics.counter('updates_total', 'Обработанные апдейты', ['type', 'route', 'status'])
+observe_db = timing_observer(
+    metrics.histogram('db_query_duration_seconds', 'Время запросов к PostgreSQL', ['operation']),
+    metrics.counter('db_query_errors_total', 'Ошибки запросов к PostgreSQL', ['operation']),
+    'operation'
+)
+observe_redis = timing_observer(
+    metrics.histogram('redis_command_duration_seconds', 'Время команд и пайплайнов Redis', ['command']),
+    metrics.counter('redis_command_errors_total', 'Ошибки команд Redis', ['command']),
+    'command'
+)
+observe_telegram = timing_observer(
+    metrics.histogram('telegram_call_duration_seconds', 'Время вызовов Bot API (без ожидания в очереди)', ['method']),
+    metrics.counter('telegram_call_errors_total', 'Ошибки вызовов Bot API', ['method']),
+    'method'
+)
+on_query(observe_db)
+
 # Инициализация бота
-bot = telebot.TeleBot(os.getenv('TELEGRAM_TOKEN'))
+bot = telebot.TeleBot(os.getenv('TELEGRAM_TOKEN'), use_class_middlewares=True)
+# Все исходящие вызовы Bot API из обработчиков идут через api
+api = TelegramApi(bot)
+api.use_observer(observe_telegram)
+# Отправка и редактирование сообщений - через очередь с лимитами Telegram
+outbound = OutboundDispatcher.from_env()
+api.use_dispatcher(outbound)
 
 # ID чата поддержки
 SUPPORT_CHAT_ID = int(os.getenv('SUPPORT_CHAT_ID', 1132159425))
+# Администраторы (кураторы), которым доступны рассылки: telegram id через запятую
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv('ADMIN_IDS', '').split(',') if admin_id.strip()}
+
+# Подключение к Redis
+redis_conn = TimedRedis(
+    host=os.getenv('REDIS_HOST', 'redis'),
+    port=6379,
+    db=0,
+    decode_responses=True,
+    observe=observe_redis
+)
+# Тот же Redis для компонентов, которые вызываются из обработчиков: в асинхронном режиме - через redis.asyncio
+redis_client = AsyncAwareClient(redis_conn)
+
+# Хранилище сессий: состояние пользователей переживает перезапуск и общее для всех реплик бота
+sessions = create_session_store(
+    os.getenv('SESSION_BACKEND', 'redis'),
+    redis_client=redis_conn,
+    ttl=int(os.getenv('SESSION_TTL', 7 * 24 * 3600)),
+    max_entries=int(os.getenv('SESSION_MAX_ENTRIES', 100000)) or None
+)
 
 # Состояния пользователей
-user_states = {}
-user_menu_messages = {}
+user_states = sessions.namespace('state')
+user_menu_messages = sessions.namespace('menu_message')
+# Позиции листания: только ключ списка, позиция и id сообщения, без карточек курсов.
+# Кнопки каталога, опроса и рекомендаций сами несут свое состояние (callback_codec),
+# позиция в сессии нужна только для кнопок листания старого формата
+NAV_STATE_TTL = int(os.getenv('NAV_STATE_TTL', 24 * 3600))
 user_course_positions = {
-    'regular': {},
-    'recommended': {}
+    'regular': NavigationStore(sessions.namespace('course_position'), NAV_STATE_TTL)
 }
-# Для хранения состояния опроса подбора курсов
-user_survey_state = {}
 # Для хранения состояния обратной связи
-user_feedback_state = {}
+user_feedback_state = sessions.namespace('feedback')
 # Для хранения состояния оценки
-user_rating_state = {}
+user_rating_state = sessions.namespace('rating')
 # Для хранения выбора курса перед оценкой
-user_selected_course_for_rating = {}
+user_selected_course_for_rating = sessions.namespace('rating_course')
 # Для хранения ФИО преподавателя перед оценкой
-user_selected_teacher_for_rating = {}
+user_selected_teacher_for_rating = sessions.namespace('rating_teacher')
 
 # Для отслеживания что сейчас пользователь пишет ФИО
-user_typing_teacher_name = {}
+user_typing_teacher_name = sessions.namespace('typing_teacher')
 
 # Для хранения пользователей, которые пишут вопрос
-users_waiting_for_question = {}
+users_waiting_for_question = sessions.namespace('waiting_question')
+
+# Последний поисковый запрос (только текст: результаты - в общем кэше search_results) и ожидание текста запроса
+user_search_results = sessions.namespace('search')
+users_waiting_for_search = sessions.namespace('waiting_search')
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Замеряет время обработки апдейта и считает апдейты по маршрутам"""
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ['message', 'callback_query', 'inline_query']
+        self._commands = None
+
+    def route(self, update):
+        if isinstance(update, types.CallbackQuery):
+            return 'callback', callback_router.route_name(update.data)
+        if isinstance(update, types.InlineQuery):
+            return 'inline', 'inline'
+        text = update.text or ''
+        if not text.startswith('/'):
+            return 'message', update.content_type
+        if self._commands is None:
+            # Команды известны после регистрации всех обработчиков
+            self._commands = {
+                command
+                for handler in bot.message_handlers
+                for command in handler['filters'].get('commands') or ()
+            }
+        command = text.split()[0][1:].split('@')[0]
+        # Неизвестные команды в одну метку, чтобы не плодить временные ряды
+        return 'message', f"/{command}" if command in self._commands else '/other'
 
-# Для связи вопросов и пользователей
-pending_questions = {}
+    def pre_process(self, message, data):
+        data['metrics_started'] = time.perf_counter()
+
+    def post_process(self, message, data, exception):
+        started = data.get('metrics_started')
+        if started is None:
+            return
+        update_type, route = self.route(message)
+        update_duration.observe(time.perf_counter() - started, type=update_type, route=route)
+        updates_total.inc(type=update_type, route=route, status='error' if exception else 'ok')
+
+
+class SessionMiddleware(BaseMiddleware):
+    """Открывает сессию пользователя на время обработки апдейта"""
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ['message', 'callback_query']
+
+    def pre_process(self, message, data):
+        sessions.begin()
+        chat = message.message.chat if isinstance(message, types.CallbackQuery) else message.chat
+        try:
+            sessions.prefetch(('session', chat.id))
+        except Exception as e:
+            logger.error(f"Ошибка чтения сессии: {e}")
+
+    def post_process(self, message, data, exception):
+        try:
+            sessions.flush()
+        except Exception as e:
+            logger.error(f"Ошибка сохранения сессии: {e}")
+
+
+# Метрики первыми: в замер входит чтение сессии
+bot.setup_middleware(MetricsMiddleware())
+bot.setup_middleware(SessionMiddleware())
 
 # Данные для опроса
 # Данные для опроса
@@ -75,178 +223,507 @@ survey_questions = [
     }
 ]
 
-# База данных FAQ (вопросы и ответы)
-# База данных FAQ (вопросы и ответы)
-faq_data = {
-    "Оплата": [
-        {"question": "Какие способы оплаты доступны?",
-         "answer": "Мы принимаем оплату банковскими картами (Visa, Mastercard, МИР), а также через PayPal."},
-        {"question": "Есть ли рассрочка?",
-         "answer": "Да, мы предоставляем рассрочку на 3 месяца для всех курсов стоимостью от 20 000 руб."},
-        {"question": "Как получить чек?",
-         "answer": "Чек приходит на вашу электронную почту сразу после оплаты. Если письма нет, проверьте папку 'Спам'."}
-    ],
-    "Запись на курс": [
-        {"question": "Как записаться на курс?",
-         "answer": "Выберите курс в каталоге и нажмите кнопку 'Записаться'. Вам придет инструкция на почту."},
-        {"question": "Нужны ли документы для записи?",
-         "answer": "Для большинства курсов достаточно паспорта. Для программ с выдачей сертификата может потребоваться диплом."},
-        {"question": "Можно ли записаться по телефону?",
-         "answer": "Да, звоните по номеру +7 (XXX) XXX-XX-XX с 9:00 до 18:00."}
-    ],
-    "Сроки": [
-        {"question": "Когда начинается курс?",
-         "answer": "Ближайший старт - 15 числа каждого месяца. Точная дата указана на странице курса."},
-        {"question": "Можно ли продлить доступ?",
-         "answer": "Да, доступ можно продлить за дополнительную плату (10% от стоимости курса за месяц)."},
-        {"question": "Сколько длится курс?",
-         "answer": "Длительность указана на странице каждого курса. Обычно от 4 до 12 недель."}
-    ],
-    "Техподдержка": [
-        {"question": "Не работает личный кабинет",
-         "answer": "Очистите кеш браузера или попробуйте зайти с другого устройства. Если проблема сохраняется, напишите на support@example.com."},
-        {"question": "Не приходят письма",
-         "answer": "Проверьте папку 'Спам'. Добавьте наш email в контакты. Если проблема не решена, свяжитесь с техподдержкой."},
-        {"question": "Как сменить пароль?",
-         "answer": "На странице входа нажмите 'Забыли пароль?' и следуйте инструкциям."}
-    ]
-}
+# Статические меню: клавиатуры собираются и сериализуются один раз при старте
+menu_registry = MenuRegistry()
+
+menu_registry.menu('main_menu', 'Выберите, что Вам нужно:', [
+    ('Каталог курсов', 'catalog'),
+    ('Частные вопросы', 'questions'),
+    ('Подобрать курс', 'courses'),
+    ('Обратная связь', 'feedback')
+], main_menu=False)
+
+menu_registry.menu('catalog', 'Выберите критерий для подбора курсов:', [
+    ('Направление обучения', 'direction'),
+    ('Должность', 'post'),
+    ('Доступность', 'availability'),
+    ('⭐ Лучшие по оценкам', 'top')
+])
+
+menu_registry.menu('direction', 'Выберите направление обучения:', [
+    ('Финансы', 'finance'),
+    ('Управление', 'management'),
+    ('Педагогика', 'pedagogy')
+], back='catalog')
+
+menu_registry.menu('post', 'Выберите вашу должность:', [
+    ('ППС', 'pps'),
+    ('АУП', 'aup'),
+    ('Руководство', 'guide'),
+    ('Студенты', 'students')
+], back='catalog')
+
+menu_registry.menu('availability', 'Программы какой доступности вас интересуют?', [
+    ('Открытые программы', 'open'),
+    ('Ограниченные программы', 'limited')
+], back='catalog')
+
+menu_registry.menu('feedback', 'Свяжитесь с кураторами или задайте свой вопрос:', [
+    ('✍️ Контактные данные кураторов', 'contact_information'),
+    ('⭐ Оценить курсы и преподавателей', 'rate'),
+    ('✍️ Задать вопрос', 'ask_question')
+])
+
+menu_registry.menu('rate', 'Что вы хотите оценить?', [
+    ('📚 Оценить курс', 'rate_course'),
+    ('🎓 Оценить преподавателя', 'rate_teacher')
+], back='feedback')
+
+menu_registry.menu('contact_information', 'Контактные данные кураторов:', [
+    ('📞 Куратор Полина', {'url': 'https://t.me/polina_morik'}),
+    ('📞 Куратор Виктория', {'url': 'https://t.me/vikkaaa1'}),
+    ('📞 Куратор Анастасия', {'url': 'https://t.me/nestty2'})
+], back='feedback')
+
+# Подсказки из FAQ перед отправкой вопроса в поддержку
+menu_registry.keyboard('faq_suggestion', [
+    [('✅ Это помогло', 'faq_helpful')],
+    [('📨 Все равно отправить в поддержку', 'faq_escalate')]
+])
+
+# Клавиатуры оценки: звезды 1-3 и 4-5 в два ряда
+for target, back in (('course', 'rate_course'), ('teacher', None)):
+    stars = [(f"⭐ {rating}", f"rating_{target}_{rating}") for rating in range(1, 6)]
+    menu_registry.keyboard(f'rating_{target}', [
+        stars[:3], stars[3:]
+    ] + ([('🔙 Назад', back)] if back else []) + [('🏠 Главное меню', 'main_menu')])
+
+# Кэш каталога курсов (сбрасывается по NOTIFY из БД или по TTL)
+catalog_cache = CatalogCache(ttl=float(os.getenv('CATALOG_CACHE_TTL', 300)))
+
+# FAQ хранится в БД (faq_entries) и кэшируется вместе с каталогом: при загрузке
+# один раз собираются меню тем и поисковый индекс для подсказок
+FAQ_MATCH_THRESHOLD = float(os.getenv('FAQ_MATCH_THRESHOLD', 0.25))
+FAQ_SUGGESTIONS = int(os.getenv('FAQ_SUGGESTIONS', 3))
+# Через сколько секунд вопрос без ответа на подсказку сам уходит в поддержку
+FAQ_ESCALATION_TIMEOUT = float(os.getenv('FAQ_ESCALATION_TIMEOUT', 600))
+faq_stats = DeflectionStats(redis_client)
+
+def build_faq_menus(index):
+    """Собирает меню FAQ: список тем и вопросы каждой темы"""
+    menu_registry.menu('questions', 'Выберите тему вопроса:', [
+        (topic, f'faq_topic_{topic}') for topic in index.topics
+    ])
+    for topic, items in index.topics.items():
+        menu_registry.menu(f'faq_topic_{topic}', f"Вопросы по теме '{topic}':", [
+            (item['question'], f"faq_item_{item['faq_id']}") for item in items
+        ], back='questions', nav_in_row=True, back_text='🔙 Назад к темам')
+        for item in items:
+            menu_registry.keyboard(f"faq_item_{item['faq_id']}", [[
+                ('🔙 Назад к вопросам', f'faq_topic_{topic}'),
+                ('🏠 Главное меню', 'main_menu')
+            ]])
+
+def get_faq_index():
+    """FAQ из кэша (при промахе загружается из БД); None, если БД недоступна"""
+    def load():
+        index = FaqIndex(load_faq(get_db_connection))
+        build_faq_menus(index)
+        return index
 
-# Подключение к Redis
-redis_conn = redis.Redis(
-    host=os.getenv('REDIS_HOST', 'redis'),
-    port=6379,
-    db=0,
-    decode_responses=True
+    try:
+        return catalog_cache.get(('faq',), load)
+    except Exception as e:
+        logger.error(f"Ошибка загрузки FAQ: {e}")
+        return None
+
+# Профили и последняя активность пользователей (last_activity пишется пакетами)
+activity_tracker = ActivityTracker.from_env(db_pool, connect=get_db_connection)
+
+# Оценки пишутся в БД пакетами из фонового потока; после записи итоги перечитываются
+rating_writer = RatingWriter.from_env(
+    db_pool,
+    on_flush=lambda rows: invalidate_rating_aggregates({row[1] for row in rows})
 )
 
-def get_db_connection():
-    """Устанавливает соединение с PostgreSQL"""
-    return psycopg2.connect(
-        dbname=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        host=os.getenv('DB_HOST')
-    )
+# Листание каталога: 'keyset' - одна строка из БД на страницу, 'list' - весь список из кэша
+CATALOG_PAGING = os.getenv('CATALOG_PAGING', 'keyset')
 
 def save_user(telegram_id, username, full_name, position=None):
-    """Сохраняет пользователя в базу данных"""
+    """Отмечает визит пользователя (новые пользователи пишутся в базу сразу, остальное - пакетами)"""
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """INSERT INTO users (telegram_id, username, full_name, position)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (telegram_id) DO UPDATE
-                    SET username = EXCLUDED.username,
-                        full_name = EXCLUDED.full_name,
-                        position = COALESCE(users.position, EXCLUDED.position),
-                        last_activity = CURRENT_TIMESTAMP""",
-                    (telegram_id, username, full_name, position)
-                )
-                conn.commit()
+        activity_tracker.touch(telegram_id, username, full_name, position)
     except Exception as e:
         logger.error(f"Ошибка сохранения пользователя: {e}")
 
 def get_user_position(telegram_id):
     """Получает должность пользователя"""
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT position FROM users WHERE telegram_id = %s",
-                    (telegram_id,)
-                )
-                result = cur.fetchone()
-                return result[0] if result else None
+        return activity_tracker.get_position(telegram_id)
     except Exception as e:
         logger.error(f"Ошибка получения должности: {e}")
         return None
 
+# Фильтры каталога: категория -> (колонка, значение)
+COURSE_FILTERS = {
+    'finance': ('direction', 'finance'),
+    'management': ('direction', 'management'),
+    'pedagogy': ('direction', 'pedagogy'),
+    'pps': ('role', 'ППС'),
+    'aup': ('role', 'АУП'),
+    'guide': ('role', 'Руководство'),
+    'students': ('role', 'Студент'),
+    'open': ('access', 'open'),
+    'limited': ('access', 'limited')
+}
+
 def get_courses_by_category(category_name):
-    """Получает курсы по категории из базы данных"""
+    """Получает курсы по категории (из кэша каталога)"""
+    if category_name not in COURSE_FILTERS:
+        return []
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                # Определяем тип запроса в зависимости от категории
-                if category_name in ['finance', 'management', 'pedagogy']:
-                    cur.execute("""
-                        SELECT title, description, duration, price, url, access, 
-                               direction as category, direction
-                        FROM courses 
-                        WHERE direction = %s
-                        ORDER BY title
-                    """, (category_name,))
-                elif category_name in ['pps', 'aup', 'guide', 'students']:
-                    role_map = {
-                        'pps': 'ППС',
-                        'aup': 'АУП',
-                        'guide': 'Руководство',
-                        'students': 'Студент'
-                    }
-                    cur.execute("""
-                        SELECT title, description, duration, price, url, access, 
-                               role as category, direction
-                        FROM courses 
-                        WHERE role = %s
-                        ORDER BY title
-                    """, (role_map[category_name],))
-                elif category_name in ['open', 'limited']:
-                    cur.execute("""
-                        SELECT title, description, duration, price, url, access, 
-                               access as category, direction
-                        FROM courses 
-                        WHERE access = %s
-                        ORDER BY title
-                    """, (category_name,))
-                else:
-                    return []
-                
-                courses = cur.fetchall()
-                return [{
-                    'title': c[0],
-                    'description': c[1],
-                    'duration': c[2],
-                    'price': c[3],
-                    'url': c[4],
-                    'access': c[5],
-                    'category': c[6],
-                    'direction': c[7],
-                    'week': f"{c[2]} недель" if c[2] else "Не указано"
-                } for c in courses]
+        return catalog_cache.get(
+            ('category', category_name),
+            lambda: load_courses_by_category(category_name)
+        )
     except Exception as e:
         logger.error(f"Ошибка при получении курсов: {e}")
         return []
-         
-def get_all_courses():
-    """Получает все курсы"""
-    try:
+
+def load_courses_by_category(category_name):
+    """Загружает курсы по категории из базы данных"""
+    # Имя колонки берется только из COURSE_FILTERS, а не из пользовательского ввода
+    column, value = COURSE_FILTERS[category_name]
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT {COURSE_COLUMNS.format(column=column)}
+                FROM courses 
+                WHERE {column} = %s
+                ORDER BY title, course_id
+            """, (value,))
+            return [course_from_row(c) for c in cur.fetchall()]
+
+# Рекомендации опроса для всех комбинаций ответов; пересобираются при изменении каталога
+recommendation_index = RecommendationIndex(
+    survey_questions,
+    lambda: {role: get_courses_by_category(role) for role in ROLE_CATEGORIES.values()},
+    catalog_keys=[('category', role) for role in ROLE_CATEGORIES.values()]
+)
+catalog_cache.on_invalidate(recommendation_index.invalidate)
+
+# Колонки карточки курса (порядок соответствует course_from_row)
+COURSE_COLUMNS = """title, description, duration, price, url, access,
+                   {column} as category, direction, course_id"""
+
+def course_from_row(c):
+    """Преобразует строку запроса в словарь курса"""
+    return {
+        'title': c[0],
+        'description': c[1],
+        'duration': c[2],
+        'price': c[3],
+        'url': c[4],
+        'access': c[5],
+        'category': c[6],
+        'direction': c[7],
+        'course_id': c[8],
+        'week': f"{c[2]} недель" if c[2] else "Не указано"
+    }
+
+def count_courses_by_category(category_name):
+    """Количество курсов в категории (из кэша каталога)"""
+    column, value = COURSE_FILTERS[category_name]
+
+    def load():
         with get_db_connection() as conn:
             with conn.cursor() as cur:
+                cur.execute(f"SELECT count(*) FROM courses WHERE {column} = %s", (value,))
+                return cur.fetchone()[0]
+
+    return catalog_cache.get(('count', category_name), load)
+
+def fetch_course_page(category_name, course_index=0, anchor_id=None, step=0):
+    """Получает один курс категории: (курс, позиция, всего курсов) или None
+
+    Листание идет по ключу (title, course_id) от курса anchor_id на step (+1/-1),
+    поэтому за страницу читается одна строка по составному индексу из init_db.sql.
+    """
+    if category_name not in COURSE_FILTERS:
+        return None
+    total = count_courses_by_category(category_name)
+    if not total:
+        return None
+    course_index %= total
+    column, value = COURSE_FILTERS[category_name]
+    select = f"SELECT {COURSE_COLUMNS.format(column=column)} FROM courses WHERE {column} = %s"
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            row = None
+            if anchor_id is not None and step:
+                comparison, order = ('>', 'ASC') if step > 0 else ('<', 'DESC')
+                cur.execute(f"""
+                    {select}
+                      AND (title, course_id) {comparison}
+                          (SELECT title, course_id FROM courses WHERE course_id = %s)
+                    ORDER BY title {order}, course_id {order}
+                    LIMIT 1
+                """, (value, anchor_id))
+                row = cur.fetchone()
+                if row is None:
+                    # Дошли до края списка - циклический переход на другой конец
+                    cur.execute(f"{select} ORDER BY title {order}, course_id {order} LIMIT 1", (value,))
+                    row = cur.fetchone()
+            else:
                 cur.execute(
-                    """SELECT c.title, c.description, c.duration, c.price, c.url, cc.name as category
-                    FROM courses c
-                    JOIN course_categories cc ON c.category_id = cc.category_id
-                    ORDER BY c.title"""
+                    f"{select} ORDER BY title, course_id OFFSET %s LIMIT 1",
+                    (value, course_index)
                 )
-                return cur.fetchall()
-    except Exception as e:
-        logger.error(f"Ошибка получения всех курсов: {e}")
-        return []
+                row = cur.fetchone()
 
-def save_rating(user_id, rating_type, target, rating):
-    """Сохраняет оценку в базу"""
-    try:
+    if row is None:
+        return None
+    return course_from_row(row), course_index, total
+
+# Подборка курсов с лучшими оценками (листается как обычная категория)
+TOP_RATED = 'top'
+TOP_RATED_LIMIT = int(os.getenv('TOP_RATED_LIMIT', 20))
+
+def get_rating_aggregates(rating_type='course'):
+    """Итоги оценок по объектам: target -> (количество, сумма, гистограмма 1-5) (из кэша каталога)"""
+    def load():
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(
-                    """INSERT INTO ratings (user_id, rating_type, target, rating)
-                    VALUES (%s, %s, %s, %s)""",
-                    (user_id, rating_type, target, rating)
+                    """SELECT target, ratings_count, ratings_sum, histogram
+                    FROM rating_aggregates
+                    WHERE rating_type = %s""",
+                    (rating_type,)
                 )
-                conn.commit()
+                return {row[0]: (row[1], row[2], list(row[3])) for row in cur.fetchall()}
+
+    try:
+        return catalog_cache.get(('ratings', rating_type), load)
     except Exception as e:
-        logger.error(f"Ошибка сохранения оценки: {e}")
+        logger.error(f"Ошибка получения итогов оценок: {e}")
+        return {}
+
+def invalidate_rating_aggregates(rating_types):
+    """Сбрасывает итоги оценок в кэше после записи новых оценок"""
+    for rating_type in rating_types:
+        catalog_cache.invalidate(('ratings', rating_type))
+    if 'course' in rating_types:
+        catalog_cache.invalidate(('category', TOP_RATED))
+
+def format_rating(target, rating_type='course'):
+    """Средняя оценка для карточки: '4.6 (оценок: 12)'"""
+    aggregate = get_rating_aggregates(rating_type).get(target)
+    if not aggregate or not aggregate[0]:
+        return "пока нет оценок"
+    count, total, _ = aggregate
+    return f"{total / count:.1f} (оценок: {count})"
+
+def get_top_rated_courses():
+    """Курсы с лучшей средней оценкой (из кэша каталога)"""
+    def load():
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT {COURSE_COLUMNS.format(column='direction')}
+                    FROM courses
+                    JOIN rating_aggregates ON rating_type = 'course' AND target = title
+                    WHERE ratings_count > 0
+                    ORDER BY ratings_sum::float / ratings_count DESC, ratings_count DESC, title, course_id
+                    LIMIT %s
+                """, (TOP_RATED_LIMIT,))
+                return [course_from_row(c) for c in cur.fetchall()]
+
+    try:
+        return catalog_cache.get(('category', TOP_RATED), load)
+    except Exception as e:
+        logger.error(f"Ошибка получения лучших курсов: {e}")
+        return []
+
+# Поиск курсов (листается как обычная категория)
+SEARCH = 'search'
+SEARCH_LIMIT = int(os.getenv('SEARCH_LIMIT', 30))
+
+def search_courses(query, limit=SEARCH_LIMIT):
+    """Ищет курсы по названию и описанию: полнотекстово и с учетом опечаток в названии"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT {COURSE_COLUMNS.format(column='direction')},
+                       ts_rank(search_vector, ts_query) + word_similarity(%s, title) AS rank
+                FROM courses, websearch_to_tsquery('russian', %s) AS ts_query
+                WHERE search_vector @@ ts_query OR %s <%% title
+                ORDER BY rank DESC, title, course_id
+                LIMIT %s
+            """, (query, query, query, limit))
+            return [course_from_row(c) for c in cur.fetchall()]
+
+# Результаты поиска по запросу, общие для всех пользователей (LRU с TTL, сбрасываются вместе с каталогом)
+search_results = InlineResultCache(
+    search_courses,
+    max_entries=int(os.getenv('SEARCH_CACHE_SIZE', 1000)),
+    ttl=float(os.getenv('CATALOG_CACHE_TTL', 300))
+)
+catalog_cache.on_invalidate(search_results.invalidate)
+
+def user_search_query(user_id):
+    """Последний поисковый запрос пользователя"""
+    saved = user_search_results.get(user_id)
+    if isinstance(saved, dict):
+        # Сессии старого формата хранили запрос вместе с карточками курсов
+        return saved.get('query')
+    return saved
+
+def get_course_list(user_id, course_type):
+    """Список курсов для листания: результаты поиска, лучшие по оценкам или категория"""
+    if course_type == SEARCH:
+        query = user_search_query(user_id)
+        return list(search_results.get(query)) if query else []
+    if course_type == TOP_RATED:
+        return get_top_rated_courses()
+    return get_courses_by_category(course_type)
+
+def get_inline_courses(query):
+    """Курсы для inline-режима: результаты поиска или все курсы по направлениям"""
+    if query:
+        return search_courses(query, limit=INLINE_RESULTS_LIMIT)
+    courses = [c for direction in ('finance', 'management', 'pedagogy') for c in get_courses_by_category(direction)]
+    return sorted(courses, key=lambda c: (c['title'], c['course_id']))[:INLINE_RESULTS_LIMIT]
+
+def course_article(course):
+    """Карточка курса для отправки через inline-режим (сериализуется один раз)"""
+    text = f"""<b>{course['title']}</b>
+
+{course['description']}
+
+⏱ Длительность: {course.get('week', 'Не указано')}
+💵 Стоимость: {course['price']:,} руб.
+🔐 Доступность: {'Открытый' if course['access'] == 'open' else 'Закрытый'}"""
+    keyboard = None
+    if course.get('url'):
+        keyboard = types.InlineKeyboardMarkup()
+        keyboard.add(types.InlineKeyboardButton("🌐 Перейти на сайт курса", url=course['url']))
+
+    return PrebuiltMarkup(types.InlineQueryResultArticle(
+        id=str(course['course_id']),
+        title=course['title'],
+        description=f"{course.get('week', 'Не указано')} · {course['price']:,} руб.",
+        input_message_content=types.InputTextMessageContent(text, parse_mode='HTML'),
+        reply_markup=keyboard
+    ))
+
+# Inline-режим (@бот запрос): готовые карточки курсов по запросу, сбрасываются вместе с каталогом
+INLINE_RESULTS_LIMIT = int(os.getenv('INLINE_RESULTS_LIMIT', 200))
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', 300))
+inline_results = InlineResultCache(
+    lambda query: [course_article(c) for c in get_inline_courses(query)],
+    max_entries=int(os.getenv('INLINE_CACHE_SIZE', 1000)),
+    ttl=float(os.getenv('CATALOG_CACHE_TTL', 300))
+)
+catalog_cache.on_invalidate(inline_results.invalidate)
+
+# Рассылки кураторов и напоминания о старте курсов (идут через очередь исходящих с низким приоритетом)
+broadcast_engine = BroadcastEngine.from_env(
+    redis_conn,
+    db_pool,
+    send=lambda chat_id, text: api.bulk.submit('send_message', chat_id, text)
+)
+# Заявки в поддержку: хранятся в БД, распределяются между агентами (SUPPORT_AGENTS) через Redis
+support_desk = SupportDesk.from_env(
+    redis_client,
+    db_pool,
+    send=lambda chat_id, text, reply_markup=None: api.send_message(chat_id, text, reply_markup=reply_markup),
+    claim_data=lambda ticket_id: callback_codec.encode('support_claim', ticket_id=ticket_id),
+    default_agent=SUPPORT_CHAT_ID,
+    connect=get_db_connection
+)
+
+# За сколько дней до старта курсов (15 числа) напоминать всем пользователям; 0 - не напоминать
+COURSE_START_REMINDER_DAYS = int(os.getenv('COURSE_START_REMINDER_DAYS', 0))
+
+@broadcast_engine.add_planner
+def plan_course_start_reminder(engine):
+    """Создает напоминание о ближайшем старте курсов (одно на месяц для всех реплик)"""
+    if not COURSE_START_REMINDER_DAYS:
+        return
+    start = next_course_start()
+    run_at = start - timedelta(days=COURSE_START_REMINDER_DAYS) + timedelta(hours=10)
+    if run_at < datetime.now():
+        return
+    engine.create(
+        f"📅 Напоминаем: через {COURSE_START_REMINDER_DAYS} дн. ({start:%d.%m}) стартуют курсы. "
+        f"Выбрать курс можно в каталоге - напишите 'Привет'.",
+        run_at=run_at.timestamp(),
+        created_by='reminder',
+        job_id=f"reminder-{start:%Y-%m}"
+    )
+
+def parse_broadcast_command(text):
+    """Разбирает '/broadcast ключ=значение ...' и текст рассылки со следующей строки"""
+    first_line, _, body = text.partition('\n')
+    options = dict(token.split('=', 1) for token in first_line.split()[1:] if '=' in token)
+    run_at = None
+    if 'at' in options:
+        run_at = datetime.strptime(options.pop('at'), '%Y-%m-%dT%H:%M').timestamp()
+    return body.strip(), options, run_at
+
+# Профилирование обработки апдейтов по команде /profile или сигналу SIGUSR1
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 300))
+
+def send_profile_report(path, session, chat_id):
+    """Отправляет отчет профилирования файлом администратору или в чат поддержки"""
+    try:
+        with open(path, 'rb') as report:
+            # Ждем отправки, пока файл открыт: вызов из очереди исходящих выполняется позже
+            resolve(api.send_document(
+                chat_id or SUPPORT_CHAT_ID,
+                report,
+                caption=f"📊 Профиль: {session.mode}, апдейтов {session.updates}"
+            ))
+    except Exception as e:
+        logger.error(f"Не удалось отправить отчет профилирования: {e}")
+
+profiler = UpdateProfiler(
+    bot,
+    report_dir=os.getenv('PROFILE_DIR', 'profiles'),
+    handler_files=[__file__],
+    on_report=send_profile_report
+)
+
+def parse_profile_command(text):
+    """Разбирает '/profile [seconds=30] [updates=N] [mode=cprofile|sample] [memory=0]'"""
+    options = dict(token.split('=', 1) for token in text.split()[1:] if '=' in token)
+    unknown = set(options) - {'seconds', 'updates', 'mode', 'memory'}
+    if unknown:
+        raise ValueError(f"Неизвестные параметры: {', '.join(sorted(unknown))}")
+    mode = options.get('mode', CPROFILE)
+    if mode not in (CPROFILE, SAMPLE):
+        raise ValueError(f"Режим должен быть {CPROFILE} или {SAMPLE}")
+    return {
+        'seconds': min(float(options.get('seconds', 30)), PROFILE_MAX_SECONDS),
+        'max_updates': int(options['updates']) if 'updates' in options else None,
+        'mode': mode,
+        'memory': options.get('memory', '1') != '0'
+    }
+
+def get_all_courses():
+    """Получает все курсы (из кэша каталога)"""
+    try:
+        return catalog_cache.get('all', load_all_courses)
+    except Exception as e:
+        logger.error(f"Ошибка получения всех курсов: {e}")
+        return []
+
+def load_all_courses():
+    """Загружает все курсы из базы данных"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT c.title, c.description, c.duration, c.price, c.url, cc.name as category
+                FROM courses c
+                JOIN course_categories cc ON c.category_id = cc.category_id
+                ORDER BY c.title"""
+            )
+            return cur.fetchall()
+
+def save_rating(user_id, rating_type, target, rating):
+    """Сохраняет оценку в базу (пакетами, через очередь записи)"""
+    rating_writer.submit(user_id, rating_type, target, rating)
 
 def filter_courses_by_direction(direction):
     """Фильтрует курсы по направлению"""
@@ -295,462 +772,266 @@ def filter_courses_by_access(access):
         return []
 def show_main_menu(user_id, edit_message_id=None):
     """Показывает главное меню с кнопками в столбик"""
-    keyboard = types.InlineKeyboardMarkup()
-    
-    # Добавляем все кнопки по одной в столбик
-    keyboard.add(types.InlineKeyboardButton('Каталог курсов', callback_data='catalog'))
-    keyboard.add(types.InlineKeyboardButton('Частные вопросы', callback_data='questions'))
-    keyboard.add(types.InlineKeyboardButton('Подобрать курс', callback_data='courses'))
-    keyboard.add(types.InlineKeyboardButton('Обратная связь', callback_data='feedback'))
-    
-    try:
-        if edit_message_id:
-            msg = bot.edit_message_text(
-                chat_id=user_id,
-                message_id=edit_message_id,
-                text='Выберите, что Вам нужно:',
-                reply_markup=keyboard
-            )
-        else:
-            msg = bot.send_message(
-                user_id,
-                text='Выберите, что Вам нужно:',
-                reply_markup=keyboard
-            )
-        user_menu_messages[user_id] = msg.message_id
-    except Exception as e:
-        logger.error(f"Ошибка отображения главного меню: {e}")
-        
-def show_direction_menu(user_id, edit_message_id=None):
-    """Показывает меню выбора направления (в столбик)"""
-    keyboard = types.InlineKeyboardMarkup()
-    
-    # Кнопки направлений (каждая в отдельный ряд)
-    keyboard.add(types.InlineKeyboardButton('Финансы', callback_data='finance'))
-    keyboard.add(types.InlineKeyboardButton('Управление', callback_data='management'))
-    keyboard.add(types.InlineKeyboardButton('Педагогика', callback_data='pedagogy'))
-    
-    # Кнопки навигации
-    keyboard.add(types.InlineKeyboardButton('🔙 Назад', callback_data='catalog'))
-    keyboard.add(types.InlineKeyboardButton('🏠 Главное меню', callback_data='main_menu'))
-    
-    send_or_edit_message(
-        user_id=user_id,
-        text="Выберите направление обучения:",
-        reply_markup=keyboard,
-        edit_message_id=edit_message_id
-    )
+    show_menu(user_id, 'main_menu', edit_message_id)
 
-def show_post_menu(user_id, edit_message_id=None):
-    """Показывает меню выбора должности (в столбик)"""
-    keyboard = types.InlineKeyboardMarkup()
-    
-    # Кнопки должностей (каждая в отдельный ряд)
-    keyboard.add(types.InlineKeyboardButton('ППС', callback_data='pps'))
-    keyboard.add(types.InlineKeyboardButton('АУП', callback_data='aup'))
-    keyboard.add(types.InlineKeyboardButton('Руководство', callback_data='guide'))
-    keyboard.add(types.InlineKeyboardButton('Студенты', callback_data='students'))
-    
-    # Кнопки навигации
-    keyboard.add(types.InlineKeyboardButton('🔙 Назад', callback_data='catalog'))
-    keyboard.add(types.InlineKeyboardButton('🏠 Главное меню', callback_data='main_menu'))
-    
+def show_menu(user_id, key, edit_message_id=None):
+    """Показывает меню из реестра (отправляет новое сообщение или редактирует старое)"""
+    menu = menu_registry.get(key)
     send_or_edit_message(
         user_id=user_id,
-        text="Выберите вашу должность:",
-        reply_markup=keyboard,
+        text=menu.text,
+        reply_markup=menu.markup,
         edit_message_id=edit_message_id
     )
 
-def send_or_edit_message(user_id, text, reply_markup, edit_message_id=None):
-    """Универсальная функция для отправки/редактирования сообщения"""
-    try:
-        if edit_message_id:
-            msg = bot.edit_message_text(
+def edit_or_send(user_id, text, reply_markup=None, edit_message_id=None, **kwargs):
+    """Редактирует сообщение edit_message_id или отправляет новое; возвращает id сообщения с текстом
+
+    Вызовы из очереди исходящих не бросают исключений сразу, поэтому результат
+    редактирования дожидаемся: если сообщение уже нельзя изменить (удалено или
+    слишком старое), пользователь получает новое сообщение, а не тишину.
+    """
+    if edit_message_id:
+        try:
+            resolve(api.edit_message_text(
                 chat_id=user_id,
                 message_id=edit_message_id,
                 text=text,
-                reply_markup=reply_markup
-            )
-        else:
-            msg = bot.send_message(
-                user_id,
-                text=text,
-                reply_markup=reply_markup
-            )
-        user_menu_messages[user_id] = msg.message_id
+                reply_markup=reply_markup,
+                **kwargs
+            ))
+            return edit_message_id
+        except Exception as e:
+            if 'message is not modified' in str(e):
+                # Повторное нажатие той же кнопки: на экране уже нужный текст
+                return edit_message_id
+            logger.warning(f"Не удалось изменить сообщение {edit_message_id}, отправляем новое: {e}")
+    return api.send_message(user_id, text=text, reply_markup=reply_markup, **kwargs).message_id
+
+def send_or_edit_message(user_id, text, reply_markup, edit_message_id=None, **kwargs):
+    """Универсальная функция для отправки/редактирования сообщения"""
+    try:
+        user_menu_messages[user_id] = edit_or_send(user_id, text, reply_markup, edit_message_id, **kwargs)
     except Exception as e:
         logger.error(f"Ошибка при отправке сообщения: {str(e)}")
-def show_course(user_id, course_type, course_index=0, edit_message_id=None):
-    """Показывает курс с возможностью листания"""
-    try:
-        # Получаем курсы по типу (направление/должность/доступность)
-        courses = get_courses_by_category(course_type)
-        
-        if not courses:
-            bot.send_message(user_id, "😕 Курсы не найдены")
-            return
-
-        # Обеспечиваем корректный индекс (циклическая навигация)
-        course_index = course_index % len(courses)
-        course = courses[course_index]
-
-        # Сохраняем текущую позицию для навигации
-        if 'regular' not in user_course_positions:
-            user_course_positions['regular'] = {}
-        user_course_positions['regular'][user_id] = {
-            'courses': courses,
-            'position': course_index,
-            'filter_value': course_type
-        }
-
-        # Формируем текст сообщения
-        message_text = f"""<b>{course['title']}</b>
+# Компактная callback_data: состояние листания и опроса хранится в самой кнопке,
+# поэтому навигация работает после перезапуска и на любой реплике бота
+callback_codec = CallbackCodec(version=1)
+COURSE_LISTS = Choice(list(COURSE_FILTERS) + [TOP_RATED, SEARCH])
+callback_codec.register('course_prev', 'cp', filter=COURSE_LISTS, position=Int(), course_id=Int())
+callback_codec.register('course_next', 'cn', filter=COURSE_LISTS, position=Int(), course_id=Int())
+callback_codec.register('survey', 's', answers=Digits())
+callback_codec.register('recommended', 'r', answers=Digits(), position=Int())
+callback_codec.register('support_claim', 'tc', ticket_id=Int())
+STALE_BUTTON = "🌀 Кнопка устарела, откройте меню заново"
+
+def render_course_card(course, course_type, course_index, total_courses):
+    """Текст и клавиатура карточки курса в каталоге"""
+    # Формируем текст сообщения
+    message_text = f"""<b>{course['title']}</b>
 
 {course['description']}
 
 📌 Категория: {course.get('category', 'Не указано')}
 ⏱ Длительность: {course.get('week', 'Не указано')}
 💵 Стоимость: {course['price']:,} руб.
-🔐 Доступность: {'Открытый' if course['access'] == 'open' else 'Закрытый'}"""
-
-        # Создаем клавиатуру с кнопками навигации
-        keyboard = types.InlineKeyboardMarkup()
-        
-        # Добавляем кнопки навигации только если курсов больше одного
-        if len(courses) > 1:
-            keyboard.row(
-                types.InlineKeyboardButton("⬅️", callback_data=f'course_prev_{course_type}_{course_index}'),
-                types.InlineKeyboardButton(f"{course_index + 1}/{len(courses)}", callback_data='none'),
-                types.InlineKeyboardButton("➡️", callback_data=f'course_next_{course_type}_{course_index}')
-            )
+🔐 Доступность: {'Открытый' if course['access'] == 'open' else 'Закрытый'}
+⭐ Оценка: {format_rating(course['title'])}"""
 
-        # Добавляем кнопку для перехода на сайт курса (если есть URL)
-        if course.get('url'):
-            keyboard.add(types.InlineKeyboardButton("🌐 Перейти на сайт курса", url=course['url']))
-
-        # Определяем действие для кнопки "Назад"
-        back_action = {
-            'finance': 'direction',
-            'management': 'direction',
-            'pedagogy': 'direction',
-            'pps': 'post',
-            'aup': 'post',
-            'guide': 'post',
-            'students': 'post',
-            'open': 'availability',
-            'limited': 'availability'
-        }.get(course_type, 'catalog')
-
-        # Добавляем кнопки навигации
+    # Создаем клавиатуру с кнопками навигации
+    keyboard = types.InlineKeyboardMarkup()
+    
+    # Добавляем кнопки навигации только если курсов больше одного
+    if total_courses > 1:
         keyboard.row(
-            types.InlineKeyboardButton("🔙 Назад", callback_data=back_action),
-            types.InlineKeyboardButton("🏠 Главное меню", callback_data='main_menu')
+            types.InlineKeyboardButton("⬅️", callback_data=callback_codec.encode(
+                'course_prev', filter=course_type, position=course_index, course_id=course['course_id']
+            )),
+            types.InlineKeyboardButton(f"{course_index + 1}/{total_courses}", callback_data='none'),
+            types.InlineKeyboardButton("➡️", callback_data=callback_codec.encode(
+                'course_next', filter=course_type, position=course_index, course_id=course['course_id']
+            ))
         )
 
-        # Отправляем или редактируем сообщение
-        if edit_message_id:
-            bot.edit_message_text(
-                chat_id=user_id,
-                message_id=edit_message_id,
-                text=message_text,
-                reply_markup=keyboard,
-                parse_mode='HTML'
-            )
-        else:
-            msg = bot.send_message(
-                user_id,
-                text=message_text,
-                reply_markup=keyboard,
-                parse_mode='HTML'
-            )
-            user_menu_messages[user_id] = msg.message_id
-
-    except Exception as e:
-        logger.error(f"Ошибка при показе курса: {e}")
-        bot.send_message(user_id, "⚠️ Произошла ошибка при загрузке курса")
+    # Добавляем кнопку для перехода на сайт курса (если есть URL)
+    if course.get('url'):
+        keyboard.add(types.InlineKeyboardButton("🌐 Перейти на сайт курса", url=course['url']))
 
-def show_availability_menu(user_id, edit_message_id=None):
-    """Показывает меню выбора доступности (в столбик)"""
-    keyboard = types.InlineKeyboardMarkup()
-    
-    # Кнопки доступности
-    keyboard.add(types.InlineKeyboardButton('Открытые программы', callback_data='open'))
-    keyboard.add(types.InlineKeyboardButton('Ограниченные программы', callback_data='limited'))
-    
-    # Кнопки навигации
-    keyboard.add(types.InlineKeyboardButton('🔙 Назад', callback_data='catalog'))
-    keyboard.add(types.InlineKeyboardButton('🏠 Главное меню', callback_data='main_menu'))
-    
-    send_or_edit_message(
-        user_id=user_id,
-        text="Программы какой доступности вас интересуют?",
-        reply_markup=keyboard,
-        edit_message_id=edit_message_id
+    # Определяем действие для кнопки "Назад"
+    back_action = {
+        'finance': 'direction',
+        'management': 'direction',
+        'pedagogy': 'direction',
+        'pps': 'post',
+        'aup': 'post',
+        'guide': 'post',
+        'students': 'post',
+        'open': 'availability',
+        'limited': 'availability',
+        SEARCH: 'main_menu'
+    }.get(course_type, 'catalog')
+
+    # Добавляем кнопки навигации
+    keyboard.row(
+        types.InlineKeyboardButton("🔙 Назад", callback_data=back_action),
+        types.InlineKeyboardButton("🏠 Главное меню", callback_data='main_menu')
     )
 
-def show_faq_topics(user_id, edit_message_id=None):
-    """Показывает темы FAQ"""
-    keyboard = types.InlineKeyboardMarkup()
-    
-    # Добавляем кнопки для каждой темы FAQ
-    for topic in faq_data.keys():
-        keyboard.add(types.InlineKeyboardButton(text=topic, callback_data=f'faq_topic_{topic}'))
-    
-    keyboard.add(types.InlineKeyboardButton(text="🏠 Главное меню", callback_data='main_menu'))
+    return message_text, keyboard
 
+def show_course(user_id, course_type, course_index=0, edit_message_id=None, anchor_id=None, step=0):
+    """Показывает курс с возможностью листания"""
     try:
-        if edit_message_id:
-            bot.edit_message_text(
-                chat_id=user_id,
-                message_id=edit_message_id,
-                text="Выберите тему вопроса:",
-                reply_markup=keyboard
-            )
+        # Получаем курс по типу (направление/должность/доступность)
+        if CATALOG_PAGING == 'keyset' and course_type in COURSE_FILTERS:
+            page = fetch_course_page(course_type, course_index, anchor_id, step)
         else:
-            msg = bot.send_message(
-                user_id,
-                text="Выберите тему вопроса:",
-                reply_markup=keyboard
-            )
-            user_menu_messages[user_id] = msg.message_id
+            courses = get_course_list(user_id, course_type)
+            page = (courses[course_index % len(courses)], course_index % len(courses), len(courses)) if courses else None
+
+        if not page:
+            api.send_message(user_id, "😕 Курсы не найдены")
+            return
+        course, course_index, total_courses = page
+
+        # Сохраняем текущую позицию для навигации
+        nav_state = NavState(course_type, course_index, course['course_id'], edit_message_id)
+        user_course_positions['regular'].set(user_id, nav_state)
+
+        message_text, keyboard = render_course_card(course, course_type, course_index, total_courses)
+
+        # Отправляем или редактируем сообщение (если изменить не удалось - придет новое)
+        message_id = edit_or_send(user_id, message_text, keyboard, edit_message_id, parse_mode='HTML')
+        if message_id != edit_message_id:
+            user_menu_messages[user_id] = message_id
+            nav_state.message_id = message_id
+            user_course_positions['regular'].set(user_id, nav_state)
+
     except Exception as e:
-        logger.error(f"Ошибка при отображении тем FAQ: {e}")
+        logger.error(f"Ошибка при показе курса: {e}")
+        api.send_message(user_id, "⚠️ Произошла ошибка при загрузке курса")
+
+def show_faq_topics(user_id, edit_message_id=None):
+    """Показывает темы FAQ"""
+    if get_faq_index() is None:
+        api.send_message(user_id, "⚠️ Частые вопросы временно недоступны")
+        return
+    show_menu(user_id, 'questions', edit_message_id)
 
 def show_faq_questions(user_id, topic, edit_message_id=None):
     """Показывает вопросы по выбранной теме"""
-    if topic not in faq_data:
-        bot.send_message(user_id, "❌ Тема не найдена")
+    index = get_faq_index()
+    if index is None or topic not in index.topics:
+        api.send_message(user_id, "❌ Тема не найдена")
         return
-    
-    keyboard = types.InlineKeyboardMarkup()
-    
-    # Добавляем кнопки для каждого вопроса в теме
-    for i, item in enumerate(faq_data[topic]):
-        keyboard.add(types.InlineKeyboardButton(
-            text=item["question"],
-            callback_data=f'faq_item_{topic}_{i}'
-        ))
-    
-    # Кнопки навигации
-    keyboard.row(
-        types.InlineKeyboardButton(text="🔙 Назад к темам", callback_data='questions'),
-        types.InlineKeyboardButton(text="🏠 Главное меню", callback_data='main_menu')
-    )
 
-    try:
-        if edit_message_id:
-            bot.edit_message_text(
-                chat_id=user_id,
-                message_id=edit_message_id,
-                text=f"Вопросы по теме '{topic}':",
-                reply_markup=keyboard
-            )
-        else:
-            msg = bot.send_message(
-                user_id,
-                text=f"Вопросы по теме '{topic}':",
-                reply_markup=keyboard
-            )
-            user_menu_messages[user_id] = msg.message_id
-    except Exception as e:
-        logger.error(f"Ошибка при отображении вопросов FAQ: {e}")
+    show_menu(user_id, f'faq_topic_{topic}', edit_message_id)
 
-def show_faq_answer(user_id, topic, question_index, edit_message_id=None):
+def show_faq_answer(user_id, faq_id, edit_message_id=None):
     """Показывает ответ на выбранный вопрос"""
-    try:
-        question_data = faq_data[topic][question_index]
-    except (KeyError, IndexError):
-        bot.send_message(user_id, "❌ Вопрос не найден")
+    index = get_faq_index()
+    question_data = index.by_id.get(faq_id) if index is not None else None
+    if question_data is None:
+        api.send_message(user_id, "❌ Вопрос не найден")
         return
     
-    keyboard = types.InlineKeyboardMarkup()
-    keyboard.row(
-        types.InlineKeyboardButton(text="🔙 Назад к вопросам", callback_data=f'faq_topic_{topic}'),
-        types.InlineKeyboardButton(text="🏠 Главное меню", callback_data='main_menu')
-    )
+    keyboard = menu_registry.get_keyboard(f'faq_item_{faq_id}')
 
     answer_text = f"<b>Вопрос:</b> {question_data['question']}\n\n<b>Ответ:</b> {question_data['answer']}"
 
     try:
-        if edit_message_id:
-            bot.edit_message_text(
-                chat_id=user_id,
-                message_id=edit_message_id,
-                text=answer_text,
-                reply_markup=keyboard,
-                parse_mode='HTML'
-            )
-        else:
-            msg = bot.send_message(
-                user_id,
-                text=answer_text,
-                reply_markup=keyboard,
-                parse_mode='HTML'
-            )
-            user_menu_messages[user_id] = msg.message_id
+        message_id = edit_or_send(user_id, answer_text, keyboard, edit_message_id, parse_mode='HTML')
+        if message_id != edit_message_id:
+            user_menu_messages[user_id] = message_id
     except Exception as e:
         logger.error(f"Ошибка при отображении ответа FAQ: {e}")
 
 def start_course_survey(user_id):
     """Начинает опрос для подбора курса"""
-    user_survey_state[user_id] = {
-        'current_question': 0,
-        'answers': {},
-        'message_id': None
+    ask_survey_question(user_id, ())
+
+def survey_answers(indices):
+    """Ответы опроса по номерам вариантов из callback_data: {ключ вопроса: вариант}"""
+    if len(indices) > len(survey_questions):
+        raise ValueError(f"Ответов больше, чем вопросов: {len(indices)}")
+    return {
+        question['key']: question['options'][index]
+        for question, index in zip(survey_questions, indices)
     }
-    ask_survey_question(user_id)
-
-def ask_survey_question(user_id):
-    """Задает вопрос из опроса"""
-    state = user_survey_state.get(user_id)
-    if not state or state['current_question'] >= len(survey_questions):
-        return
 
-    question_data = survey_questions[state['current_question']]
+def ask_survey_question(user_id, answers, edit_message_id=None):
+    """Задает следующий вопрос опроса; answers - номера уже выбранных вариантов"""
+    question_index = len(answers)
+    question_data = survey_questions[question_index]
     keyboard = types.InlineKeyboardMarkup()
 
-    for option in question_data['options']:
-        clean_option = option.replace(' ', '_').replace(',', '')
-        callback_data = f"survey_{state['current_question']}_{clean_option}"
+    # Ответы едут в самой кнопке: сессия для опроса не нужна
+    for option_index, option in enumerate(question_data['options']):
+        callback_data = callback_codec.encode('survey', answers=answers + (option_index,))
         keyboard.add(types.InlineKeyboardButton(text=option, callback_data=callback_data))
 
     row_buttons = []
-    if state['current_question'] > 0:
-        row_buttons.append(types.InlineKeyboardButton(text="🔙 Назад", callback_data="survey_back"))
+    if question_index > 0:
+        row_buttons.append(types.InlineKeyboardButton(
+            text="🔙 Назад", callback_data=callback_codec.encode('survey', answers=answers[:-1])
+        ))
     row_buttons.append(types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="survey_main_menu"))
     keyboard.row(*row_buttons)
 
     try:
-        if state['message_id']:
-            msg = bot.edit_message_text(
-                chat_id=user_id,
-                message_id=state['message_id'],
-                text=question_data['question'],
-                reply_markup=keyboard
-            )
-        else:
-            msg = bot.send_message(user_id, question_data['question'], reply_markup=keyboard)
-            state['message_id'] = msg.message_id
+        edit_or_send(user_id, question_data['question'], keyboard, edit_message_id)
     except Exception as e:
         logger.error(f"Ошибка при отправке вопроса: {e}")
 
-def process_survey_answer(user_id, question_index, answer):
-    """Обрабатывает ответ на вопрос опроса"""
-    state = user_survey_state.get(user_id)
-    if not state:
+def process_survey_answer(user_id, answers, message_id):
+    """Обрабатывает ответ на вопрос опроса: следующий вопрос или подбор курсов"""
+    if len(answers) < len(survey_questions):
+        ask_survey_question(user_id, answers, message_id)
         return
 
-    question_data = survey_questions[question_index]
-    state['answers'][question_data['key']] = answer
-    state['current_question'] += 1
+    try:
+        api.delete_message(user_id, message_id)
+    except:
+        pass
 
-    if state['current_question'] < len(survey_questions):
-        ask_survey_question(user_id)
+    # Подбор курсов по предрасчитанному индексу
+    if recommendation_index.recommend(survey_answers(answers)):
+        show_recommended_course(user_id, answers, course_index=0)
     else:
-        try:
-            bot.delete_message(user_id, state['message_id'])
-        except:
-            pass
-
-        # Фильтрация курсов
-        filtered_courses = []
-
-        # Фильтр по роли
-        role_map = {
-            'Студент': 'students',
-            'АУП': 'aup',
-            'Руководство': 'guide',
-            'ППС': 'pps'
-        }
-        role = role_map.get(state['answers'].get('role'))
-        if role:
-            role_courses = get_courses_by_category(role)
-            filtered_courses.extend(role_courses)
-
-        # Фильтр по направлению (если выбрано)
-        selected_direction = state['answers'].get('direction')
-        if selected_direction:
-            # Преобразование выбранного направления в ключ курса
-            direction_mapping = {
-                'Финансы': 'finance',
-                'Управление': 'management',
-                'Педагогика': 'pedagogy'
-            }
-            target_direction = direction_mapping.get(selected_direction)
-            # Фильтрация по полю direction в курсах
-            filtered_courses = [c for c in filtered_courses if c.get('direction') == target_direction]
-
-        # Фильтр по бюджету
-        budget_filter = {
-            'До 10 000 руб.': lambda x: x <= 10000,
-            '10-20 000 руб.': lambda x: 10000 < x <= 20000,
-            'Более 20 000 руб.': lambda x: x > 20000
-        }
-        budget_func = budget_filter.get(state['answers'].get('budget'), lambda x: True)
-        filtered_courses = [c for c in filtered_courses if budget_func(c['price'])]
-
-        # Фильтр по длительности
-        duration_preference = state['answers'].get('time')
-        duration_filter = {
-            '1-4 недели': lambda x: x <= 4,
-            '5-8 недель': lambda x: 5 <= x <= 8,
-            'Более 8 недель': lambda x: x > 8
-        }.get(duration_preference, lambda x: True)
-        filtered_courses = [c for c in filtered_courses if duration_filter(c['duration'])]
-
-        # Удаление дубликатов
-        seen = set()
-        unique_courses = []
-        for c in filtered_courses:
-            if c['title'] not in seen:
-                seen.add(c['title'])
-                unique_courses.append(c)
-
-        # Сохраняем рекомендации
-        user_course_positions['recommended'][user_id] = {
-            'courses': unique_courses,
-            'position': 0,
-            'saved_answers': state['answers'].copy(),
-            'saved_question': len(survey_questions) - 1
-        }
-
-        if unique_courses:
-            show_recommended_course(user_id, course_index=0)
-        else:
-            bot.send_message(user_id, "😕 По вашим критериям не найдено подходящих курсов")
-            show_main_menu(user_id)
-
-        del user_survey_state[user_id]
-
-def show_recommended_course(user_id, course_index, edit_message_id=None):
-    """Показывает рекомендованный курс"""
-    if user_id not in user_course_positions['recommended']:
-        return
+        api.send_message(user_id, "😕 По вашим критериям не найдено подходящих курсов")
+        show_main_menu(user_id)
 
-    current_state = user_course_positions['recommended'][user_id]
-    courses = current_state['courses']
+def show_recommended_course(user_id, answers, course_index, edit_message_id=None):
+    """Показывает рекомендованный курс; answers - номера вариантов ответов опроса"""
+    courses = recommendation_index.recommend(survey_answers(answers))
     total_courses = len(courses)
+    if not total_courses:
+        return
 
     # Обеспечиваем циклическую навигацию
     course_index = course_index % total_courses
-    current_state['position'] = course_index
     course = courses[course_index]
 
     keyboard = types.InlineKeyboardMarkup()
 
     if total_courses > 1:
         keyboard.row(
-            types.InlineKeyboardButton("⬅️", callback_data='recommended_prev'),
+            types.InlineKeyboardButton("⬅️", callback_data=callback_codec.encode(
+                'recommended', answers=answers, position=(course_index - 1) % total_courses
+            )),
             types.InlineKeyboardButton(f"{course_index + 1}/{total_courses}", callback_data='none'),
-            types.InlineKeyboardButton("➡️", callback_data='recommended_next')
+            types.InlineKeyboardButton("➡️", callback_data=callback_codec.encode(
+                'recommended', answers=answers, position=(course_index + 1) % total_courses
+            ))
         )
 
     if course.get('url'):
         keyboard.add(types.InlineKeyboardButton("🌐 Перейти на сайт курса", url=course['url']))
 
-    # Кнопки навигации (в столбик)
-    keyboard.add(types.InlineKeyboardButton("🔙 Назад к опросу", callback_data='recommended_back'))
+    # Кнопки навигации (в столбик); "Назад к опросу" - последний вопрос с прежними ответами
+    keyboard.add(types.InlineKeyboardButton(
+        "🔙 Назад к опросу", callback_data=callback_codec.encode('survey', answers=answers[:-1])
+    ))
     keyboard.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data='main_menu'))
 
     message_text = f"""🎉 <b>Рекомендованный курс</b> 🎉
@@ -760,25 +1041,11 @@ def show_recommended_course(user_id, course_index, edit_message_id=None):
 
 ⏱ Длительность: {course.get('week', 'Не указано')}
 💵 Стоимость: {course.get('price', 0):,} руб.
-🔐 Доступность: {'Открытый' if course.get('access') == 'open' else 'Закрытый'}"""
+🔐 Доступность: {'Открытый' if course.get('access') == 'open' else 'Закрытый'}
+⭐ Оценка: {format_rating(course['title'])}"""
 
     try:
-        if edit_message_id:
-            msg = bot.edit_message_text(
-                chat_id=user_id,
-                message_id=edit_message_id,
-                text=message_text,
-                reply_markup=keyboard,
-                parse_mode='HTML'
-            )
-        else:
-            msg = bot.send_message(
-                user_id,
-                text=message_text,
-                reply_markup=keyboard,
-                parse_mode='HTML'
-            )
-            current_state['message_id'] = msg.message_id
+        edit_or_send(user_id, message_text, keyboard, edit_message_id, parse_mode='HTML')
     except Exception as e:
         logger.error(f"Ошибка при отображении курса: {e}")
 
@@ -787,165 +1054,223 @@ def send_welcome(message):
     """Обработчик команды /start"""
     user = message.from_user
     save_user(user.id, user.username, f"{user.first_name} {user.last_name or ''}")
-    bot.send_message(message.chat.id, "Напишите 'Привет' для начала работы с ботом")
+    api.send_message(message.chat.id, "Напишите 'Привет' для начала работы с ботом")
+
+@bot.message_handler(commands=['search'])
+def handle_search_command(message):
+    """Обработчик команды /search <запрос>"""
+    query = message.text.partition(' ')[2].strip()
+    if not query:
+        users_waiting_for_search[message.chat.id] = True
+        api.send_message(message.chat.id, "🔎 Напишите название или тему курса")
+        return
+    run_search(message.chat.id, query)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('course_prev_'))
-def handle_course_prev(call):
-    """Обрабатывает кнопку 'Назад' в листании курсов"""
+@bot.message_handler(commands=['broadcast', 'broadcasts', 'broadcast_cancel'],
+                     func=lambda message: message.from_user.id in ADMIN_IDS)
+def handle_broadcast_command(message):
+    """Рассылки для администраторов: создание, список и отмена"""
+    chat_id = message.chat.id
+    command = message.text.split()[0].lstrip('/').split('@')[0]
     try:
-        parts = call.data.split('_')
-        if len(parts) >= 4:
-            course_type = parts[2]
-            current_index = int(parts[3])
-            show_course(call.from_user.id, course_type, current_index - 1, call.message.message_id)
+        if command == 'broadcasts':
+            jobs = broadcast_engine.jobs()
+            lines = [f"#{job['id']}: {job['status']}, отправлено {job['sent']}, "
+                     f"заблокировали {job['blocked']}, ошибок {job['failed']}" for job in jobs]
+            api.send_message(chat_id, '\n'.join(lines) or "Активных рассылок нет")
+        elif command == 'broadcast_cancel':
+            job_id = message.text.split()[1] if len(message.text.split()) > 1 else ''
+            cancelled = broadcast_engine.cancel(job_id)
+            api.send_message(chat_id, f"🛑 Рассылка #{job_id} отменена" if cancelled else "❌ Рассылка не найдена")
+        else:
+            text, filters, run_at = parse_broadcast_command(message.text)
+            if not text:
+                api.send_message(
+                    chat_id,
+                    "Формат: /broadcast [position=...] [direction=finance] [rated=course] [at=2026-09-12T10:00]\n"
+                    "Текст рассылки - со следующей строки"
+                )
+                return
+            job_id = broadcast_engine.create(text, filters, run_at=run_at, created_by=str(message.from_user.id))
+            api.send_message(chat_id, f"📣 Рассылка #{job_id} поставлена в очередь")
+    except ValueError as e:
+        api.send_message(chat_id, f"❌ {e}")
     except Exception as e:
-        logger.error(f"Ошибка в обработке course_prev: {e}")
-    finally:
-        bot.answer_callback_query(call.id)
+        logger.error(f"Ошибка команды рассылки: {e}")
+        api.send_message(chat_id, "⚠️ Не удалось выполнить команду")
 
-@bot.callback_query_handler(func=lambda call: call.data == 'catalog')
-def handle_catalog(call):
-    """Показывает меню каталога (в столбик)"""
-    keyboard = types.InlineKeyboardMarkup()
-    
-    # Кнопки фильтрации (каждая в отдельный ряд)
-    keyboard.add(types.InlineKeyboardButton('Направление обучения', callback_data='direction'))
-    keyboard.add(types.InlineKeyboardButton('Должность', callback_data='post'))
-    keyboard.add(types.InlineKeyboardButton('Доступность', callback_data='availability'))
-    
-    # Кнопка главного меню
-    keyboard.add(types.InlineKeyboardButton('🏠 Главное меню', callback_data='main_menu'))
-    
+@bot.message_handler(commands=['faq_stats'], func=lambda message: message.from_user.id in ADMIN_IDS)
+def handle_faq_stats_command(message):
+    """Сколько вопросов закрыли подсказки FAQ, а сколько ушло в поддержку"""
+    try:
+        stats = faq_stats.stats()
+    except Exception as e:
+        logger.error(f"Ошибка чтения статистики FAQ: {e}")
+        api.send_message(message.chat.id, "⚠️ Статистика недоступна")
+        return
+    api.send_message(
+        message.chat.id,
+        f"📊 Вопросов: {stats['questions']}\n"
+        f"С подсказками из FAQ: {stats['suggested']}\n"
+        f"Закрыто подсказкой: {stats['deflected']} ({stats['deflection_rate']:.0%} всех вопросов, "
+        f"{stats['suggestion_success']:.0%} подсказок)\n"
+        f"Отправлено в поддержку после подсказки: {stats['escalated']}\n"
+        f"Ушло в поддержку без ответа на подсказку: {stats['expired']}\n"
+        f"Без подходящих ответов: {stats['unmatched']}"
+    )
+
+@bot.message_handler(commands=['profile', 'profile_stop'],
+                     func=lambda message: message.from_user.id in ADMIN_IDS)
+def handle_profile_command(message):
+    """Профилирование для администраторов: запуск на N секунд / N апдейтов и досрочная остановка"""
+    chat_id = message.chat.id
+    if message.text.split()[0].lstrip('/').split('@')[0] == 'profile_stop':
+        if profiler.active:
+            profiler.stop()
+        else:
+            api.send_message(chat_id, "Профилирование не запущено")
+        return
     try:
-        bot.edit_message_text(
-            chat_id=call.from_user.id,
-            message_id=call.message.message_id,
-            text="Выберите критерий для подбора курсов:",
-            reply_markup=keyboard
+        options = parse_profile_command(message.text)
+    except ValueError as e:
+        api.send_message(chat_id, f"❌ {e}\nФормат: /profile [seconds=30] [updates=500] [mode=sample] [memory=0]")
+        return
+    if not profiler.start(reply_to=chat_id, **options):
+        api.send_message(chat_id, "Профилирование уже идет: /profile_stop - остановить")
+        return
+    limit = f"{options['seconds']:g} с" + (f" или {options['max_updates']} апдейтов" if options['max_updates'] else "")
+    api.send_message(chat_id, f"📊 Профилирование ({options['mode']}) запущено на {limit}, отчет придет файлом")
+
+@bot.inline_handler(func=lambda query: True)
+def handle_inline_query(inline_query):
+    """Отвечает на '@бот запрос' карточками курсов"""
+    try:
+        results, next_offset = inline_results.page(inline_query.query, inline_query.offset)
+    except Exception as e:
+        logger.error(f"Ошибка inline-запроса: {e}")
+        results, next_offset = [], ''
+
+    try:
+        # Результаты не зависят от пользователя: Telegram может отдавать их всем из своего кэша
+        api.answer_inline_query(
+            inline_query.id,
+            results,
+            cache_time=INLINE_CACHE_TIME,
+            is_personal=False,
+            next_offset=next_offset
         )
     except Exception as e:
-        logger.error(f"Ошибка отображения каталога: {e}")
-    finally:
-        bot.answer_callback_query(call.id)
-
-@bot.callback_query_handler(func=lambda call: call.data in ['direction', 'post', 'availability'])
-def handle_back_to_menus(call):
-    """Обрабатывает кнопки возврата в меню"""
-    if call.data == 'direction':
-        show_direction_menu(call.from_user.id, call.message.message_id)
-    elif call.data == 'post':
-        show_post_menu(call.from_user.id, call.message.message_id)
-    elif call.data == 'availability':
-        show_availability_menu(call.from_user.id, call.message.message_id)
-    bot.answer_callback_query(call.id)
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith('course_next_'))
-def handle_course_next(call):
-    """Обрабатывает кнопку 'Вперед' в листании курсов"""
+        logger.error(f"Ошибка ответа на inline-запрос: {e}")
+
+@bot.message_handler(func=lambda message: users_waiting_for_search.get(message.chat.id))
+def handle_search_input(message):
+    """Обрабатывает текст поискового запроса"""
+    users_waiting_for_search.pop(message.chat.id, None)
+    run_search(message.chat.id, (message.text or '').strip())
+
+def run_search(chat_id, query):
+    """Ищет курсы и показывает первый результат"""
+    if not query:
+        api.send_message(chat_id, "❗ Пустой запрос. Попробуйте /search финансы")
+        return
     try:
-        parts = call.data.split('_')
-        if len(parts) >= 4:
-            course_type = parts[2]
-            current_index = int(parts[3])
-            show_course(call.from_user.id, course_type, current_index + 1, call.message.message_id)
+        courses = search_results.get(query)
     except Exception as e:
-        logger.error(f"Ошибка в обработке course_next: {e}")
-    finally:
-        bot.answer_callback_query(call.id)
+        logger.error(f"Ошибка поиска курсов: {e}")
+        api.send_message(chat_id, "⚠️ Поиск временно недоступен")
+        return
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('faq_topic_'))
-def handle_faq_topic(call):
-    """Обрабатывает выбор темы FAQ"""
-    topic = call.data.split('_', 2)[2]  # Получаем тему из callback_data
-    show_faq_questions(call.from_user.id, topic, call.message.message_id)
-    bot.answer_callback_query(call.id)
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith('faq_item_'))
-def handle_faq_item(call):
-    """Обрабатывает выбор конкретного вопроса FAQ"""
-    parts = call.data.split('_')
-    if len(parts) == 4:  # faq_item_{topic}_{index}
-        topic = parts[2]
-        question_index = int(parts[3])
-        show_faq_answer(call.from_user.id, topic, question_index, call.message.message_id)
-    bot.answer_callback_query(call.id)
-
-@bot.callback_query_handler(func=lambda call: call.data == "questions")
-def handle_questions_callback(call):
-    """Обрабатывает нажатие на кнопку 'Частные вопросы'"""
-    show_faq_topics(call.from_user.id, call.message.message_id)
-    bot.answer_callback_query(call.id)
+    if not courses:
+        api.send_message(chat_id, f"😕 По запросу «{query}» ничего не найдено")
+        return
+    user_search_results[chat_id] = query
+    show_course(chat_id, SEARCH)
+
+def suggest_faq_answers(chat_id, text):
+    """Показывает подходящие ответы из FAQ; False, если подходящих нет"""
+    index = get_faq_index()
+    if index is None:
+        return False
+    matches = index.search(text, limit=FAQ_SUGGESTIONS, min_score=FAQ_MATCH_THRESHOLD)
+    if not matches:
+        return False
+    answers = '\n\n'.join(f"<b>{entry['question']}</b>\n{entry['answer']}" for score, entry in matches)
+    api.send_message(
+        chat_id,
+        f"🔎 Возможно, ответ на ваш вопрос уже есть:\n\n{answers}\n\n"
+        f"Если ответа здесь нет, вопрос уйдет в поддержку автоматически через "
+        f"{max(1, round(FAQ_ESCALATION_TIMEOUT / 60))} мин.",
+        reply_markup=menu_registry.get_keyboard('faq_suggestion'),
+        parse_mode='HTML'
+    )
+    return True
 
-@bot.callback_query_handler(func=lambda call: call.data == 'main_menu')
-def handle_main_menu(call):
-    """Обрабатывает кнопку 'Главное меню'"""
+def escalate_question(chat_id, username, text):
+    """Создает заявку в поддержку"""
     try:
-        # Очищаем состояние опроса, если есть
-        if call.from_user.id in user_survey_state:
-            del user_survey_state[call.from_user.id]
-        
-        # Очищаем состояние рекомендованных курсов
-        if call.from_user.id in user_course_positions['recommended']:
-            del user_course_positions['recommended'][call.from_user.id]
-        
-        show_main_menu(call.from_user.id)
+        ticket_id = support_desk.create_ticket(chat_id, username, text)
     except Exception as e:
-        logger.error(f"Ошибка обработки главного меню: {e}")
-    finally:
-        bot.answer_callback_query(call.id)
+        logger.error(f"Ошибка создания заявки в поддержку: {e}")
+        api.send_message(chat_id, "⚠️ Не удалось отправить вопрос. Пожалуйста, попробуйте позже.")
+        show_main_menu(chat_id)
+        return
+
+    api.send_message(chat_id, f"✅ Ваш вопрос #{ticket_id} отправлен. Спасибо! Мы скоро ответим вам.")
+    show_main_menu(chat_id)
+
+def escalate_expired_question(chat_id, username, text):
+    """Пользователь не ответил на подсказки FAQ: вопрос уходит в поддержку"""
+    faq_stats.record(EXPIRED)
+    escalate_question(chat_id, username, text)
+
+# Вопросы, на которые показаны подсказки из FAQ: хранятся в Redis до ответа на подсказку или до таймаута
+faq_pending = PendingQuestions(redis_client, escalate_expired_question, timeout=FAQ_ESCALATION_TIMEOUT)
 
 @bot.message_handler(func=lambda message: users_waiting_for_question.get(message.chat.id))
 def handle_user_question(message):
-    """Обрабатывает вопрос пользователя"""
+    """Обрабатывает вопрос пользователя: сначала подсказки из FAQ, без них - заявка в поддержку"""
     chat_id = message.chat.id
-    user_id = message.from_user.id
     text = message.text
 
     users_waiting_for_question.pop(chat_id, None)
+    # Пользователь не ответил на подсказку к прежнему вопросу: прежний уходит в поддержку
+    faq_pending.escalate_pending(chat_id)
+    faq_stats.record(QUESTION)
+
+    if suggest_faq_answers(chat_id, text):
+        # Вопрос ждет, пока пользователь не скажет, помогла ли подсказка (или до таймаута)
+        faq_pending.hold(chat_id, message.from_user.username, text)
+        faq_stats.record(SUGGESTED)
+        return
 
-    sent = bot.send_message(
-        SUPPORT_CHAT_ID,
-        f"📩 Новый вопрос от пользователя @{message.from_user.username or 'Без ника'} :\n\n{text}\n\n"
-        f"Ответьте на это сообщение для ответа пользователю."
-    )
-
-    pending_questions[sent.message_id] = {
-        "chat_id": chat_id,
-        "question_text": text
-    }
+    faq_stats.record(UNMATCHED)
+    escalate_question(chat_id, message.from_user.username, text)
 
-    bot.send_message(chat_id, "✅ Ваш вопрос отправлен. Спасибо! Мы скоро ответим вам.")
-    show_main_menu(chat_id)
+@bot.message_handler(func=lambda message: message.reply_to_message is not None and message.chat.id in support_desk.agents)
+def handle_support_response(message):
+    """Обрабатывает ответ поддержки: reply на сообщение с заявкой"""
+    chat_id = message.chat.id
+    ticket_id = support_desk.find_ticket(chat_id, message.reply_to_message.message_id)
+    if ticket_id is None:
+        api.send_message(chat_id, "❌ Не удалось определить заявку. Ответьте на сообщение с заявкой или нажмите «Взять».")
+        return
 
-@bot.callback_query_handler(func=lambda call: call.data == "courses")
-def handle_courses_callback(call):
-    """Обрабатывает нажатие на кнопку 'Подобрать курс'"""
-    start_course_survey(call.from_user.id)
+    ticket = support_desk.answer(ticket_id, message.from_user.id, message.text)
+    if ticket is None:
+        api.send_message(chat_id, f"ℹ️ На заявку #{ticket_id} уже ответили.")
+        return
 
-@bot.message_handler(func=lambda message: message.reply_to_message is not None and message.chat.id == SUPPORT_CHAT_ID)
-def handle_support_response(message):
-    """Обрабатывает ответ поддержки"""
-    reply_to = message.reply_to_message
-
-    if reply_to and reply_to.message_id in pending_questions:
-        user_data = pending_questions[reply_to.message_id]
-        user_chat_id = user_data["chat_id"]
-        original_question = user_data["question_text"]
-
-        # Отправляем ответ пользователю
-        bot.send_message(
-            user_chat_id,
-            f"🔔 Ответ от поддержки:\n\n<b>{message.text}</b>\n\n"
-            f"На ваш вопрос:\n<b>{original_question}</b>",
-            parse_mode="HTML"
-        )
+    # Отправляем ответ пользователю
+    api.send_message(
+        ticket['user_chat_id'],
+        f"🔔 Ответ от поддержки:\n\n<b>{message.text}</b>\n\n"
+        f"На ваш вопрос:\n<b>{ticket['question']}</b>",
+        parse_mode="HTML"
+    )
 
-        show_main_menu(user_chat_id)
+    show_main_menu(ticket['user_chat_id'])
 
-        bot.send_message(SUPPORT_CHAT_ID, "✅ Ответ отправлен пользователю.")
-        pending_questions.pop(reply_to.message_id, None)
-    else:
-        bot.send_message(SUPPORT_CHAT_ID, "❌ Не удалось определить пользователя для ответа.")
+    api.send_message(chat_id, f"✅ Ответ на заявку #{ticket_id} отправлен пользователю.")
 
 @bot.message_handler(func=lambda message: user_typing_teacher_name.get(message.chat.id))
 def handle_teacher_name_input(message):
@@ -954,23 +1279,15 @@ def handle_teacher_name_input(message):
     full_name = message.text.strip()
 
     if not full_name:
-        bot.send_message(chat_id, "❗ Пожалуйста, введите корректное имя.")
+        api.send_message(chat_id, "❗ Пожалуйста, введите корректное имя.")
         return
 
     user_selected_teacher_for_rating[chat_id] = full_name
     user_typing_teacher_name.pop(chat_id, None)
 
-    keyboard = types.InlineKeyboardMarkup()
-    keyboard.add(
-        types.InlineKeyboardButton(text="⭐ 1", callback_data="rating_teacher_1"),
-        types.InlineKeyboardButton(text="⭐ 2", callback_data="rating_teacher_2"),
-        types.InlineKeyboardButton(text="⭐ 3", callback_data="rating_teacher_3"),
-        types.InlineKeyboardButton(text="⭐ 4", callback_data="rating_teacher_4"),
-        types.InlineKeyboardButton(text="⭐ 5", callback_data="rating_teacher_5")
-    )
-    keyboard.add(types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu"))
+    keyboard = menu_registry.get_keyboard('rating_teacher')
 
-    bot.send_message(
+    api.send_message(
         chat_id,
         f"Теперь поставьте оценку преподавателю:\n<b>{full_name}</b>",
         reply_markup=keyboard,
@@ -983,377 +1300,503 @@ def get_text_messages(message):
     if message.text.lower() == "привет":
         user = message.from_user
         save_user(user.id, user.username, f"{user.first_name} {user.last_name or ''}")
-        bot.send_message(message.from_user.id, "Привет! Я Учёный помощник, помогу тебе разобраться с обучением.")
+        api.send_message(message.from_user.id, "Привет! Я Учёный помощник, помогу тебе разобраться с обучением.")
         show_main_menu(message.from_user.id)
     elif message.text == "/help":
-        bot.send_message(message.from_user.id, "Напиши Привет")
+        api.send_message(message.from_user.id, "Напиши Привет")
     else:
-        bot.send_message(message.from_user.id, "Привет! Я Учёный помощник, помогу тебе разобраться с обучением.")
+        api.send_message(message.from_user.id, "Привет! Я Учёный помощник, помогу тебе разобраться с обучением.")
         show_main_menu(message.from_user.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == 'none')
-def handle_none(call):
-    """Обрабатывает пустые callback'и"""
-    bot.answer_callback_query(call.id)
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith('recommended_'))
-def handle_recommended_navigation(call):
-    """Обрабатывает навигацию по рекомендованным курсам"""
-    user_id = call.from_user.id
-    if user_id not in user_course_positions['recommended']:
-        bot.answer_callback_query(call.id)
-        return
-
-    action = call.data.split('_')[1]
-    current_state = user_course_positions['recommended'][user_id]
-
-    if action == 'back':
-        # Восстанавливаем состояние опроса
-        state = {
-            'answers': current_state.get('saved_answers', {}),
-            'current_question': current_state.get('saved_question', 0),
-            'message_id': call.message.message_id
-        }
-        user_survey_state[user_id] = state
-
-        # Возвращаемся к опросу
-        ask_survey_question(user_id)
-    else:
-        # Обработка навигации по курсам
-        current_pos = current_state['position']
-        total = len(current_state['courses'])
-
-        if action == 'prev':
-            new_pos = (current_pos - 1) % total
-        elif action == 'next':
-            new_pos = (current_pos + 1) % total
-        else:
-            bot.answer_callback_query(call.id)
-            return
-
-        show_recommended_course(user_id, new_pos, call.message.message_id)
-
-    bot.answer_callback_query(call.id)
+# Маршрутизация callback-запросов: callback_data разбирается один раз,
+# обработчик находится по словарю/префиксному дереву (см. router.py)
+callback_router = CallbackRouter()
 
 @bot.callback_query_handler(func=lambda call: True)
-def callback_worker(call):
-    """Обработчик callback-запросов"""
-    chat_id = call.message.chat.id
-    message_id = call.message.message_id
-    logger.info(f"Received callback: {call.data}")
-
-    if call.data == "main_menu":
-        show_main_menu(chat_id, user_menu_messages.get(chat_id))
-
-    elif call.data == "questions":
-        show_faq_topics(chat_id, message_id)
-
-    elif call.data.startswith("faq_answer_"):
-        parts = call.data.split('_')
-        topic = parts[2]
-        question_index = int(parts[3])
-        show_faq_answer(chat_id, topic, question_index, message_id)
-
-    elif call.data == "courses":
-        start_course_survey(chat_id)
-
-    elif call.data == "survey_back":
-        state = user_survey_state.get(chat_id)
-        if state and state['current_question'] > 0:
-            state['current_question'] -= 1
-            prev_question_key = survey_questions[state['current_question']]['key']
-
-            if prev_question_key in state['answers']:
-                del state['answers'][prev_question_key]
-
-            ask_survey_question(chat_id)
-
-    elif call.data == "survey_main_menu":
-        if chat_id in user_survey_state:
-            try:
-                bot.delete_message(chat_id, user_survey_state[chat_id]['message_id'])
-            except:
-                pass
-
-            del user_survey_state[chat_id]
-        show_main_menu(chat_id)
-
-    elif call.data.startswith("survey_"):
-        parts = call.data.split('_')
-        if len(parts) >= 3 and parts[0] == "survey":
-            try:
-                question_index = int(parts[1])
-                answer = '_'.join(parts[2:]).replace('_', ' ')
-                process_survey_answer(chat_id, question_index, answer)
-            except ValueError:
-                pass
-
-    elif call.data == "catalog":
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.add(
-            types.InlineKeyboardButton('Направление обучения', callback_data='direction'),
-            types.InlineKeyboardButton('Должность', callback_data='post'),
-            types.InlineKeyboardButton('Доступность', callback_data='availability'),
-            types.InlineKeyboardButton('🏠 Главное меню', callback_data='main_menu')
-        )
-
-        try:
-            bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text="Выберите по какому критерию фильтровать доступные курсы:",
-                reply_markup=keyboard
-            )
-        except:
-            bot.send_message(chat_id, "Выберите по какому критерию фильтровать доступные курсы:", reply_markup=keyboard)
-
-    elif call.data == "availability":
-        show_availability_menu(chat_id, message_id)
-        
-    elif call.data == "direction":
-        keyboard = types.InlineKeyboardMarkup()
-        key_finance = types.InlineKeyboardButton(text='Финансы', callback_data='finance')
-        key_management = types.InlineKeyboardButton(text='Управление', callback_data='management')
-        key_pedagogy = types.InlineKeyboardButton(text='Педагогика', callback_data='pedagogy')
-        key_back = types.InlineKeyboardButton(text='🔙 Назад', callback_data='catalog')
-        key_main = types.InlineKeyboardButton(text='Главное меню', callback_data='main_menu')
-
-        keyboard.add(key_finance)
-        keyboard.add(key_management)
-        keyboard.add(key_pedagogy)
-        keyboard.add(key_back)
-        keyboard.add(key_main)
-
-        try:
-            bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text="Какое направление обучения Вас интересует?",
-                reply_markup=keyboard
-            )
-        except:
-            bot.send_message(chat_id, "Какое направление обучения Вас интересует?", reply_markup=keyboard)
-
-    elif call.data == "post":
-        keyboard = types.InlineKeyboardMarkup()
-        key_pps = types.InlineKeyboardButton(text='ППС', callback_data='pps')
-        key_aup = types.InlineKeyboardButton(text='АУП', callback_data='aup')
-        key_guide = types.InlineKeyboardButton(text='Руководство', callback_data='guide')
-        key_students = types.InlineKeyboardButton(text='Студенты', callback_data='students')
-        key_back = types.InlineKeyboardButton(text='🔙 Назад', callback_data='catalog')
-        key_main = types.InlineKeyboardButton(text='Главное меню', callback_data='main_menu')
-
-        keyboard.add(key_pps)
-        keyboard.add(key_aup)
-        keyboard.add(key_guide)
-        keyboard.add(key_students)
-        keyboard.add(key_back)
-        keyboard.add(key_main)
-
-        try:
-            bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text="Какая должность Вас интересует?",
-                reply_markup=keyboard
-            )
-        except:
-            bot.send_message(chat_id, "Какая должность Вас интересует?", reply_markup=keyboard)
-
-    elif call.data == "availability":
-        keyboard = types.InlineKeyboardMarkup()
-        key_open_programs = types.InlineKeyboardButton(text='Открытые программы', callback_data='open')
-        key_limited_programs = types.InlineKeyboardButton(text='Ограниченные программы', callback_data='limited')
-        key_back = types.InlineKeyboardButton(text='🔙 Назад', callback_data='catalog')
-        key_main = types.InlineKeyboardButton(text='Главное меню', callback_data='main_menu')
-
-        keyboard.add(key_open_programs)
-        keyboard.add(key_limited_programs)
-        keyboard.add(key_back)
-        keyboard.add(key_main)
-
+def handle_callback(call):
+    """Передает callback-запрос обработчику маршрута и отвечает на него"""
+    answer = None
+    try:
+        answer = callback_router.dispatch(call)
+    except Exception as e:
+        logger.error(f"Ошибка обработки callback {call.data}: {e}")
+        answer = "⚠️ Ошибка обновления"
+    finally:
         try:
-            bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text="Программы какой доступности Вас интересуют?",
-                reply_markup=keyboard
-            )
-        except:
-            bot.send_message(chat_id, "Программы какой доступности Вас интересуют?", reply_markup=keyboard)
+            api.answer_callback_query(call.id, answer)
+        except Exception as e:
+            logger.error(f"Ошибка ответа на callback: {e}")
 
-    elif call.data in ['finance', 'management', 'pedagogy', 'pps', 'aup', 'guide', 'students', 'open', 'limited']:
-        show_course(chat_id, call.data, edit_message_id=message_id)
+@callback_router.route('none')
+def handle_none(call, callback):
+    """Обрабатывает пустые callback'и"""
 
-    elif call.data == "feedback":
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.add(types.InlineKeyboardButton(text="✍️ Контактные данные кураторов", callback_data="contact_information"))
-        keyboard.add(types.InlineKeyboardButton(text="⭐ Оценить курсы и преподавателей", callback_data="rate"))
-        keyboard.add(types.InlineKeyboardButton(text="✍️ Задать вопрос", callback_data="ask_question"))
-        keyboard.add(types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu"))
-        
-        try:
-            bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text="Свяжитесь с кураторами или задайте свой вопрос:",
-                reply_markup=keyboard
-            )
-        except:
-            bot.send_message(chat_id, "Свяжитесь с кураторами или задайте свой вопрос:", reply_markup=keyboard)
+@callback_router.route('main_menu')
+def handle_main_menu(call, callback):
+    """Обрабатывает кнопку 'Главное меню'"""
+    show_main_menu(call.from_user.id)
+
+@callback_router.route('catalog', 'direction', 'post', 'availability', 'feedback', 'rate', 'contact_information')
+def handle_menu(call, callback):
+    """Показывает статическое меню из реестра"""
+    show_menu(call.message.chat.id, call.data, call.message.message_id)
+
+@callback_router.route(*COURSE_FILTERS, TOP_RATED)
+def handle_course_filter(call, callback):
+    """Показывает первый курс выбранной категории"""
+    show_course(call.message.chat.id, call.data, edit_message_id=call.message.message_id)
+
+@callback_router.prefix(callback_codec.token('course_prev'), callback_codec.token('course_next'))
+def handle_course_page(call, callback):
+    """Листание каталога: категория, позиция и id текущего курса - в кнопке"""
+    name = 'course_prev' if callback.route == callback_codec.token('course_prev') else 'course_next'
+    try:
+        fields = callback_codec.decode(name, callback.args)
+    except ValueError:
+        return STALE_BUTTON
+    step = -1 if name == 'course_prev' else 1
+    show_course(call.from_user.id, fields['filter'], fields['position'] + step, call.message.message_id,
+                anchor_id=fields['course_id'], step=step)
+
+@callback_router.prefix('course_prev', 'course_next')
+def handle_course_navigation(call, callback):
+    """Кнопки листания старого формата: course_prev|next_{категория}_{позиция}_{id курса}"""
+    step = -1 if callback.action == 'prev' else 1
+
+    if len(callback.args) >= 2:
+        course_type = callback.args[0]
+        current_index = int(callback.args[1])
+        anchor_id = int(callback.args[2]) if len(callback.args) >= 3 else None
+        show_course(call.from_user.id, course_type, current_index + step, call.message.message_id,
+                    anchor_id=anchor_id, step=step)
+        return
 
-    elif call.data == "ask_question":
-        users_waiting_for_question[chat_id] = True
-        bot.send_message(chat_id, "✍️ Пожалуйста, напишите свой вопрос. Мы ответим как можно скорее!")
+    # Кнопки без параметров листают от сохраненной позиции пользователя
+    user_id = call.from_user.id
+    state = user_course_positions['regular'].get(user_id)
+    if not state:
+        return "🌀 Обновите фильтр"
 
-    elif call.data == "rate":
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.add(types.InlineKeyboardButton(text="📚 Оценить курс", callback_data="rate_course"))
-        keyboard.add(types.InlineKeyboardButton(text="🎓 Оценить преподавателя", callback_data="rate_teacher"))
-        keyboard.add(types.InlineKeyboardButton(text="🔙 Назад", callback_data="feedback"))
-        keyboard.add(types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu"))
+    show_course(
+        user_id=user_id,
+        course_type=state.key,
+        course_index=state.position + step,
+        edit_message_id=call.message.message_id,
+        anchor_id=state.course_id,
+        step=step
+    )
 
-        try:
-            bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text="Что вы хотите оценить?",
-                reply_markup=keyboard
-            )
-        except:
-            bot.send_message(chat_id, "Что вы хотите оценить?", reply_markup=keyboard)
+@callback_router.route('questions')
+def handle_questions_callback(call, callback):
+    """Обрабатывает нажатие на кнопку 'Частные вопросы'"""
+    show_faq_topics(call.from_user.id, call.message.message_id)
 
-    elif call.data == "rate_course":
-        all_courses = get_all_courses()
-        keyboard = types.InlineKeyboardMarkup()
+@callback_router.prefix('faq_topic')
+def handle_faq_topic(call, callback):
+    """Обрабатывает выбор темы FAQ"""
+    topic = '_'.join(callback.args)  # Получаем тему из callback_data
+    show_faq_questions(call.from_user.id, topic, call.message.message_id)
 
-        for idx, course in enumerate(all_courses[:10]):  # Ограничиваем показ первыми 10 курсами
-            keyboard.add(types.InlineKeyboardButton(text=course[0], callback_data=f"select_course_{idx}"))
+@callback_router.prefix('faq_item')
+def handle_faq_item(call, callback):
+    """Обрабатывает выбор конкретного вопроса FAQ: faq_item_{id вопроса}"""
+    try:
+        if len(callback.args) == 1:
+            faq_id = int(callback.args[0])
+        else:
+            # Кнопки старого формата: faq_item_{тема}_{номер в теме}
+            index = get_faq_index()
+            faq_id = index.topics['_'.join(callback.args[:-1])][int(callback.args[-1])]['faq_id']
+    except (ValueError, KeyError, IndexError, AttributeError):
+        return STALE_BUTTON
+    show_faq_answer(call.from_user.id, faq_id, call.message.message_id)
+
+@callback_router.route('courses')
+def handle_courses_callback(call, callback):
+    """Обрабатывает нажатие на кнопку 'Подобрать курс'"""
+    start_course_survey(call.from_user.id)
 
-        keyboard.add(types.InlineKeyboardButton(text="🔙 Назад", callback_data="rate"))
-        keyboard.add(types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu"))
+@callback_router.route('survey_main_menu')
+def handle_survey_main_menu(call, callback):
+    """Прерывает опрос и возвращает в главное меню"""
+    chat_id = call.message.chat.id
+    try:
+        api.delete_message(chat_id, call.message.message_id)
+    except:
+        pass
+    show_main_menu(chat_id)
 
-        try:
-            bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text="Выберите курс для оценки:",
-                reply_markup=keyboard
-            )
-        except:
-            bot.send_message(chat_id, "Выберите курс для оценки:", reply_markup=keyboard)
+@callback_router.prefix(callback_codec.token('survey'))
+def handle_survey_answer(call, callback):
+    """Ответ на вопрос опроса или шаг назад: кнопка несет все ответы до текущего вопроса"""
+    try:
+        answers = callback_codec.decode('survey', callback.args)['answers']
+        survey_answers(answers)
+    except (ValueError, IndexError):
+        return STALE_BUTTON
+    process_survey_answer(call.message.chat.id, answers, call.message.message_id)
+
+@callback_router.prefix(callback_codec.token('recommended'))
+def handle_recommended_navigation(call, callback):
+    """Листание рекомендованных курсов: ответы опроса и позиция - в кнопке"""
+    try:
+        fields = callback_codec.decode('recommended', callback.args)
+        survey_answers(fields['answers'])
+    except (ValueError, IndexError):
+        return STALE_BUTTON
+    show_recommended_course(call.from_user.id, fields['answers'], fields['position'], call.message.message_id)
+
+@callback_router.prefix('survey', 'recommended')
+def handle_legacy_survey(call, callback):
+    """Кнопки опроса старого формата (до кодека callback_data): начинаем опрос заново"""
+    start_course_survey(call.message.chat.id)
+    return STALE_BUTTON
+
+@callback_router.prefix(callback_codec.token('support_claim'))
+def handle_support_claim(call, callback):
+    """Агент берет заявку из дайджеста"""
+    if call.message.chat.id not in support_desk.agents:
+        return
+    try:
+        ticket_id = callback_codec.decode('support_claim', callback.args)['ticket_id']
+    except ValueError:
+        return STALE_BUTTON
+    ticket, reason = support_desk.claim(ticket_id, call.from_user.id, call.message.chat.id)
+    if ticket is None:
+        return reason
+    return f"Заявка #{ticket_id} ваша"
+
+@callback_router.route('faq_helpful')
+def handle_faq_helpful(call, callback):
+    """Подсказка из FAQ ответила на вопрос: в поддержку он не уходит"""
+    chat_id = call.message.chat.id
+    if faq_pending.take(chat_id) is not None:
+        faq_stats.record(DEFLECTED)
+    api.send_message(chat_id, "😊 Рады, что ответ нашелся!")
+    show_main_menu(chat_id)
 
-    elif call.data.startswith("select_course_"):
-        course_idx = int(call.data.split("_")[2])
-        all_courses = get_all_courses()
-        selected_course = all_courses[course_idx]
-        user_selected_course_for_rating[chat_id] = selected_course[0]
+@callback_router.route('faq_escalate')
+def handle_faq_escalate(call, callback):
+    """Подсказки не помогли: отправляем вопрос в поддержку"""
+    chat_id = call.message.chat.id
+    question = faq_pending.take(chat_id)
+    if question is None:
+        return "Вопрос уже отправлен"
+    faq_stats.record(ESCALATED)
+    escalate_question(chat_id, *question)
+
+@callback_router.route('ask_question')
+def handle_ask_question(call, callback):
+    """Ждет от пользователя текст вопроса"""
+    chat_id = call.message.chat.id
+    users_waiting_for_question[chat_id] = True
+    api.send_message(chat_id, "✍️ Пожалуйста, напишите свой вопрос. Мы ответим как можно скорее!")
 
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.add(
-            types.InlineKeyboardButton(text="⭐ 1", callback_data="rating_course_1"),
-            types.InlineKeyboardButton(text="⭐ 2", callback_data="rating_course_2"),
-            types.InlineKeyboardButton(text="⭐ 3", callback_data="rating_course_3"),
-            types.InlineKeyboardButton(text="⭐ 4", callback_data="rating_course_4"),
-            types.InlineKeyboardButton(text="⭐ 5", callback_data="rating_course_5")
-        )
-        keyboard.add(types.InlineKeyboardButton(text="🔙 Назад", callback_data="rate_course"))
-        keyboard.add(types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu"))
+@callback_router.route('rate_course')
+def handle_rate_course(call, callback):
+    """Показывает список курсов для оценки"""
+    chat_id = call.message.chat.id
+    all_courses = get_all_courses()
+    keyboard = types.InlineKeyboardMarkup()
 
-        try:
-            bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text=f"Вы выбрали курс:\n<b>{selected_course[0]}</b>\n\nТеперь поставьте ему оценку:",
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-        except:
-            bot.send_message(
-                chat_id,
-                f"Вы выбрали курс:\n<b>{selected_course[0]}</b>\n\nТеперь поставьте ему оценку:",
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
+    for idx, course in enumerate(all_courses[:10]):  # Ограничиваем показ первыми 10 курсами
+        keyboard.add(types.InlineKeyboardButton(text=course[0], callback_data=f"select_course_{idx}"))
 
-    elif call.data.startswith("rating_course_"):
-        rating = int(call.data.split("_")[2])
-        course_title = user_selected_course_for_rating.get(chat_id, "Неизвестный курс")
+    keyboard.add(types.InlineKeyboardButton(text="🔙 Назад", callback_data="rate"))
+    keyboard.add(types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu"))
 
-        # Сохраняем оценку в базу данных
-        save_rating(chat_id, 'course', course_title, rating)
+    edit_or_send(chat_id, "Выберите курс для оценки:", keyboard, call.message.message_id)
 
-        bot.send_message(chat_id, "✅ Спасибо за вашу оценку!")
-        user_selected_course_for_rating.pop(chat_id, None)
-        show_main_menu(chat_id)
+@callback_router.prefix('select_course')
+def handle_select_course(call, callback):
+    """Запоминает курс и предлагает поставить оценку"""
+    chat_id = call.message.chat.id
+    course_idx = int(callback.args[0])
+    all_courses = get_all_courses()
+    selected_course = all_courses[course_idx]
+    user_selected_course_for_rating[chat_id] = selected_course[0]
 
-    elif call.data == "rate_teacher":
-        user_typing_teacher_name[chat_id] = True
-        bot.send_message(chat_id, "✍️ Пожалуйста, введите ФИО преподавателя, которого хотите оценить:")
+    keyboard = menu_registry.get_keyboard('rating_course')
 
-    elif call.data.startswith("rating_teacher_"):
-        rating = int(call.data.split("_")[2])
-        full_name = user_selected_teacher_for_rating.get(chat_id, "Неизвестный преподаватель")
+    edit_or_send(
+        chat_id,
+        f"Вы выбрали курс:\n<b>{selected_course[0]}</b>\n\nТеперь поставьте ему оценку:",
+        keyboard,
+        call.message.message_id,
+        parse_mode="HTML"
+    )
 
-        # Сохраняем оценку в базу данных
-        save_rating(chat_id, 'teacher', full_name, rating)
+@callback_router.prefix('rating_course')
+def handle_rating_course(call, callback):
+    """Сохраняет оценку курса"""
+    chat_id = call.message.chat.id
+    rating = int(callback.args[0])
+    course_title = user_selected_course_for_rating.get(chat_id, "Неизвестный курс")
 
-        bot.send_message(chat_id, "✅ Спасибо за вашу оценку!")
-        user_selected_teacher_for_rating.pop(chat_id, None)
-        show_main_menu(chat_id)
+    # Сохраняем оценку в базу данных
+    save_rating(chat_id, 'course', course_title, rating)
 
-    elif call.data == "contact_information":
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.add(types.InlineKeyboardButton(text="📞 Куратор Полина", url="https://t.me/polina_morik"))
-        keyboard.add(types.InlineKeyboardButton(text="📞 Куратор Виктория", url="https://t.me/vikkaaa1"))
-        keyboard.add(types.InlineKeyboardButton(text="📞 Куратор Анастасия", url="https://t.me/nestty2"))
-        keyboard.add(types.InlineKeyboardButton(text="🔙 Назад", callback_data="feedback"))
-        keyboard.add(types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu"))
+    api.send_message(chat_id, "✅ Спасибо за вашу оценку!")
+    user_selected_course_for_rating.pop(chat_id, None)
+    show_main_menu(chat_id)
 
-        try:
-            bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text="Контактные данные кураторов:",
-                reply_markup=keyboard
-            )
-        except:
-            bot.send_message(chat_id, "Контактные данные кураторов:", reply_markup=keyboard)
+@callback_router.route('rate_teacher')
+def handle_rate_teacher(call, callback):
+    """Ждет от пользователя ФИО преподавателя"""
+    chat_id = call.message.chat.id
+    user_typing_teacher_name[chat_id] = True
+    api.send_message(chat_id, "✍️ Пожалуйста, введите ФИО преподавателя, которого хотите оценить:")
 
-    elif call.data in ['course_prev', 'course_next']:
-        user_id = call.from_user.id
-        state = user_course_positions['regular'].get(user_id)
+@callback_router.prefix('rating_teacher')
+def handle_rating_teacher(call, callback):
+    """Сохраняет оценку преподавателя"""
+    chat_id = call.message.chat.id
+    rating = int(callback.args[0])
+    full_name = user_selected_teacher_for_rating.get(chat_id, "Неизвестный преподаватель")
 
-        if not state or not state.get('courses'):
-            bot.answer_callback_query(call.id, "🌀 Обновите фильтр")
-            return
+    # Сохраняем оценку в базу данных
+    save_rating(chat_id, 'teacher', full_name, rating)
 
-        try:
-            current_index = state['position']
-            total = len(state['courses'])
+    api.send_message(chat_id, "✅ Спасибо за вашу оценку!")
+    user_selected_teacher_for_rating.pop(chat_id, None)
+    show_main_menu(chat_id)
 
-            new_index = current_index - 1 if call.data == 'course_prev' else current_index + 1
-            new_index %= total  # Циклическая навигация
+# Показатели компонентов для метрик: читаются из stats() в момент опроса
+def cache_stats():
+    recommendations = recommendation_index.stats()
+    catalog, inline, search = catalog_cache.stats(), inline_results.stats(), search_results.stats()
+    return {
+        'catalog': (catalog['hits'], catalog['misses']),
+        'inline': (inline['hits'], inline['misses']),
+        'search': (search['hits'], search['misses']),
+        # Промах индекса рекомендаций - запрос ушел в полный перебор курсов
+        'recommendations': (recommendations['lookups'] - recommendations['fallbacks'], recommendations['fallbacks'])
+    }
 
-            user_course_positions['regular'][user_id]['position'] = new_index
+def cache_hit_ratios():
+    return {
+        cache: hits / (hits + misses) if hits + misses else 0.0
+        for cache, (hits, misses) in cache_stats().items()
+    }
 
-            show_course(
-                user_id=user_id,
-                course_type=state['filter_value'],
-                course_index=new_index,
-                edit_message_id=call.message.message_id
+metrics.callback('cache_hits_total', 'Попадания в кэши', lambda: {
+    cache: hits for cache, (hits, _) in cache_stats().items()
+}, ['cache'], kind='counter')
+metrics.callback('cache_misses_total', 'Промахи кэшей', lambda: {
+    cache: misses for cache, (_, misses) in cache_stats().items()
+}, ['cache'], kind='counter')
+metrics.callback('cache_hit_ratio', 'Доля попаданий в кэши', cache_hit_ratios, ['cache'])
+metrics.callback('cache_entries', 'Записей в кэшах в памяти', lambda: {
+    'catalog': catalog_cache.stats()['entries'],
+    'inline': inline_results.stats()['entries'],
+    'search': search_results.stats()['entries'],
+    'recommendations': recommendation_index.stats()['combinations'],
+    'profiles': activity_tracker.stats()['profiles']
+}, ['cache'])
+
+# Состояние пользователей: сколько сессий содержит каждое пространство имен
+# (user_course_positions, users_waiting_for_question и т.д.). Подсчет обходит все сессии, поэтому кэшируется
+metrics.callback('session_states', 'Сессий с заполненным состоянием', cached(lambda: {
+    (prefix, field): count
+    for prefix in ('session',)
+    for field, count in sessions.field_counts(prefix).items()
+}, float(os.getenv('METRICS_STATE_INTERVAL', 60))), ['prefix', 'state'])
+
+def pick(stats, keys):
+    return {key: stats[key] for key in keys}
+
+if hasattr(sessions, 'stats'):
+    # Только для хранилища в памяти: в Redis вытеснением управляет сам Redis
+    metrics.callback('memory_sessions_evicted_total', 'Сессии, удаленные из памяти', lambda: pick(
+        sessions.stats(), ('evicted', 'expired')
+    ), ['reason'], kind='counter')
+
+metrics.callback('support_tickets', 'Заявки в поддержку по статусам', cached(
+    support_desk.status_counts, float(os.getenv('METRICS_STATE_INTERVAL', 60))
+), ['status'])
+metrics.callback('support_events_total', 'События заявок в поддержку', lambda: pick(
+    support_desk.stats(), ('created', 'assigned', 'digests', 'claimed', 'answered', 'sla_breached', 'reassigned')
+), ['event'], kind='counter')
+
+metrics.callback('faq_questions_total', 'Вопросы пользователей и подсказки FAQ', lambda: pick(
+    faq_stats.stats(), (QUESTION, SUGGESTED, DEFLECTED, ESCALATED, UNMATCHED, EXPIRED)
+), ['event'], kind='counter')
+metrics.callback('faq_deflection_ratio', 'Доля вопросов, закрытых подсказкой FAQ',
+                 lambda: faq_stats.stats()['deflection_rate'])
+
+metrics.callback('db_pool_connections', 'Соединения пула БД', lambda: pick(
+    db_pool.stats(), ('in_use', 'idle', 'waiting')
+), ['state'])
+metrics.callback('outbound_queued', 'Вызовов Bot API в очереди исходящих', lambda: outbound.stats()['queued'], ['priority'])
+metrics.callback('outbound_calls_total', 'Вызовы очереди исходящих', lambda: pick(
+    outbound.stats(), ('sent', 'failed', 'retried_429')
+), ['result'], kind='counter')
+
+def outbound_wait():
+    stats = outbound.stats()
+    return {name: stats[f'{name}_wait_avg_ms'] / 1000 for name in PRIORITY_NAMES.values()}
+
+metrics.callback('outbound_wait_avg_seconds', 'Среднее ожидание в очереди исходящих', outbound_wait, ['priority'])
+metrics.callback('background_queue_depth', 'Записей в очередях фоновой записи', lambda: {
+    'ratings': rating_writer.stats()['queue_depth'],
+    'activity': activity_tracker.stats()['pending']
+}, ['queue'])
+
+# Шардирование апдейтов по чатам между процессами: BOT_MODE=dispatcher принимает апдейты,
+# BOT_MODE=worker (несколько процессов) обрабатывает их, сохраняя порядок внутри чата
+def update_streams():
+    # Отдельный клиент без замеров: блокирующее чтение потоков исказило бы метрики задержек Redis
+    return UpdateStreams.from_env(TimedRedis(
+        host=os.getenv('REDIS_HOST', 'redis'),
+        port=6379,
+        db=0,
+        decode_responses=True
+    ))
+
+def stop_on_sigterm():
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    # docker stop шлет SIGTERM - завершаемся так же аккуратно, как по Ctrl+C
+    signal.signal(signal.SIGTERM, stop)
+
+def run_dispatcher():
+    """Получает апдейты и раскладывает их по шардам, сам апдейты не обрабатывает"""
+    dispatcher = UpdateDispatcher(update_streams())
+    logger.info(f"Диспетчер запущен, шардов: {dispatcher.streams.shards}")
+    try:
+        if os.getenv('DISPATCHER_INGRESS', 'polling') == 'webhook':
+            run_webhook(
+                bot,
+                url=os.getenv('WEBHOOK_URL'),
+                host=os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+                port=int(os.getenv('WEBHOOK_PORT', 8443)),
+                path=os.getenv('WEBHOOK_PATH', '/webhook'),
+                secret_token=os.getenv('WEBHOOK_SECRET'),
+                workers=int(os.getenv('WEBHOOK_WORKERS', 8)),
+                dispatcher=dispatcher
             )
-            bot.answer_callback_query(call.id)
-
-        except Exception as e:
-            logger.error(f"Ошибка навигации: {e}")
-            bot.answer_callback_query(call.id, "⚠️ Ошибка обновления")
-
-    bot.answer_callback_query(call.id)
+        else:
+            bot.remove_webhook()
+            stop_on_sigterm()
+            dispatcher.poll(os.getenv('TELEGRAM_TOKEN'))
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        logger.info(f"Статистика диспетчера: {dispatcher.stats()}")
+
+def run_worker():
+    """Обрабатывает апдейты своих шардов до остановки процесса"""
+    if os.getenv('SESSION_BACKEND', 'redis') != 'redis':
+        logger.warning("Сессии хранятся в памяти процесса: при переходе шарда к другому обработчику состояние пользователей потеряется")
+    # Порядок внутри шарда обеспечивает сам обработчик, пул потоков TeleBot не нужен
+    bot.threaded = False
+    worker = ShardWorker.from_env(
+        update_streams(), lambda update: bot.process_new_updates([types.Update.de_json(update)])
+    )
+    metrics.callback('shard_updates_total', 'Апдейты, обработанные из шардов', lambda: pick(
+        worker.stats(), ('processed', 'failed', 'replayed')
+    ), ['result'], kind='counter')
+    metrics.callback('shards_owned', 'Шардов у обработчика', lambda: len(worker.stats()['shards']))
+    logger.info(f"Обработчик {worker.owner} запущен")
+    stop_on_sigterm()
+    try:
+        worker.run_forever()
+    except SystemExit:
+        pass
+    finally:
+        logger.info(f"Статистика обработчика шардов: {worker.stats()}")
 
-if __name__ == '__main__':
+if __name__ == '__main__' and os.getenv('BOT_MODE') == 'dispatcher':
+    # Диспетчеру не нужны фоновые службы: они работают в процессах-обработчиках
+    run_dispatcher()
+elif __name__ == '__main__':
     logger.info("Бот запущен")
     try:
-        bot.polling(none_stop=True)
+        db_pool.warmup()
     except Exception as e:
-        logger.error(f"Ошибка в работе бота: {e}")
\ No newline at end of file
+        logger.error(f"Не удалось заранее открыть соединения с БД: {e}")
+    catalog_cache.start_listener(db_pool.connect_kwargs)
+    if hasattr(signal, 'SIGUSR1'):
+        # kill -USR1 <pid>: профилирование на PROFILE_SIGNAL_SECONDS, отчет - в чат поддержки
+        signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(
+            target=profiler.start,
+            kwargs={'seconds': float(os.getenv('PROFILE_SIGNAL_SECONDS', 30)), 'mode': SAMPLE},
+            daemon=True
+        ).start())
+    metrics_server = None
+    if int(os.getenv('METRICS_PORT', 8000)):
+        metrics_server = MetricsServer(metrics, port=int(os.getenv('METRICS_PORT', 8000)))
+        try:
+            metrics_server.start()
+        except OSError as e:
+            logger.error(f"Не удалось запустить сервер метрик: {e}")
+            metrics_server = None
+    rating_writer.start()
+    activity_tracker.start()
+    support_desk.start()
+    faq_pending.start()
+    if os.getenv('OUTBOUND_LIMITS', '1') == '1':
+        outbound.start()
+        broadcast_engine.start()
+    else:
+        logger.warning("Рассылки отключены: они работают только через очередь исходящих (OUTBOUND_LIMITS=1)")
+    try:
+        if os.getenv('BOT_RUNTIME', 'sync') == 'async':
+            # Асинхронный режим: AsyncTeleBot, asyncpg и redis.asyncio, те же обработчики
+            asyncio.run(run_async(
+                bot,
+                api,
+                token=os.getenv('TELEGRAM_TOKEN'),
+                db_async_pool=db_async_pool,
+                sessions=sessions,
+                redis_async_client=TimedAsyncRedis(
+                    host=os.getenv('REDIS_HOST', 'redis'),
+                    port=6379,
+                    db=0,
+                    decode_responses=True,
+                    observe=observe_redis
+                ),
+                redis_clients=[redis_client],
+                concurrency=int(os.getenv('ASYNC_CONCURRENCY', 1000))
+            ))
+        elif os.getenv('BOT_MODE', 'polling') == 'worker':
+            run_worker()
+        elif os.getenv('BOT_MODE', 'polling') == 'webhook':
+            run_webhook(
+                bot,
+                url=os.getenv('WEBHOOK_URL'),
+                host=os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+                port=int(os.getenv('WEBHOOK_PORT', 8443)),
+                path=os.getenv('WEBHOOK_PATH', '/webhook'),
+                secret_token=os.getenv('WEBHOOK_SECRET'),
+                workers=int(os.getenv('WEBHOOK_WORKERS', 8)),
+                queue_size=int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+            )
+        else:
+            # Для локальной разработки: long polling без публичного адреса
+            bot.remove_webhook()
+            bot.polling(none_stop=True)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logger.error(f"Ошибка в работе бота: {e}")
+    finally:
+        broadcast_engine.stop()
+        support_desk.stop()
+        faq_pending.stop()
+        outbound.stop()
+        # Сначала дописываем оценки и активность из очередей, пока пул соединений открыт
+        rating_writer.stop()
+        activity_tracker.stop()
+        logger.info(f"Статистика исходящих сообщений: {outbound.stats()}")
+        logger.info(f"Статистика заявок в поддержку: {support_desk.stats()}")
+        logger.info(f"Статистика записи оценок: {rating_writer.stats()}")
+        logger.info(f"Статистика активности пользователей: {activity_tracker.stats()}")
+        logger.info(f"Статистика пула БД: {db_pool.stats()}")
+        logger.info(f"Статистика кэша каталога: {catalog_cache.stats()}")
+        logger.info(f"Статистика индекса рекомендаций: {recommendation_index.stats()}")
+        logger.info(f"Статистика кэша inline-запросов: {inline_results.stats()}")
+        if metrics_server is not None:
+            metrics_server.stop()
+        db_pool.closeall()
\ No newline at end of file
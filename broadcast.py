@@ -0,0 +1,291 @@
+"""Рассылки и напоминания по аудитории из таблицы users
+
+Задание рассылки хранится в хэше Redis broadcast:<id>: текст, фильтры аудитории,
+статус и контрольная точка (последний обработанный telegram_id). Получатели
+читаются из БД серверным курсором по возрастанию telegram_id, сообщения уходят
+через очередь исходящих вызовов с низким приоритетом (outbound.BULK), поэтому
+лимиты Telegram не нарушаются. После перезапуска задание продолжается с
+контрольной точки; блокировка в Redis не дает двум репликам вести одно задание.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+# Фильтр аудитории -> условие SQL
+AUDIENCE_FILTERS = {
+    'position': "u.position = %s",
+    # Интерес к направлению: пользователь оценивал курсы этого направления
+    'direction': """EXISTS (
+        SELECT 1 FROM ratings r JOIN courses c ON c.title = r.target
+        WHERE r.rating_type = 'course' AND r.user_id = u.telegram_id AND c.direction = %s)""",
+    # История оценок: пользователь оценивал хоть что-нибудь ('course' / 'teacher' / 'any')
+    'rated': """EXISTS (
+        SELECT 1 FROM ratings r
+        WHERE r.user_id = u.telegram_id AND (%s = 'any' OR r.rating_type = %s))""",
+}
+
+
+def audience_query(filters):
+    """SQL и параметры выборки получателей после контрольной точки"""
+    conditions = ["u.telegram_id > %s"]
+    params = []
+    for name, value in sorted(filters.items()):
+        if name not in AUDIENCE_FILTERS:
+            raise ValueError(f"Неизвестный фильтр аудитории: {name}")
+        conditions.append(AUDIENCE_FILTERS[name])
+        params.extend([value] * AUDIENCE_FILTERS[name].count('%s'))
+    query = f"""
+        SELECT u.telegram_id FROM users u
+        WHERE {' AND '.join(conditions)}
+        ORDER BY u.telegram_id
+        LIMIT %s
+    """
+    return query, params
+
+
+class BroadcastEngine:
+    """Фоновое выполнение рассылок с контрольными точками в Redis"""
+
+    def __init__(self, redis_client, pool, send, prefix='broadcast', poll_interval=5.0,
+                 window=30, segment_size=5000, itersize=1000, lock_ttl=60):
+        self.redis = redis_client
+        self.pool = pool
+        # send(chat_id, text) -> Future: отправка через очередь исходящих вызовов
+        self.send = send
+        self.prefix = prefix
+        self.poll_interval = poll_interval
+        # Сколько сообщений рассылки одновременно ждут отправки
+        self.window = window
+        self.segment_size = segment_size
+        self.itersize = itersize
+        self.lock_ttl = lock_ttl
+        self.owner = uuid.uuid4().hex
+        self._planners = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, redis_client, pool, send):
+        """Создает движок рассылок по переменным окружения"""
+        return cls(
+            redis_client,
+            pool,
+            send,
+            poll_interval=float(os.getenv('BROADCAST_POLL_INTERVAL', 5)),
+            window=int(os.getenv('BROADCAST_WINDOW', 30)),
+            segment_size=int(os.getenv('BROADCAST_SEGMENT_SIZE', 5000))
+        )
+
+    def _key(self, job_id):
+        return f"{self.prefix}:{job_id}"
+
+    @property
+    def _schedule_key(self):
+        return f"{self.prefix}:scheduled"
+
+    def create(self, text, filters=None, run_at=None, created_by=None, job_id=None):
+        """Создает задание; с заданным job_id повторное создание ничего не меняет"""
+        if job_id is None:
+            job_id = str(self.redis.incr(f"{self.prefix}:seq"))
+        filters = filters or {}
+        audience_query(filters)
+        run_at = run_at or time.time()
+        job = {
+            'text': text,
+            'filters': json.dumps(filters, ensure_ascii=False),
+            'status': PENDING,
+            'run_at': run_at,
+            'created_at': time.time(),
+            'created_by': created_by or '',
+            'last_id': 0,
+            'sent': 0,
+            'blocked': 0,
+            'failed': 0
+        }
+        # Только первое создание записывает задание (реплики могут планировать одно и то же)
+        if not self.redis.hsetnx(self._key(job_id), 'text', text):
+            return job_id
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key(job_id), mapping=job)
+        pipe.zadd(self._schedule_key, {job_id: run_at})
+        pipe.execute()
+        return job_id
+
+    def status(self, job_id):
+        job = self.redis.hgetall(self._key(job_id))
+        if not job:
+            return None
+        job['id'] = job_id
+        return job
+
+    def jobs(self, limit=10):
+        """Задания в очереди (по времени запуска)"""
+        job_ids = self.redis.zrange(self._schedule_key, 0, limit - 1)
+        return [job for job in (self.status(job_id) for job_id in job_ids) if job]
+
+    def cancel(self, job_id):
+        job = self.status(job_id)
+        if not job or job['status'] in (DONE, CANCELLED):
+            return False
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key(job_id), 'status', CANCELLED)
+        pipe.zrem(self._schedule_key, job_id)
+        pipe.execute()
+        return True
+
+    def add_planner(self, planner):
+        """planner(engine) вызывается на каждом опросе - например, чтобы создать напоминание"""
+        self._planners.append(planner)
+        return planner
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='broadcast', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30.0):
+        """Останавливает рассылку; текущее задание продолжится с контрольной точки"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                for planner in self._planners:
+                    planner(self)
+                for job_id in self.redis.zrangebyscore(self._schedule_key, 0, time.time()):
+                    if self._stop.is_set():
+                        break
+                    if self._claim(job_id):
+                        try:
+                            self.run_job(job_id)
+                        finally:
+                            self._release(job_id)
+            except Exception as e:
+                logger.error(f"Ошибка выполнения рассылок: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def _claim(self, job_id):
+        return bool(self.redis.set(f"{self._key(job_id)}:lock", self.owner, nx=True, ex=self.lock_ttl))
+
+    def _renew(self, job_id):
+        lock_key = f"{self._key(job_id)}:lock"
+        if self.redis.get(lock_key) != self.owner:
+            return False
+        self.redis.expire(lock_key, self.lock_ttl)
+        return True
+
+    def _release(self, job_id):
+        lock_key = f"{self._key(job_id)}:lock"
+        if self.redis.get(lock_key) == self.owner:
+            self.redis.delete(lock_key)
+
+    def iter_audience(self, filters, after_id=0):
+        """Получатели по возрастанию telegram_id, начиная после контрольной точки
+
+        Выборка читается серверным курсором частями по segment_size строк, чтобы
+        транзакция и соединение не держались открытыми всю рассылку.
+        """
+        query, params = audience_query(filters)
+        while True:
+            count = 0
+            with self.pool.connection() as conn:
+                with conn.cursor(name=f"broadcast_{uuid.uuid4().hex[:8]}") as cur:
+                    cur.itersize = self.itersize
+                    cur.execute(query, [after_id] + params + [self.segment_size])
+                    for (telegram_id,) in cur:
+                        count += 1
+                        after_id = telegram_id
+                        yield telegram_id
+            if count < self.segment_size:
+                return
+
+    def run_job(self, job_id):
+        """Выполняет задание с контрольной точки до конца, отмены или остановки"""
+        job = self.status(job_id)
+        if not job or job['status'] in (DONE, CANCELLED):
+            self.redis.zrem(self._schedule_key, job_id)
+            return
+        self.redis.hset(self._key(job_id), 'status', RUNNING)
+        text = job['text']
+        counters = {name: int(job.get(name) or 0) for name in ('sent', 'blocked', 'failed')}
+        last_id = int(job.get('last_id') or 0)
+        logger.info(f"Рассылка {job_id}: старт после пользователя {last_id}")
+
+        in_flight = deque()
+        last_checkpoint = time.monotonic()
+
+        def settle(block):
+            # Контрольная точка двигается только по подряд завершенным отправкам
+            nonlocal last_id
+            while in_flight and (block or in_flight[0][1].done()):
+                telegram_id, future = in_flight.popleft()
+                try:
+                    future.result()
+                    counters['sent'] += 1
+                except Exception as e:
+                    if getattr(e, 'error_code', None) == 403:
+                        # Пользователь заблокировал бота
+                        counters['blocked'] += 1
+                    else:
+                        counters['failed'] += 1
+                        logger.warning(f"Рассылка {job_id}: ошибка отправки {telegram_id}: {e}")
+                last_id = telegram_id
+
+        interrupted = False
+        audience = self.iter_audience(json.loads(job['filters'] or '{}'), last_id)
+        for telegram_id in audience:
+            in_flight.append((telegram_id, self.send(telegram_id, text)))
+            while len(in_flight) >= self.window:
+                # Ждем самую старую отправку: в очереди не больше window сообщений рассылки
+                in_flight[0][1].exception()
+                settle(block=False)
+
+            if time.monotonic() - last_checkpoint >= 1.0:
+                last_checkpoint = time.monotonic()
+                self._checkpoint(job_id, last_id, counters)
+                if self._stop.is_set() or not self._renew(job_id) or \
+                        self.redis.hget(self._key(job_id), 'status') == CANCELLED:
+                    interrupted = True
+                    break
+
+        audience.close()
+        settle(block=True)
+        self._checkpoint(job_id, last_id, counters)
+        if interrupted:
+            logger.info(f"Рассылка {job_id} прервана на пользователе {last_id}: {counters}")
+            return
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key(job_id), mapping={'status': DONE, 'finished_at': time.time()})
+        pipe.zrem(self._schedule_key, job_id)
+        pipe.execute()
+        logger.info(f"Рассылка {job_id} завершена: {counters}")
+
+    def _checkpoint(self, job_id, last_id, counters):
+        self.redis.hset(self._key(job_id), mapping=dict(counters, last_id=last_id))
+
+
+def next_course_start(now=None, day=15):
+    """Ближайшая дата старта курсов (по FAQ - 15 числа каждого месяца)"""
+    now = now or datetime.now()
+    start = now.replace(day=day, hour=0, minute=0, second=0, microsecond=0)
+    if start <= now:
+        year, month = (now.year + 1, 1) if now.month == 12 else (now.year, now.month + 1)
+        start = start.replace(year=year, month=month)
+    return start
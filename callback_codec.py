@@ -0,0 +1,111 @@
+"""Компактная callback_data без состояния на сервере
+
+Кнопка несет все, что нужно обработчику: фильтр, позицию, id курса, ответы
+опроса. callback_data имеет вид <версия><код>_<арг>_<арг>: код маршрута - пара
+латинских букв, числа записываются в base36, выбор из списка - номером, ответы
+опроса - по одному символу на ответ. Версия входит в токен маршрута, поэтому
+кнопки старого формата не попадут в новый обработчик, а маршрутизатор
+(CallbackRouter) разбирает такие данные как обычный префиксный маршрут.
+"""
+
+# Ограничение Telegram на callback_data (в байтах UTF-8)
+MAX_CALLBACK_BYTES = 64
+
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def to_base36(value):
+    if value < 0:
+        raise ValueError(f"Отрицательное число в callback_data: {value}")
+    out = ''
+    while True:
+        value, rest = divmod(value, 36)
+        out = DIGITS[rest] + out
+        if not value:
+            return out
+
+
+def from_base36(text):
+    # int() принял бы и знак, и пробелы
+    if not text or text.strip(DIGITS):
+        raise ValueError(f"Некорректное число в callback_data: {text!r}")
+    return int(text, 36)
+
+
+class Int:
+    """Неотрицательное целое в base36"""
+
+    def encode(self, value):
+        return to_base36(int(value))
+
+    def decode(self, text):
+        return from_base36(text)
+
+
+class Choice:
+    """Значение из фиксированного списка - номер в base36"""
+
+    def __init__(self, values):
+        self.values = tuple(values)
+        self._index = {value: i for i, value in enumerate(self.values)}
+
+    def encode(self, value):
+        try:
+            return to_base36(self._index[value])
+        except KeyError:
+            raise ValueError(f"Значение {value!r} не из списка {self.values}")
+
+    def decode(self, text):
+        index = from_base36(text)
+        if index >= len(self.values):
+            raise ValueError(f"Номер {index} вне списка {self.values}")
+        return self.values[index]
+
+
+class Digits:
+    """Последовательность маленьких чисел (< 36) - по символу на число"""
+
+    def encode(self, values):
+        return ''.join(DIGITS[value] for value in values)
+
+    def decode(self, text):
+        return tuple(from_base36(char) for char in text)
+
+
+class CallbackCodec:
+    """Реестр компактных маршрутов: name -> (токен, поля)"""
+
+    def __init__(self, version=1, separator='_'):
+        self.version = version
+        self.separator = separator
+        self._routes = {}
+
+    def register(self, name, code, **fields):
+        """Регистрирует маршрут; поля кодируются в порядке объявления"""
+        token = f"{self.version}{code}"
+        if any(route[0] == token for route in self._routes.values()):
+            raise ValueError(f"Код {code} уже занят")
+        self._routes[name] = (token, tuple(fields.items()))
+        return token
+
+    def token(self, name):
+        """Токен маршрута для CallbackRouter.prefix()"""
+        return self._routes[name][0]
+
+    def encode(self, name, **values):
+        token, fields = self._routes[name]
+        parts = [token] + [kind.encode(values[field]) for field, kind in fields]
+        data = self.separator.join(parts)
+        if len(data.encode()) > MAX_CALLBACK_BYTES:
+            raise ValueError(f"callback_data длиннее {MAX_CALLBACK_BYTES} байт: {data}")
+        return data
+
+    def decode(self, name, args):
+        """Аргументы разобранной callback_data (Callback.args) -> словарь полей
+
+        ValueError, если данные повреждены или не подходят маршруту.
+        """
+        _, fields = self._routes[name]
+        if len(args) != len(fields):
+            raise ValueError(f"Маршрут {name} ожидает {len(fields)} аргументов, получено {len(args)}")
+        return {field: kind.decode(text) for (field, kind), text in zip(fields, args)}
@@ -0,0 +1,175 @@
+import time
+import select
+import logging
+import threading
+
+import psycopg2
+from psycopg2 import extensions
+
+from aio import in_async_context
+
+logger = logging.getLogger(__name__)
+
+# Канал, в который триггер на таблице courses шлет уведомления (см. init_db.sql)
+CATALOG_CHANNEL = 'courses_changed'
+
+
+class CatalogCache:
+    """Кэш каталога курсов в памяти процесса с инвалидацией по LISTEN/NOTIFY и TTL"""
+
+    def __init__(self, ttl=300.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (значение, время загрузки)
+        self._entries = {}
+        # Блокировки загрузки по ключу, чтобы один промах не порождал N одинаковых запросов
+        self._load_locks = {}
+        # Поколения: общее меняется при сбросе всего кэша, по ключу - при сбросе этого ключа
+        self._generation = 0
+        self._key_generations = {}
+        self._invalidate_callbacks = []
+        self._listener = None
+        self._stop = threading.Event()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.expirations = 0
+
+    def get(self, key, loader):
+        """Возвращает значение из кэша или загружает его через loader()
+
+        Возвращаемые списки общие для всех пользователей - их нельзя изменять.
+        """
+        entry = self._fresh_entry(key)
+        if entry is not None:
+            return entry
+
+        if in_async_context():
+            # Все greenlet'ы асинхронного режима живут в одном потоке: ожидание блокировки
+            # остановило бы цикл событий, поэтому параллельные промахи грузят данные сами
+            return self._load(key, loader)
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            # Пока ждали блокировку, значение мог загрузить другой поток
+            entry = self._fresh_entry(key, count_hit=False)
+            if entry is not None:
+                return entry
+            return self._load(key, loader)
+
+    def _load(self, key, loader):
+        with self._lock:
+            self.misses += 1
+            generation = (self._generation, self._key_generations.get(key, 0))
+        value = loader()
+        with self._lock:
+            # Если за время загрузки сбросили весь каталог или этот ключ, результат не сохраняем;
+            # сброс других ключей (например, итогов оценок) загрузку не отменяет
+            if generation == (self._generation, self._key_generations.get(key, 0)):
+                self._entries[key] = (value, time.monotonic())
+        return value
+
+    def _fresh_entry(self, key, count_hit=True):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, loaded_at = entry
+            if time.monotonic() - loaded_at <= self.ttl:
+                if count_hit:
+                    self.hits += 1
+                return value
+            self.expirations += 1
+        # Истекший TTL - запасной путь на случай потерянного NOTIFY: подписчики
+        # (индекс рекомендаций, inline-кэш) должны сброситься так же, как по уведомлению
+        self.invalidate(key)
+        return None
+
+    def invalidate(self, key=None):
+        """Сбрасывает один ключ или весь кэш"""
+        with self._lock:
+            # Загрузки, начатые до сброса, не сохранят устаревший результат
+            if key is None:
+                self._entries.clear()
+                self._key_generations.clear()
+                self._generation += 1
+            else:
+                self._entries.pop(key, None)
+                self._key_generations[key] = self._key_generations.get(key, 0) + 1
+            self.invalidations += 1
+            callbacks = list(self._invalidate_callbacks)
+        for callback in callbacks:
+            try:
+                callback(key)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика инвалидации каталога: {e}")
+
+    def on_invalidate(self, callback):
+        """Регистрирует функцию, вызываемую при сбросе кэша"""
+        with self._lock:
+            self._invalidate_callbacks.append(callback)
+        return callback
+
+    def stats(self):
+        """Возвращает счетчики попаданий и промахов"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'invalidations': self.invalidations,
+                'expirations': self.expirations,
+                'ttl': self.ttl
+            }
+
+    def start_listener(self, connect_kwargs, channel=CATALOG_CHANNEL, poll_interval=5.0):
+        """Запускает фоновый поток, слушающий уведомления об изменении курсов"""
+        if self._listener and self._listener.is_alive():
+            return
+        self._stop.clear()
+        self._listener = threading.Thread(
+            target=self._listen,
+            args=(connect_kwargs, channel, poll_interval),
+            name='catalog-listener',
+            daemon=True
+        )
+        self._listener.start()
+
+    def stop_listener(self):
+        self._stop.set()
+
+    def _listen(self, connect_kwargs, channel, poll_interval):
+        backoff = 1.0
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**connect_kwargs)
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {channel}")
+                # Пока соединения не было, уведомления могли потеряться
+                self.invalidate()
+                backoff = 1.0
+                logger.info(f"Подписка на изменения каталога ({channel}) установлена")
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], poll_interval) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self.invalidate()
+            except Exception as e:
+                logger.error(f"Ошибка подписки на изменения каталога: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
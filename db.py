@@ -0,0 +1,416 @@
+import os
+import re
+import asyncio
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2 import extensions
+
+from aio import await_only, in_async_context
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведённое время"""
+
+
+# Наблюдатели за запросами: observe(операция, секунды, ошибка)
+_query_observers = []
+
+_OPERATION = re.compile(r'\s*(\w+)')
+_OPERATIONS = {'select', 'insert', 'update', 'delete', 'with', 'listen', 'declare'}
+
+
+def on_query(observe):
+    """Регистрирует функцию, которая получает время выполнения каждого запроса"""
+    _query_observers.append(observe)
+    return observe
+
+
+def query_operation(query):
+    """Тип запроса для метрик: select, insert, update... или other"""
+    if isinstance(query, bytes):
+        query = query[:32].decode(errors='ignore')
+    match = _OPERATION.match(query) if isinstance(query, str) else None
+    operation = match.group(1).lower() if match else 'other'
+    return operation if operation in _OPERATIONS else 'other'
+
+
+@contextmanager
+def _observed(query):
+    if not _query_observers:
+        yield
+        return
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        operation = query_operation(query)
+        for observe in _query_observers:
+            observe(operation, elapsed, failed)
+
+
+class TimedCursor(extensions.cursor):
+    """Курсор psycopg2, сообщающий наблюдателям время каждого запроса"""
+
+    def execute(self, query, vars=None):
+        with _observed(query):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        with _observed(query):
+            return super().executemany(query, vars_list)
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений с PostgreSQL"""
+
+    def __init__(self, minconn=1, maxconn=10, timeout=5.0, health_check_interval=30.0, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Некорректные размеры пула соединений")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connect_kwargs = connect_kwargs
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        # Свободные соединения: (соединение, время возврата в пул)
+        self._idle = deque()
+        self._in_use = set()
+        # Места, зарезервированные под проверку или открытие соединения
+        self._pending = 0
+        self._waiting = 0
+        self._closed = False
+
+        # Статистика
+        self._checkouts = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._checkout_time_total = 0.0
+        self._checkout_time_max = 0.0
+
+    @classmethod
+    def from_env(cls):
+        """Создает пул по переменным окружения"""
+        return cls(
+            minconn=int(os.getenv('DB_POOL_MIN', 1)),
+            maxconn=int(os.getenv('DB_POOL_MAX', 10)),
+            timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+            health_check_interval=float(os.getenv('DB_POOL_HEALTHCHECK', 30)),
+            dbname=os.getenv('DB_NAME'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            host=os.getenv('DB_HOST')
+        )
+
+    def _connect(self):
+        conn = psycopg2.connect(cursor_factory=TimedCursor, **self.connect_kwargs)
+        with self._lock:
+            self._created += 1
+        return conn
+
+    def warmup(self):
+        """Заранее открывает minconn соединений"""
+        with self._lock:
+            missing = self.minconn - len(self._idle) - len(self._in_use) - self._pending
+        for _ in range(max(missing, 0)):
+            conn = self._connect()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+                self._available.notify()
+
+    def _is_healthy(self, conn, idle_since):
+        """Проверяет соединение, если оно долго простаивало"""
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _reserve(self, deadline):
+        """Резервирует место в пуле: свободное соединение или право открыть новое"""
+        with self._lock:
+            if self._closed:
+                raise PoolTimeout("Пул соединений закрыт")
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        self._pending += 1
+                        return self._idle.pop()
+                    if len(self._in_use) + self._pending < self.maxconn:
+                        self._pending += 1
+                        return None, None
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"Нет свободных соединений за {self.timeout} с "
+                            f"(занято {len(self._in_use)} из {self.maxconn})"
+                        )
+                    self._available.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+    def getconn(self):
+        """Берет соединение из пула, при необходимости ожидая освобождения"""
+        started = time.monotonic()
+        conn, idle_since = self._reserve(started + self.timeout)
+        try:
+            # Проверка и открытие соединения идут вне блокировки
+            if conn is not None and not self._is_healthy(conn, idle_since):
+                self._close_quietly(conn)
+                with self._lock:
+                    self._discarded += 1
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+                self._available.notify()
+            raise
+        with self._lock:
+            self._pending -= 1
+            return self._checked_out(conn, started)
+
+    def _checked_out(self, conn, started):
+        elapsed = time.monotonic() - started
+        self._in_use.add(conn)
+        self._checkouts += 1
+        self._checkout_time_total += elapsed
+        self._checkout_time_max = max(self._checkout_time_max, elapsed)
+        return conn
+
+    def putconn(self, conn):
+        """Возвращает соединение в пул"""
+        reusable = not conn.closed
+        if reusable:
+            try:
+                # Не оставляем открытых транзакций у свободных соединений
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                reusable = False
+        with self._lock:
+            self._in_use.discard(conn)
+            if reusable and not self._closed:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            else:
+                self._discarded += 1
+            self._available.notify()
+        if conn is not None:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """Соединение из пула: commit при успехе, rollback при ошибке"""
+        conn = self.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        """Закрывает все соединения пула"""
+        with self._lock:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._discarded += len(idle)
+            self._available.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Возвращает статистику пула"""
+        with self._lock:
+            return {
+                'min': self.minconn,
+                'max': self.maxconn,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'created': self._created,
+                'discarded': self._discarded,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'checkout_avg_ms': (self._checkout_time_total / self._checkouts * 1000) if self._checkouts else 0.0,
+                'checkout_max_ms': self._checkout_time_max * 1000
+            }
+
+
+_PLACEHOLDER = re.compile(r'%(s|%)')
+
+
+def to_asyncpg_query(query):
+    """Переводит плейсхолдеры psycopg2 (%s) в нумерованные плейсхолдеры asyncpg ($1)"""
+    counter = iter(range(1, query.count('%s') + 1))
+    return _PLACEHOLDER.sub(lambda m: '%' if m.group(1) == '%' else f'${next(counter)}', query)
+
+
+class AsyncpgCursor:
+    """Курсор в стиле psycopg2 поверх соединения asyncpg"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._rows = []
+        self._position = 0
+
+    def execute(self, query, params=()):
+        self.connection._begin()
+        with _observed(query):
+            self._rows = await_only(self.connection.raw.fetch(to_asyncpg_query(query), *params))
+        self._position = 0
+
+    def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        row = self._rows[self._position]
+        self._position += 1
+        return row
+
+    def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    def close(self):
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncpgConnection:
+    """Соединение asyncpg с интерфейсом psycopg2: транзакция открывается неявно"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._transaction = None
+
+    def _begin(self):
+        if self._transaction is None:
+            self._transaction = self.raw.transaction()
+            await_only(self._transaction.start())
+
+    def cursor(self):
+        return AsyncpgCursor(self)
+
+    def commit(self):
+        if self._transaction is not None:
+            transaction, self._transaction = self._transaction, None
+            await_only(transaction.commit())
+
+    def rollback(self):
+        if self._transaction is not None:
+            transaction, self._transaction = self._transaction, None
+            await_only(transaction.rollback())
+
+
+class AsyncConnectionPool:
+    """Пул asyncpg для асинхронного режима с тем же интерфейсом, что у ConnectionPool"""
+
+    def __init__(self, minconn=1, maxconn=10, timeout=5.0, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.connect_kwargs = connect_kwargs
+        self._pool = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            minconn=int(os.getenv('DB_POOL_MIN', 1)),
+            maxconn=int(os.getenv('DB_ASYNC_POOL_MAX', 50)),
+            timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+            database=os.getenv('DB_NAME'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            host=os.getenv('DB_HOST')
+        )
+
+    async def open(self):
+        import asyncpg
+        self._pool = await asyncpg.create_pool(
+            min_size=self.minconn, max_size=self.maxconn, **self.connect_kwargs
+        )
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    @contextmanager
+    def connection(self):
+        """Соединение из пула (вызывать внутри greenlet_spawn)"""
+        try:
+            raw = await_only(self._pool.acquire(timeout=self.timeout))
+        except asyncio.TimeoutError as e:
+            raise PoolTimeout(f"Нет свободных соединений за {self.timeout} с") from e
+        conn = AsyncpgConnection(raw)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            await_only(self._pool.release(raw))
+
+    def stats(self):
+        if self._pool is None:
+            return {'min': self.minconn, 'max': self.maxconn, 'size': 0, 'idle': 0, 'in_use': 0}
+        size, idle = self._pool.get_size(), self._pool.get_idle_size()
+        return {'min': self.minconn, 'max': self.maxconn, 'size': size, 'idle': idle, 'in_use': size - idle}
+
+
+# Общий пул соединений бота
+pool = ConnectionPool.from_env()
+
+# Пул asyncpg, открывается только в асинхронном режиме
+async_pool = AsyncConnectionPool.from_env()
+
+
+def get_db_connection():
+    """Выдает соединение из общего пула (использовать через with)"""
+    if async_pool._pool is not None and in_async_context():
+        return async_pool.connection()
+    return pool.connection()
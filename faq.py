@@ -0,0 +1,249 @@
+"""Поиск ответа в FAQ по тексту вопроса пользователя
+
+Вопросы и ответы FAQ индексируются один раз при загрузке (TF-IDF по основам слов
+с подлинейной частотой плюс триграммы символов, чтобы находить слова с опечатками и в другой форме).
+Поиск - обход инвертированного индекса только по словам запроса, поэтому
+занимает доли миллисекунды. DeflectionStats считает, сколько вопросов закрыл
+FAQ, а сколько ушло в поддержку. PendingQuestions держит вопрос, пока пользователь
+смотрит подсказки, и отправляет его в поддержку, если пользователь так и не ответил.
+"""
+import re
+import json
+import math
+import time
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'[a-zа-я0-9]+')
+
+# Служебные слова не помогают найти ответ
+STOP_WORDS = frozenset("""
+а без бы в вам вас ваш во вот все вы да для до если есть же за и из или им их к как ко
+когда ли либо мне мой мы на над не нет ни но ну о об от по под при про с со так то только
+у уже чем что чтобы это я можно здравствуйте добрый день подскажите пожалуйста
+""".split())
+
+# Окончания для грубого выделения основы (от длинных к коротким)
+ENDINGS = sorted("""
+иями ями ами ией иях ого его ому ему ыми ими ах ях ам ям ом ем ой ей ый ий ая яя ое ее ые ие
+ых их ую юю ов ев ия ья ть ться ся сь ет ут ют ит ат ят ешь ишь а я о е ы и у ю ь
+""".split(), key=len, reverse=True)
+
+# Вес совпадения по триграммам относительно совпадения по основе слова
+TRIGRAM_WEIGHT = 0.3
+# Вес текста вопроса относительно текста ответа
+QUESTION_WEIGHT = 2
+
+
+def stem(word):
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    """Основы значимых слов текста"""
+    words = WORD_RE.findall(text.lower().replace('ё', 'е'))
+    return [stem(word) for word in words if word not in STOP_WORDS and len(word) > 1]
+
+
+def features(text):
+    """Признаки текста: основы слов и триграммы символов основ"""
+    counts = Counter()
+    for token in tokenize(text):
+        counts[token] += 1
+        padded = f'#{token}#'
+        for i in range(len(padded) - 2):
+            counts['\x00' + padded[i:i + 3]] += TRIGRAM_WEIGHT
+    return counts
+
+
+class FaqIndex:
+    """Записи FAQ и TF-IDF индекс по ним
+
+    entries - словари с ключами faq_id, topic, question, answer в порядке показа.
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self.by_id = {entry['faq_id']: entry for entry in self.entries}
+        self.topics = {}
+        for entry in self.entries:
+            self.topics.setdefault(entry['topic'], []).append(entry)
+
+        documents = []
+        for entry in self.entries:
+            counts = features(entry['question'])
+            for feature in counts:
+                counts[feature] *= QUESTION_WEIGHT
+            counts.update(features(entry['answer']))
+            documents.append(counts)
+
+        total = len(documents)
+        document_frequency = Counter(feature for counts in documents for feature in counts)
+        self.idf = {
+            feature: math.log(1 + total / frequency) for feature, frequency in document_frequency.items()
+        }
+        # признак -> [(номер записи, вес)]
+        self.postings = {}
+        for i, counts in enumerate(documents):
+            weights = {feature: math.sqrt(count) * self.idf[feature] for feature, count in counts.items()}
+            norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+            for feature, weight in weights.items():
+                self.postings.setdefault(feature, []).append((i, weight / norm))
+
+    def search(self, query, limit=3, min_score=0.2):
+        """Лучшие записи для вопроса: [(оценка 0..1, запись)] по убыванию оценки"""
+        weights = {
+            feature: math.sqrt(count) * self.idf[feature]
+            for feature, count in features(query).items() if feature in self.idf
+        }
+        if not weights:
+            return []
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        scores = Counter()
+        for feature, weight in weights.items():
+            for i, document_weight in self.postings[feature]:
+                scores[i] += weight / norm * document_weight
+        return [
+            (score, self.entries[i]) for i, score in scores.most_common(limit) if score >= min_score
+        ]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def load_faq(connect):
+    """Записи FAQ из БД в порядке тем и вопросов
+
+    connect() - соединение из пула (get_db_connection: в асинхронном режиме - asyncpg).
+    """
+    with connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT faq_id, topic, question, answer FROM faq_entries
+                ORDER BY topic_position, position, faq_id
+            """)
+            return [
+                {'faq_id': faq_id, 'topic': topic, 'question': question, 'answer': answer}
+                for faq_id, topic, question, answer in cur.fetchall()
+            ]
+
+
+# События обработки вопроса пользователя
+QUESTION = 'questions'
+SUGGESTED = 'suggested'
+DEFLECTED = 'deflected'
+ESCALATED = 'escalated'
+UNMATCHED = 'unmatched'
+# Пользователь не ответил на подсказку - вопрос ушел в поддержку по таймауту
+EXPIRED = 'expired'
+
+
+class DeflectionStats:
+    """Счетчики вопросов в Redis (общие для всех реплик): сколько закрыл FAQ, сколько ушло в поддержку"""
+
+    def __init__(self, redis_client, key='faq:deflection'):
+        self.redis = redis_client
+        self.key = key
+
+    def record(self, event):
+        try:
+            self.redis.hincrby(self.key, event, 1)
+        except Exception as e:
+            logger.warning(f"Не удалось учесть событие FAQ {event}: {e}")
+
+    def stats(self):
+        counts = {event: int(value) for event, value in (self.redis.hgetall(self.key) or {}).items()}
+        stats = {
+            event: counts.get(event, 0) for event in (QUESTION, SUGGESTED, DEFLECTED, ESCALATED, UNMATCHED, EXPIRED)
+        }
+        # Доля вопросов, на которые ответил FAQ, и доля показанных подсказок, которые помогли
+        stats['deflection_rate'] = stats[DEFLECTED] / stats[QUESTION] if stats[QUESTION] else 0.0
+        stats['suggestion_success'] = stats[DEFLECTED] / stats[SUGGESTED] if stats[SUGGESTED] else 0.0
+        return stats
+
+
+class PendingQuestions:
+    """Вопросы, отложенные на время показа подсказок FAQ
+
+    Вопрос хранится в Redis (общий для реплик) с моментом, когда он уйдет в поддержку
+    сам. Кнопка под подсказкой или фоновый поток забирают вопрос через take():
+    HGET и HDEL в одной транзакции, поэтому вопрос забирается ровно один раз.
+    У чата отложен один вопрос: если пользователь задал новый, не ответив на
+    подсказку к прежнему, прежний уходит в поддержку, а не теряется.
+    """
+
+    def __init__(self, redis_client, escalate, timeout=600.0, key='faq:pending', poll_interval=5.0):
+        self.redis = redis_client
+        # escalate(chat_id, username, text) - создает заявку в поддержку
+        self.escalate = escalate
+        self.timeout = timeout
+        self.key = key
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def hold(self, chat_id, username, text):
+        """Откладывает вопрос; вопрос, уже отложенный для этого чата, уходит в поддержку"""
+        pipe = self.redis.pipeline()
+        pipe.hget(self.key, chat_id)
+        pipe.hset(self.key, chat_id, json.dumps({'username': username, 'text': text}, ensure_ascii=False))
+        pipe.zadd(f'{self.key}:due', {chat_id: time.time() + self.timeout})
+        previous = pipe.execute()[0]
+        if previous is not None:
+            question = json.loads(previous)
+            self.escalate(chat_id, question['username'], question['text'])
+
+    def escalate_pending(self, chat_id):
+        """Сразу отправляет в поддержку отложенный вопрос чата; False, если его нет"""
+        question = self.take(chat_id)
+        if question is None:
+            return False
+        self.escalate(chat_id, *question)
+        return True
+
+    def take(self, chat_id):
+        """Забирает отложенный вопрос: (username, text) или None, если его уже нет"""
+        pipe = self.redis.pipeline()
+        pipe.hget(self.key, chat_id)
+        pipe.hdel(self.key, chat_id)
+        pipe.zrem(f'{self.key}:due', chat_id)
+        raw, deleted, _ = pipe.execute()
+        if not deleted or raw is None:
+            return None
+        question = json.loads(raw)
+        return question['username'], question['text']
+
+    def escalate_expired(self):
+        """Отправляет в поддержку вопросы, на подсказки к которым пользователь не ответил"""
+        for chat_id in self.redis.zrangebyscore(f'{self.key}:due', 0, time.time()):
+            question = self.take(chat_id)
+            if question is None:
+                continue
+            self.escalate(int(chat_id), *question)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.escalate_expired()
+            except Exception as e:
+                logger.error(f"Ошибка отправки отложенных вопросов в поддержку: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='faq-pending', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
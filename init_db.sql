@@ -1,4 +1,8 @@
 -- Удаляем старые таблицы
+DROP TABLE IF EXISTS support_ticket_messages;
+DROP TABLE IF EXISTS support_tickets;
+DROP TABLE IF EXISTS faq_entries;
+DROP TABLE IF EXISTS rating_aggregates;
 DROP TABLE IF EXISTS ratings;
 DROP TABLE IF EXISTS course_availability;
 DROP TABLE IF EXISTS courses;
@@ -6,6 +10,9 @@ DROP TABLE IF EXISTS positions;
 DROP TABLE IF EXISTS course_categories;
 DROP TABLE IF EXISTS users;
 
+-- Триграммы для поиска курсов с опечатками
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Создаем таблицы
 CREATE TABLE users (
     user_id SERIAL PRIMARY KEY,
@@ -33,7 +40,12 @@ CREATE TABLE courses (
     url TEXT,
     access TEXT DEFAULT 'open' CHECK (access IN ('open', 'limited')),
     direction TEXT CHECK (direction IN ('finance', 'management', 'pedagogy')),
-    role TEXT CHECK (role IN ('ППС', 'АУП', 'Руководство', 'Студент'))
+    role TEXT CHECK (role IN ('ППС', 'АУП', 'Руководство', 'Студент')),
+    -- Полнотекстовый поиск: название важнее описания
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(description, '')), 'B')
+    ) STORED
 );
 
 CREATE TABLE ratings (
@@ -45,6 +57,17 @@ CREATE TABLE ratings (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Накопленные итоги оценок по объекту (поддерживаются триггером на ratings)
+CREATE TABLE rating_aggregates (
+    rating_type TEXT NOT NULL,
+    target TEXT NOT NULL,
+    ratings_count INTEGER NOT NULL DEFAULT 0,
+    ratings_sum INTEGER NOT NULL DEFAULT 0,
+    histogram INTEGER[] NOT NULL DEFAULT '{0,0,0,0,0}',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (rating_type, target)
+);
+
 -- Заполняем данные
 INSERT INTO course_categories (name, description) VALUES 
 ('Финансы', 'Курсы по финансовому учету'),
@@ -107,9 +130,123 @@ INSERT INTO courses (category_id, title, description, duration, price, url, acce
 (7, 'Цифровые инструменты преподавания', 'Использование технологий в образовательной деятельности', 5, 8500, 'https://openedu.ru/students/digital-teaching', 'open', 'pedagogy', 'Студент'),
 (7, 'Методика студенческого тьюторства', 'Подготовка кураторов для младших курсов', 6, 11000, 'https://openedu.ru/students/tutoring', 'limited', 'pedagogy', 'Студент');
 
+-- Частые вопросы: меню FAQ и автоматические подсказки перед отправкой вопроса в поддержку
+CREATE TABLE faq_entries (
+    faq_id SERIAL PRIMARY KEY,
+    topic TEXT NOT NULL,
+    topic_position INTEGER NOT NULL DEFAULT 0,
+    position INTEGER NOT NULL DEFAULT 0,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL
+);
+
+INSERT INTO faq_entries (topic, topic_position, position, question, answer) VALUES
+('Оплата', 1, 1, 'Какие способы оплаты доступны?', 'Мы принимаем оплату банковскими картами (Visa, Mastercard, МИР), а также через PayPal.'),
+('Оплата', 1, 2, 'Есть ли рассрочка?', 'Да, мы предоставляем рассрочку на 3 месяца для всех курсов стоимостью от 20 000 руб.'),
+('Оплата', 1, 3, 'Как получить чек?', 'Чек приходит на вашу электронную почту сразу после оплаты. Если письма нет, проверьте папку ''Спам''.'),
+('Запись на курс', 2, 1, 'Как записаться на курс?', 'Выберите курс в каталоге и нажмите кнопку ''Записаться''. Вам придет инструкция на почту.'),
+('Запись на курс', 2, 2, 'Нужны ли документы для записи?', 'Для большинства курсов достаточно паспорта. Для программ с выдачей сертификата может потребоваться диплом.'),
+('Запись на курс', 2, 3, 'Можно ли записаться по телефону?', 'Да, звоните по номеру +7 (XXX) XXX-XX-XX с 9:00 до 18:00.'),
+('Сроки', 3, 1, 'Когда начинается курс?', 'Ближайший старт - 15 числа каждого месяца. Точная дата указана на странице курса.'),
+('Сроки', 3, 2, 'Можно ли продлить доступ?', 'Да, доступ можно продлить за дополнительную плату (10% от стоимости курса за месяц).'),
+('Сроки', 3, 3, 'Сколько длится курс?', 'Длительность указана на странице каждого курса. Обычно от 4 до 12 недель.'),
+('Техподдержка', 4, 1, 'Не работает личный кабинет', 'Очистите кеш браузера или попробуйте зайти с другого устройства. Если проблема сохраняется, напишите на support@example.com.'),
+('Техподдержка', 4, 2, 'Не приходят письма', 'Проверьте папку ''Спам''. Добавьте наш email в контакты. Если проблема не решена, свяжитесь с техподдержкой.'),
+('Техподдержка', 4, 3, 'Как сменить пароль?', 'На странице входа нажмите ''Забыли пароль?'' и следуйте инструкциям.');
+
+-- Заявки в поддержку (назначение агентам и дайджесты - через Redis, см. support.py)
+CREATE TABLE support_tickets (
+    ticket_id SERIAL PRIMARY KEY,
+    user_chat_id BIGINT NOT NULL,
+    username TEXT,
+    question TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'claimed', 'answered')),
+    -- Чат агента, которому назначена заявка, и кто ее взял и ответил
+    agent_chat_id BIGINT,
+    claimed_by BIGINT,
+    answered_by BIGINT,
+    answer TEXT,
+    sla_due TIMESTAMP NOT NULL,
+    sla_breached BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    assigned_at TIMESTAMP,
+    -- Когда агент получил заявку в дайджесте (NULL - назначена, но уведомление не дошло)
+    notified_at TIMESTAMP,
+    claimed_at TIMESTAMP,
+    answered_at TIMESTAMP
+);
+
+-- Сообщения агентам с заявками: ответ (reply) на такое сообщение закрывает заявку
+CREATE TABLE support_ticket_messages (
+    chat_id BIGINT NOT NULL,
+    message_id BIGINT NOT NULL,
+    ticket_id INTEGER NOT NULL REFERENCES support_tickets(ticket_id) ON DELETE CASCADE,
+    PRIMARY KEY (chat_id, message_id)
+);
+
 -- Индексы
 CREATE INDEX idx_users_telegram ON users(telegram_id);
 CREATE INDEX idx_courses_category ON courses(category_id);
-CREATE INDEX idx_courses_direction ON courses(direction);
-CREATE INDEX idx_courses_role ON courses(role);
+-- Составные индексы под постраничное листание каталога по (title, course_id)
+CREATE INDEX idx_courses_direction_title ON courses(direction, title, course_id);
+CREATE INDEX idx_courses_role_title ON courses(role, title, course_id);
+CREATE INDEX idx_courses_access_title ON courses(access, title, course_id);
 CREATE INDEX idx_ratings_user ON ratings(user_id);
+-- Загрузка агентов: только незакрытые заявки
+CREATE INDEX idx_support_tickets_open ON support_tickets(agent_chat_id) WHERE status <> 'answered';
+-- Поиск курсов: полнотекстовый по названию и описанию, нечеткий по названию
+CREATE INDEX idx_courses_search ON courses USING GIN (search_vector);
+CREATE INDEX idx_courses_title_trgm ON courses USING GIN (title gin_trgm_ops);
+
+-- Уведомления об изменении каталога (сбрасывают кэш курсов в боте)
+CREATE OR REPLACE FUNCTION notify_courses_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('courses_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER courses_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON courses
+FOR EACH STATEMENT EXECUTE FUNCTION notify_courses_changed();
+
+-- FAQ кэшируется вместе с каталогом и сбрасывается тем же уведомлением
+CREATE TRIGGER faq_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON faq_entries
+FOR EACH STATEMENT EXECUTE FUNCTION notify_courses_changed();
+
+-- Итоги оценок: один UPSERT на пакет вставленных строк, без пересчета по всей таблице
+CREATE OR REPLACE FUNCTION update_rating_aggregates() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO rating_aggregates AS a (rating_type, target, ratings_count, ratings_sum, histogram)
+    SELECT rating_type, target, count(*), sum(rating),
+           ARRAY[
+               count(*) FILTER (WHERE rating = 1),
+               count(*) FILTER (WHERE rating = 2),
+               count(*) FILTER (WHERE rating = 3),
+               count(*) FILTER (WHERE rating = 4),
+               count(*) FILTER (WHERE rating = 5)
+           ]::INTEGER[]
+    FROM new_ratings
+    GROUP BY rating_type, target
+    -- Одинаковый порядок блокировок для параллельных пакетов
+    ORDER BY rating_type, target
+    ON CONFLICT (rating_type, target) DO UPDATE SET
+        ratings_count = a.ratings_count + EXCLUDED.ratings_count,
+        ratings_sum = a.ratings_sum + EXCLUDED.ratings_sum,
+        histogram = ARRAY[
+            a.histogram[1] + EXCLUDED.histogram[1],
+            a.histogram[2] + EXCLUDED.histogram[2],
+            a.histogram[3] + EXCLUDED.histogram[3],
+            a.histogram[4] + EXCLUDED.histogram[4],
+            a.histogram[5] + EXCLUDED.histogram[5]
+        ],
+        updated_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER ratings_aggregate
+AFTER INSERT ON ratings
+REFERENCING NEW TABLE AS new_ratings
+FOR EACH STATEMENT EXECUTE FUNCTION update_rating_aggregates();
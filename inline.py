@@ -0,0 +1,77 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+def normalize_query(query):
+    """Приводит inline-запрос к ключу кэша: регистр и лишние пробелы не важны"""
+    return ' '.join((query or '').lower().split())
+
+
+class InlineResultCache:
+    """LRU-кэш готовых результатов inline-запросов
+
+    Для каждого запроса хранится кортеж результатов с заранее сериализованным
+    JSON, поэтому популярные запросы отдаются без обращения к БД и без сборки
+    объектов Bot API.
+    """
+
+    def __init__(self, build, page_size=50, max_entries=1000, ttl=300.0):
+        # build(запрос) -> список готовых результатов
+        self.build = build
+        self.page_size = page_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # запрос -> (результаты, время сборки)
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query):
+        """Все результаты запроса (из кэша или собранные заново)"""
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        results = tuple(self.build(key))
+        with self._lock:
+            self._entries[key] = (results, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return results
+
+    def page(self, query, offset=''):
+        """Страница результатов и next_offset ('' - страниц больше нет)"""
+        try:
+            start = max(int(offset), 0) if offset else 0
+        except ValueError:
+            start = 0
+        results = self.get(query)
+        end = start + self.page_size
+        return results[start:end], str(end) if end < len(results) else ''
+
+    def invalidate(self, key=None):
+        """Сбрасывает кэш при изменении каталога"""
+        if key is not None:
+            # По одному ключу сбрасываются только производные данные каталога
+            return
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0
+            }
@@ -0,0 +1,71 @@
+from collections import namedtuple
+
+from telebot import types
+
+# Готовое меню: текст сообщения и клавиатура, сериализованная один раз
+Menu = namedtuple('Menu', ['key', 'text', 'markup', 'back'])
+
+
+class PrebuiltMarkup(types.JsonSerializable):
+    """Неизменяемый объект Bot API (клавиатура, результат inline-запроса): JSON строится один раз"""
+
+    def __init__(self, markup):
+        self._json = markup.to_json()
+
+    def to_json(self):
+        return self._json
+
+
+def build_keyboard(rows):
+    """Собирает InlineKeyboardMarkup из рядов кнопок
+
+    Кнопка - пара (текст, callback_data) или (текст, {'url': ...}); ряд - кнопка или список кнопок.
+    """
+    keyboard = types.InlineKeyboardMarkup()
+    for row in rows:
+        buttons = row if isinstance(row, list) else [row]
+        keyboard.row(*[
+            types.InlineKeyboardButton(text, **target) if isinstance(target, dict)
+            else types.InlineKeyboardButton(text, callback_data=target)
+            for text, target in buttons
+        ])
+    return keyboard
+
+
+class MenuRegistry:
+    """Реестр статических меню и клавиатур, собранных при старте бота"""
+
+    def __init__(self, main_menu_key='main_menu', main_menu_text='🏠 Главное меню', back_text='🔙 Назад'):
+        self.main_menu_key = main_menu_key
+        self.main_menu_text = main_menu_text
+        self.back_text = back_text
+        self._menus = {}
+        self._keyboards = {}
+
+    def menu(self, key, text, buttons, back=None, main_menu=True, nav_in_row=False, back_text=None):
+        """Объявляет меню: кнопки, цель кнопки 'Назад' и кнопку главного меню"""
+        nav = []
+        if back:
+            nav.append((back_text or self.back_text, back))
+        if main_menu:
+            nav.append((self.main_menu_text, self.main_menu_key))
+        rows = list(buttons) + ([nav] if nav_in_row and nav else nav)
+        self._menus[key] = Menu(key, text, PrebuiltMarkup(build_keyboard(rows)), back)
+        return self._menus[key]
+
+    def keyboard(self, key, rows):
+        """Объявляет клавиатуру без собственного текста (например, звезды оценки)"""
+        self._keyboards[key] = PrebuiltMarkup(build_keyboard(rows))
+        return self._keyboards[key]
+
+    def get(self, key):
+        return self._menus.get(key)
+
+    def get_keyboard(self, key):
+        return self._keyboards[key]
+
+    def keys(self):
+        return list(self._menus)
+
+    def __contains__(self, key):
+        return key in self._menus
@@ -0,0 +1,340 @@
+"""Метрики бота в текстовом формате Prometheus
+
+Счетчики и гистограммы обновляются в обработчиках, а значения, которые уже
+считают другие компоненты (stats() кэшей, очередей, пула), снимаются функциями
+в момент опроса. MetricsServer отдает все метрики по GET /metrics.
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import redis
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм по умолчанию (секунды): от запросов к Redis до долгих обработчиков
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        # значения меток -> значение метрики
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labels}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счетчики по корзинам, сумма, количество]
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        samples = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f'{self.name}_bucket', key, (('le', _format_value(bound)),), cumulative))
+            samples.append((f'{self.name}_bucket', key, (('le', '+Inf'),), count))
+            samples.append((f'{self.name}_sum', key, (), total))
+            samples.append((f'{self.name}_count', key, (), count))
+        return samples
+
+
+class _CallbackMetric(_Metric):
+    """Метрика, значение которой вычисляет функция в момент опроса"""
+
+    def __init__(self, name, help, collect, labels=(), kind='gauge'):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        # collect() -> число или словарь {значение метки (или кортеж значений): число}
+        self.collect = collect
+
+    def samples(self):
+        value = self.collect()
+        if not isinstance(value, dict):
+            return [(self.name, (), (), value)]
+        return [
+            (self.name, key if isinstance(key, tuple) else (key,), (), item)
+            for key, item in value.items()
+        ]
+
+
+def cached(collect, interval):
+    """Вызывает дорогую функцию сбора не чаще раза в interval секунд"""
+    lock = threading.Lock()
+    state = {'value': None, 'at': None}
+
+    def wrapper():
+        with lock:
+            now = time.monotonic()
+            if state['at'] is None or now - state['at'] >= interval:
+                state['value'] = collect()
+                state['at'] = now
+            return state['value']
+    return wrapper
+
+
+def timing_observer(histogram, errors, label):
+    """observe(значение метки, секунды, ошибка) для гистограммы времени и счетчика ошибок"""
+    def observe(value, seconds, failed=False):
+        histogram.observe(seconds, **{label: value})
+        if failed:
+            errors.inc(**{label: value})
+    return observe
+
+
+class MetricsRegistry:
+    """Набор метрик с общим префиксом имени"""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = []
+        self._lock = threading.Lock()
+        self.collect_errors = 0
+
+    def _add(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(self.prefix + name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(self.prefix + name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help, labels, buckets))
+
+    def callback(self, name, help, collect, labels=(), kind='gauge'):
+        """Метрика, которая читается функцией collect() при каждом опросе"""
+        return self._add(_CallbackMetric(self.prefix + name, help, collect, labels, kind))
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # Ошибка одного источника не должна ломать весь ответ
+                self.collect_errors += 1
+                logger.error(f"Ошибка сбора метрики {metric.name}: {e}")
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, key, extra, value in samples:
+                lines.append(f'{name}{_format_labels(metric.labels, key, extra)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """HTTP-сервер, отдающий метрики по GET /metrics"""
+
+    def __init__(self, registry, host='0.0.0.0', port=8000, path='/metrics'):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.path = path
+        self._httpd = None
+        self._thread = None
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != server.path:
+                    self.send_error(404)
+                    return
+                body = server.registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+        logger.info(f"Метрики доступны на http://{self.host}:{self._httpd.server_port}{self.path}")
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+
+# --- Замер времени команд Redis ---
+
+class TimedRedis(redis.Redis):
+    """Клиент Redis, сообщающий время каждой команды и пайплайна: observe(команда, секунды, ошибка)"""
+
+    def __init__(self, *args, observe=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.observe = observe
+
+    def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        failed = False
+        try:
+            return super().execute_command(*args, **options)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if self.observe is not None:
+                self.observe(str(args[0]).lower(), time.perf_counter() - started, failed)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipe.observe = self.observe
+        return pipe
+
+
+class TimedPipeline(redis.client.Pipeline):
+    observe = None
+
+    def execute(self, raise_on_error=True):
+        started = time.perf_counter()
+        failed = False
+        try:
+            return super().execute(raise_on_error)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if self.observe is not None:
+                self.observe('pipeline', time.perf_counter() - started, failed)
+
+
+class TimedAsyncRedis(aioredis.Redis):
+    """То же для redis.asyncio (асинхронный режим)"""
+
+    def __init__(self, *args, observe=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.observe = observe
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await super().execute_command(*args, **options)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if self.observe is not None:
+                self.observe(str(args[0]).lower(), time.perf_counter() - started, failed)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = TimedAsyncPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipe.observe = self.observe
+        return pipe
+
+
+class TimedAsyncPipeline(aioredis.client.Pipeline):
+    observe = None
+
+    async def execute(self, raise_on_error=True):
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await super().execute(raise_on_error)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if self.observe is not None:
+                self.observe('pipeline', time.perf_counter() - started, failed)
@@ -0,0 +1,72 @@
+"""Компактные позиции листания курсов
+
+Вместо списка карточек курсов в сессии хранится только ключ списка (фильтр
+каталога), позиция, id курса и id сообщения. Сами курсы берутся из кэша каталога.
+Листание рекомендаций опроса состояния в сессии не требует: оно целиком в
+callback_data кнопок (см. callback_codec.py).
+"""
+import time
+
+
+class NavState:
+    """Позиция пользователя в списке курсов"""
+
+    __slots__ = ('key', 'position', 'course_id', 'message_id', 'touched')
+
+    def __init__(self, key, position=0, course_id=None, message_id=None, touched=None):
+        # Фильтр каталога (finance, pps, search, ...)
+        self.key = key
+        self.position = position
+        self.course_id = course_id
+        self.message_id = message_id
+        self.touched = touched
+
+    def to_list(self):
+        return [self.key, self.position, self.course_id, self.message_id, self.touched]
+
+    @classmethod
+    def from_list(cls, values):
+        return cls(*values)
+
+    def __repr__(self):
+        return f"NavState({self.key!r}, position={self.position}, course_id={self.course_id})"
+
+
+class NavigationStore:
+    """Позиции листания поверх пространства имен сессий
+
+    Запись - короткий список [ключ, позиция, id курса, id сообщения, время], а не
+    карточки курсов. Запись, к которой не обращались дольше ttl секунд, считается
+    устаревшей и удаляется при чтении (сама сессия живет по своему TTL).
+    """
+
+    def __init__(self, namespace, ttl=None):
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def get(self, user_id):
+        raw = self.namespace.get(user_id)
+        if raw is None:
+            return None
+        if not isinstance(raw, list):
+            # Запись старого формата (словарь с карточками курсов)
+            self.namespace.pop(user_id, None)
+            return None
+        state = NavState.from_list(raw)
+        if self.ttl and state.touched and time.time() - state.touched > self.ttl:
+            self.namespace.pop(user_id, None)
+            return None
+        return state
+
+    def set(self, user_id, state):
+        state.touched = int(time.time())
+        self.namespace[user_id] = state.to_list()
+
+    def pop(self, user_id):
+        state = self.get(user_id)
+        if state is not None:
+            self.namespace.pop(user_id, None)
+        return state
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
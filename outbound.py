@@ -0,0 +1,319 @@
+"""Очередь исходящих вызовов Bot API с ограничением скорости
+
+Telegram ограничивает рассылку примерно 30 сообщениями в секунду на бота и
+примерно одним сообщением в секунду на чат (20 в минуту для групп). Вызовы
+проходят через общий токен-бакет и бакет чата, поэтому бот не упирается в
+429 Too Many Requests. Если 429 все же пришел, вызов повторяется после
+retry_after, а остальные чаты продолжают получать сообщения.
+
+Вызовы одного чата выполняются по одному: обработчик не ждет отправки, поэтому
+порядок сообщений в чате обеспечивает сама очередь. Ожидающие вызовы чата
+упорядочены по приоритету, а внутри приоритета - по времени постановки: ответ
+пользователю не ждет рассылку в тот же чат. Редактирование меню
+в ответ на нажатие (EDIT) не расходует бакет чата - лимит в секунду касается
+новых сообщений, а листание каталога не должно ждать.
+"""
+import os
+import time
+import heapq
+import logging
+import threading
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше - раньше
+EDIT = 0          # редактирование меню в ответ на нажатие
+INTERACTIVE = 1   # ответы пользователю
+BULK = 2          # рассылки
+PRIORITY_NAMES = {EDIT: 'edit', INTERACTIVE: 'interactive', BULK: 'bulk'}
+
+
+class TokenBucket:
+    """Токен-бакет: rate токенов в секунду, не больше capacity в запасе"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now):
+        """Сколько ждать до появления токена (0 - токен есть)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Call:
+    __slots__ = ('priority', 'seq', 'chat_id', 'call', 'future', 'enqueued', 'attempts')
+
+    def __init__(self, priority, seq, chat_id, call):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.call = call
+        self.future = Future()
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+
+
+class OutboundDispatcher:
+    """Планировщик исходящих вызовов: приоритетная очередь, лимиты и повторы после 429"""
+
+    def __init__(self, global_rate=30.0, chat_rate=1.0, chat_burst=3, group_rate=20 / 60.0,
+                 workers=8, max_retries=5):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.workers = workers
+        # Общий лимит без запаса: вызовы идут равномерно, и в любом окне в секунду их не больше global_rate
+        self._global = TokenBucket(global_rate, 1)
+        self._chats = {}
+        # Чат -> куча (приоритет, номер, вызов), ждущих завершения текущего вызова этого чата
+        # (ключ есть, пока у чата есть вызов в работе)
+        self._chat_queues = {}
+        # Чат -> время, до которого Telegram попросил не писать (retry_after)
+        self._paused = {}
+        self._ready = []
+        self._delayed = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        # Вызовы в работе: после 429 они возвращаются в очередь
+        self._inflight = 0
+        self._thread = None
+        self._executor = None
+        self._last_prune = time.monotonic()
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.deferred = 0
+        self._wait_total = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self._wait_max = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self._wait_count = {priority: 0 for priority in PRIORITY_NAMES}
+
+    @classmethod
+    def from_env(cls):
+        """Создает планировщик по переменным окружения"""
+        return cls(
+            global_rate=float(os.getenv('OUTBOUND_GLOBAL_RATE', 30)),
+            chat_rate=float(os.getenv('OUTBOUND_CHAT_RATE', 1)),
+            chat_burst=int(os.getenv('OUTBOUND_CHAT_BURST', 3)),
+            group_rate=float(os.getenv('OUTBOUND_GROUP_RATE', 20 / 60.0)),
+            workers=int(os.getenv('OUTBOUND_WORKERS', 8)),
+            max_retries=int(os.getenv('OUTBOUND_MAX_RETRIES', 5))
+        )
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='outbound')
+        self._thread = threading.Thread(target=self._run, name='outbound-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30.0):
+        """Отправляет то, что уже в очереди, и останавливает планировщик"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+        self._thread = None
+
+    def submit(self, chat_id, call, priority=INTERACTIVE):
+        """Ставит вызов в очередь; возвращает Future с результатом call()"""
+        item = _Call(priority, next(self._seq), chat_id, call)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Очередь исходящих сообщений остановлена")
+            if chat_id is not None and chat_id in self._chat_queues:
+                # У чата уже есть вызов в очереди или в работе - этот выполнится после него
+                heapq.heappush(self._chat_queues[chat_id], (item.priority, item.seq, item))
+                return item.future
+            if chat_id is not None:
+                self._chat_queues[chat_id] = []
+            heapq.heappush(self._ready, (item.priority, item.seq, item))
+            self._cond.notify()
+        return item.future
+
+    def _advance(self, chat_id):
+        """Текущий вызов чата завершен: в очередь встает самый приоритетный из ждущих вызовов чата"""
+        if chat_id is None:
+            return
+        waiting = self._chat_queues.get(chat_id)
+        if waiting:
+            _, _, item = heapq.heappop(waiting)
+            heapq.heappush(self._ready, (item.priority, item.seq, item))
+        else:
+            self._chat_queues.pop(chat_id, None)
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные id - группы и каналы, у них лимит строже
+            rate = self.group_rate if str(chat_id).startswith('-') else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst, now)
+        return bucket
+
+    def _chat_wait(self, item, now):
+        if item.chat_id is None:
+            return 0.0
+        paused_until = self._paused.get(item.chat_id)
+        if paused_until is not None:
+            if paused_until > now:
+                return paused_until - now
+            del self._paused[item.chat_id]
+        if item.priority == EDIT:
+            return 0.0
+        return self._chat_bucket(item.chat_id, now).wait_time(now)
+
+    def _prune(self, now):
+        """Забывает бакеты чатов, которые давно ничего не получали, и истекшие паузы после 429"""
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        for chat_id in [c for c, bucket in self._chats.items() if bucket.is_full(now)]:
+            del self._chats[chat_id]
+        for chat_id in [c for c, until in self._paused.items() if until <= now]:
+            del self._paused[chat_id]
+
+    def _next(self):
+        """Ждет вызов, который можно выполнить прямо сейчас; None - очередь закрыта и пуста"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, _, item = heapq.heappop(self._delayed)
+                    heapq.heappush(self._ready, (item.priority, item.seq, item))
+
+                timeout = None
+                if self._ready:
+                    global_wait = self._global.wait_time(now)
+                    if global_wait <= 0:
+                        _, _, item = heapq.heappop(self._ready)
+                        chat_wait = self._chat_wait(item, now)
+                        if chat_wait > 0:
+                            # Чат занят - откладываем только его вызов, остальные идут дальше
+                            heapq.heappush(self._delayed, (now + chat_wait, item.seq, item))
+                            self.deferred += 1
+                            continue
+                        self._global.consume(now)
+                        if item.chat_id is not None and item.priority != EDIT:
+                            self._chat_bucket(item.chat_id, now).consume(now)
+                        self._prune(now)
+                        self._inflight += 1
+                        return item
+                    timeout = global_wait
+                elif self._closed and not self._delayed and not self._inflight:
+                    return None
+
+                if self._delayed:
+                    delay = self._delayed[0][0] - now
+                    timeout = delay if timeout is None else min(timeout, delay)
+                self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            self._executor.submit(self._execute, item)
+
+    def _execute(self, item):
+        done = True
+        try:
+            done = self._perform(item)
+        finally:
+            with self._cond:
+                self._inflight -= 1
+                if done:
+                    self._advance(item.chat_id)
+                self._cond.notify()
+
+    def _perform(self, item):
+        """Выполняет вызов; False, если он отложен до повтора после 429"""
+        waited = time.monotonic() - item.enqueued
+        item.attempts += 1
+        try:
+            result = item.call()
+        except Exception as e:
+            retry_after = self._retry_after(e)
+            if retry_after is not None and item.attempts <= self.max_retries:
+                self._retry(item, retry_after)
+                return False
+            with self._cond:
+                self.failed += 1
+            item.future.set_exception(e)
+            return True
+
+        with self._cond:
+            self.sent += 1
+            self._wait_total[item.priority] += waited
+            self._wait_max[item.priority] = max(self._wait_max[item.priority], waited)
+            self._wait_count[item.priority] += 1
+        item.future.set_result(result)
+        return True
+
+    @staticmethod
+    def _retry_after(error):
+        """retry_after из ответа 429 или None для остальных ошибок"""
+        if getattr(error, 'error_code', None) != 429:
+            return None
+        result_json = getattr(error, 'result_json', None) or {}
+        return float(result_json.get('parameters', {}).get('retry_after', 1))
+
+    def _retry(self, item, retry_after):
+        logger.warning(f"Telegram ограничил отправку в чат {item.chat_id}, повтор через {retry_after} с")
+        with self._cond:
+            self.retried += 1
+            until = time.monotonic() + retry_after
+            if item.chat_id is not None:
+                self._paused[item.chat_id] = max(until, self._paused.get(item.chat_id, 0))
+            heapq.heappush(self._delayed, (until, item.seq, item))
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            waiting = [item for items in self._chat_queues.values() for _, _, item in items]
+            for item in [item for _, _, item in self._ready + self._delayed] + waiting:
+                queued[PRIORITY_NAMES[item.priority]] += 1
+            stats = {
+                'queued': queued,
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried_429': self.retried,
+                'deferred': self.deferred,
+                'chats': len(self._chats),
+                'paused_chats': len(self._paused)
+            }
+            for priority, name in PRIORITY_NAMES.items():
+                count = self._wait_count[priority]
+                stats[f'{name}_wait_avg_ms'] = round(self._wait_total[priority] / count * 1000, 2) if count else 0.0
+                stats[f'{name}_wait_max_ms'] = round(self._wait_max[priority] * 1000, 2)
+            return stats
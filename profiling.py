@@ -0,0 +1,275 @@
+"""Профилирование обработки апдейтов по запросу
+
+Пока профилирование выключено, оно ничего не стоит: middleware добавляется в
+бота только на время сеанса и сразу убирается. Сеанс ограничен временем или
+числом апдейтов. Режимы: 'cprofile' (точный, профиль на каждый поток обработки)
+и 'sample' (выборка стеков раз в interval секунд - почти без накладных расходов,
+подходит и для асинхронного режима). Дополнительно tracemalloc показывает, где
+выросла память. Отчет сохраняется в файл и передается в on_report.
+"""
+import os
+import io
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+
+from telebot.handler_backends import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+CPROFILE = 'cprofile'
+SAMPLE = 'sample'
+
+
+class _ProfilingMiddleware(BaseMiddleware):
+    def __init__(self, session):
+        super().__init__()
+        self.update_types = ['message', 'callback_query', 'inline_query']
+        self.session = session
+
+    def pre_process(self, message, data):
+        self.session.enter()
+
+    def post_process(self, message, data, exception):
+        self.session.leave()
+
+
+class ProfilingSession:
+    """Один сеанс профилирования: от start() до finish()"""
+
+    def __init__(self, mode=CPROFILE, seconds=30.0, max_updates=None, memory=True,
+                 interval=0.005, handler_files=()):
+        if mode not in (CPROFILE, SAMPLE):
+            raise ValueError(f"Неизвестный режим профилирования: {mode}")
+        self.mode = mode
+        self.seconds = seconds
+        self.max_updates = max_updates
+        self.memory = memory
+        self.interval = interval
+        # Файлы с обработчиками: время их функций выводится отдельно
+        self.handler_files = {os.path.abspath(path) for path in handler_files}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        # Поток -> [профиль, сколько апдейтов этого потока сейчас в работе]
+        self._threads = {}
+        self._samples = Counter()
+        self._inclusive = Counter()
+        self._sample_count = 0
+        self._stop = threading.Event()
+        self._on_done = None
+        self._tracemalloc_started = False
+        self._snapshot = None
+        self.updates = 0
+        self.skipped = 0
+        self.started = None
+        self.finished = None
+
+    def start(self, on_done):
+        self._on_done = on_done
+        self.started = time.monotonic()
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+                self._tracemalloc_started = True
+            self._snapshot = tracemalloc.take_snapshot()
+        if self.mode == SAMPLE:
+            threading.Thread(target=self._sample_loop, name='profiler-sampler', daemon=True).start()
+        if self.seconds:
+            timer = threading.Timer(self.seconds, self.finish)
+            timer.daemon = True
+            timer.start()
+
+    # --- Апдейты ---
+
+    def enter(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            if self._stop.is_set():
+                return
+            state = self._threads.setdefault(thread_id, [None, 0])
+            state[1] += 1
+            if state[1] > 1 or self.mode != CPROFILE:
+                return
+            if state[0] is None:
+                state[0] = cProfile.Profile()
+        try:
+            state[0].enable()
+        except ValueError:
+            # В потоке уже работает другой профилировщик
+            with self._lock:
+                self.skipped += 1
+
+    def leave(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            state = self._threads.get(thread_id)
+            if state is None or state[1] == 0:
+                return
+            state[1] -= 1
+            self.updates += 1
+            done = self.max_updates is not None and self.updates >= self.max_updates
+            disable = state[1] == 0 and state[0] is not None
+        if disable:
+            state[0].disable()
+            with self._lock:
+                self._idle.notify_all()
+        if done:
+            # Отчет собирается в отдельном потоке, чтобы не задерживать ответ пользователю
+            threading.Thread(target=self.finish, name='profiler-report', daemon=True).start()
+
+    # --- Выборка стеков ---
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                active = [thread_id for thread_id, state in self._threads.items() if state[1]]
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id in active:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                with self._lock:
+                    self._sample_count += 1
+                    self._samples[stack[0]] += 1
+                    self._inclusive.update(set(stack))
+
+    # --- Отчет ---
+
+    def finish(self, drain_timeout=10.0):
+        with self._lock:
+            if self._stop.is_set():
+                return
+            self._stop.set()
+            self.finished = time.monotonic()
+            # cProfile выключается только в своем потоке: ждем, пока начатые апдейты закончатся
+            deadline = time.monotonic() + drain_timeout
+            while any(state[1] for state in self._threads.values()) and time.monotonic() < deadline:
+                self._idle.wait(deadline - time.monotonic())
+            profiles = [state[0] for state in self._threads.values() if state[0] is not None and not state[1]]
+        memory = None
+        if self.memory:
+            memory = tracemalloc.take_snapshot().compare_to(self._snapshot, 'lineno')
+            if self._tracemalloc_started:
+                tracemalloc.stop()
+        try:
+            self._on_done(self, profiles, memory)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения отчета профилирования: {e}")
+
+    def _is_handler(self, filename):
+        return os.path.abspath(filename) in self.handler_files
+
+    def report(self, profiles, memory, top=40):
+        """Текст отчета и (для cprofile) pstats.Stats"""
+        elapsed = (self.finished or time.monotonic()) - self.started
+        out = io.StringIO()
+        out.write(f"Профилирование обработки апдейтов: режим {self.mode}, {elapsed:.1f} с, "
+                  f"апдейтов {self.updates}\n")
+        if self.skipped:
+            out.write(f"Пропущено апдейтов (занят другим профилировщиком): {self.skipped}\n")
+
+        stats = None
+        if self.mode == CPROFILE:
+            profiles = [profile for profile in profiles if profile.getstats()]
+            if profiles:
+                stats = pstats.Stats(profiles[0], stream=out)
+                for profile in profiles[1:]:
+                    stats.add(profile)
+                handlers = [
+                    (ct, nc, name, lineno)
+                    for (filename, lineno, name), (cc, nc, tt, ct, callers) in stats.stats.items()
+                    if self._is_handler(filename)
+                ]
+                out.write("\n== Время в функциях бота (включая вложенные вызовы) ==\n")
+                for ct, nc, name, lineno in sorted(handlers, reverse=True)[:top]:
+                    out.write(f"{ct * 1000:12.1f} мс  {nc:8} вызовов  {name} (строка {lineno})\n")
+                out.write(f"\n== Топ-{top} функций по общему времени ==\n")
+                stats.sort_stats('cumulative').print_stats(top)
+        else:
+            to_ms = self.interval * 1000
+            out.write(f"Выборок стека: {self._sample_count}, интервал {to_ms:.1f} мс\n")
+            out.write("\n== Время в функциях бота (включая вложенные вызовы) ==\n")
+            handlers = [(count, key) for key, count in self._inclusive.items() if self._is_handler(key[0])]
+            for count, (filename, lineno, name) in sorted(handlers, reverse=True)[:top]:
+                out.write(f"{count * to_ms:12.1f} мс  {name} (строка {lineno})\n")
+            out.write(f"\n== Топ-{top} функций по собственному времени ==\n")
+            for (filename, lineno, name), count in self._samples.most_common(top):
+                out.write(f"{count * to_ms:12.1f} мс  {name}  {filename}:{lineno}\n")
+
+        if memory is not None:
+            out.write("\n== Рост памяти (tracemalloc) ==\n")
+            for diff in memory[:20]:
+                out.write(f"{diff}\n")
+        return out.getvalue(), stats
+
+
+class UpdateProfiler:
+    """Запускает сеансы профилирования для бота (не больше одного одновременно)"""
+
+    def __init__(self, bot, report_dir='profiles', handler_files=(), on_report=None):
+        self.bot = bot
+        self.report_dir = report_dir
+        self.handler_files = handler_files
+        # on_report(путь к отчету, сеанс, адресат) - например, отправка файла в чат
+        self.on_report = on_report
+        self._lock = threading.Lock()
+        self._session = None
+        self._middleware = None
+
+    @property
+    def active(self):
+        return self._session is not None
+
+    def start(self, mode=CPROFILE, seconds=30.0, max_updates=None, memory=True, reply_to=None):
+        """Начинает сеанс; False, если профилирование уже идет"""
+        session = ProfilingSession(
+            mode, seconds, max_updates, memory, handler_files=self.handler_files
+        )
+        with self._lock:
+            if self._session is not None:
+                return False
+            self._session = session
+            self._middleware = _ProfilingMiddleware(session)
+        session.start(lambda session, profiles, memory: self._done(session, profiles, memory, reply_to))
+        # Первым в списке: в замер входят остальные middleware
+        self.bot.middlewares.insert(0, self._middleware)
+        logger.info(f"Профилирование запущено: {mode}, {seconds} с, апдейтов {max_updates}")
+        return True
+
+    def stop(self):
+        """Досрочно завершает сеанс (отчет все равно сохраняется)"""
+        session = self._session
+        if session is not None:
+            session.finish()
+
+    def _done(self, session, profiles, memory, reply_to):
+        with self._lock:
+            if self._middleware in self.bot.middlewares:
+                self.bot.middlewares.remove(self._middleware)
+            self._session = None
+            self._middleware = None
+
+        text, stats = session.report(profiles, memory)
+        os.makedirs(self.report_dir, exist_ok=True)
+        name = time.strftime('profile-%Y%m%d-%H%M%S')
+        path = os.path.join(self.report_dir, f'{name}.txt')
+        with open(path, 'w') as f:
+            f.write(text)
+        if stats is not None:
+            # Для snakeviz / pstats
+            stats.dump_stats(os.path.join(self.report_dir, f'{name}.pstats'))
+        logger.info(f"Отчет профилирования сохранен: {path}")
+        if self.on_report is not None:
+            self.on_report(path, session, reply_to)
@@ -0,0 +1,194 @@
+import os
+import time
+import queue
+import logging
+import threading
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+INSERT_RATINGS = "INSERT INTO ratings (user_id, rating_type, target, rating, created_at) VALUES %s"
+
+
+class RatingWriter:
+    """Отложенная пакетная запись оценок
+
+    Обработчики только ставят оценку в очередь. Фоновый поток пишет накопленные
+    оценки одним многострочным INSERT, когда набрался пакет или прошел интервал.
+    """
+
+    def __init__(self, pool, batch_size=500, flush_interval=1.0, queue_size=100000,
+                 retry_backoff=0.5, max_backoff=30.0, on_flush=None):
+        self.pool = pool
+        # Вызывается со списком записанных строк (например, чтобы сбросить кэш итогов)
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.direct_writes = 0
+        self.flushes = 0
+        self.retries = 0
+        self._flush_total = 0.0
+        self._flush_max = 0.0
+
+    @classmethod
+    def from_env(cls, pool, on_flush=None):
+        """Создает запись оценок по переменным окружения"""
+        return cls(
+            pool,
+            on_flush=on_flush,
+            batch_size=int(os.getenv('RATINGS_BATCH_SIZE', 500)),
+            flush_interval=float(os.getenv('RATINGS_FLUSH_INTERVAL', 1.0)),
+            queue_size=int(os.getenv('RATINGS_QUEUE_SIZE', 100000))
+        )
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='rating-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, rating_type, target, rating):
+        """Ставит оценку в очередь на запись"""
+        row = (user_id, rating_type, target, rating, datetime.now())
+        if self._thread is None or not self._thread.is_alive():
+            # Фоновая запись не запущена (скрипты, остановка бота) - пишем сразу
+            self._write_direct([row])
+            return
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # Очередь переполнена: оценку не теряем, пишем синхронно
+            logger.warning("Очередь оценок переполнена, запись напрямую")
+            self._write_direct([row])
+            return
+        with self._lock:
+            self.enqueued += 1
+
+    def stop(self, timeout=30.0):
+        """Останавливает запись, предварительно сохранив все оценки из очереди"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"Запись оценок не завершилась за {timeout} с, в очереди {self._queue.qsize()}")
+        self._thread = None
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+            elif self._stop.is_set():
+                return
+
+    def _collect(self):
+        """Ждет первую оценку, затем добирает пакет до batch_size или до конца интервала"""
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if self._stop.is_set():
+                # При остановке забираем остаток без ожидания
+                timeout = 0
+            elif deadline is None:
+                timeout = self.flush_interval
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+            try:
+                row = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                if batch or self._stop.is_set():
+                    break
+                continue
+            batch.append(row)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+        return batch
+
+    def _flush(self, batch):
+        """Пишет пакет; при недоступности БД повторяет с нарастающей паузой"""
+        backoff = self.retry_backoff
+        attempts = 0
+        while True:
+            started = time.monotonic()
+            attempts += 1
+            try:
+                self._insert(batch)
+                break
+            except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+                # Пакет отвергнут из-за отдельных строк: пишем по одной, плохие отбрасываем
+                logger.warning(f"Пакет оценок отклонен ({e}), запись по одной")
+                self._write_direct(batch)
+                return
+            except Exception as e:
+                with self._lock:
+                    self.retries += 1
+                logger.error(f"Ошибка записи {len(batch)} оценок, повтор через {backoff:.1f} с: {e}")
+                if self._stop.is_set() and attempts >= 3:
+                    # Бот останавливается, а БД так и не ответила
+                    with self._lock:
+                        self.dropped += len(batch)
+                    logger.error(f"Потеряно {len(batch)} оценок при остановке")
+                    return
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.written += len(batch)
+            self.flushes += 1
+            self._flush_total += elapsed
+            self._flush_max = max(self._flush_max, elapsed)
+
+    def _insert(self, rows):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, INSERT_RATINGS, rows, page_size=self.batch_size)
+        if self.on_flush is not None:
+            try:
+                self.on_flush(rows)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика записи оценок: {e}")
+
+    def _write_direct(self, rows):
+        for row in rows:
+            try:
+                self._insert([row])
+            except Exception as e:
+                with self._lock:
+                    self.dropped += 1
+                logger.error(f"Ошибка сохранения оценки: {e}")
+                continue
+            with self._lock:
+                self.written += 1
+                self.direct_writes += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'direct_writes': self.direct_writes,
+                'flushes': self.flushes,
+                'retries': self.retries,
+                'flush_avg_ms': round(self._flush_total / self.flushes * 1000, 2) if self.flushes else 0.0,
+                'flush_max_ms': round(self._flush_max * 1000, 2)
+            }
@@ -0,0 +1,152 @@
+import logging
+import threading
+from itertools import product
+
+from aio import in_async_context
+
+logger = logging.getLogger(__name__)
+
+# Ответы опроса -> критерии подбора
+ROLE_CATEGORIES = {
+    'Студент': 'students',
+    'АУП': 'aup',
+    'Руководство': 'guide',
+    'ППС': 'pps'
+}
+
+DIRECTIONS = {
+    'Финансы': 'finance',
+    'Управление': 'management',
+    'Педагогика': 'pedagogy'
+}
+
+BUDGET_FILTERS = {
+    'До 10 000 руб.': lambda x: x <= 10000,
+    '10-20 000 руб.': lambda x: 10000 < x <= 20000,
+    'Более 20 000 руб.': lambda x: x > 20000
+}
+
+DURATION_FILTERS = {
+    '1-4 недели': lambda x: x <= 4,
+    '5-8 недель': lambda x: 5 <= x <= 8,
+    'Более 8 недель': lambda x: x > 8
+}
+
+
+def match_courses(courses_by_role, answers):
+    """Подбирает курсы по ответам опроса (без индекса)"""
+    courses = courses_by_role.get(ROLE_CATEGORIES.get(answers.get('role')), [])
+
+    selected_direction = answers.get('direction')
+    if selected_direction:
+        target_direction = DIRECTIONS.get(selected_direction)
+        courses = [c for c in courses if c.get('direction') == target_direction]
+
+    budget_func = BUDGET_FILTERS.get(answers.get('budget'), lambda x: True)
+    duration_func = DURATION_FILTERS.get(answers.get('time'), lambda x: True)
+    courses = [c for c in courses if budget_func(c['price']) and duration_func(c['duration'])]
+
+    # Удаление дубликатов по названию
+    seen = set()
+    unique_courses = []
+    for c in courses:
+        if c['title'] not in seen:
+            seen.add(c['title'])
+            unique_courses.append(c)
+    return unique_courses
+
+
+class RecommendationIndex:
+    """Предрасчитанные рекомендации для всех комбинаций ответов опроса
+
+    Комбинаций мало (роль x направление x время x бюджет), поэтому при изменении
+    каталога индекс пересобирается целиком, а завершение опроса - поиск в словаре.
+    Индекс живет в памяти каждого процесса, а не в Redis: он собирается из кэша
+    каталога за миллисекунды, а согласованность между репликами обеспечивает общий
+    для всех сброс кэша (NOTIFY из БД, а при его потере - TTL).
+    """
+
+    def __init__(self, questions, load_courses_by_role, catalog_keys=None):
+        # Ключ индекса - ответы в порядке вопросов опроса
+        self.keys = [q['key'] for q in questions]
+        self.options = [q['options'] for q in questions]
+        self.load_courses_by_role = load_courses_by_role
+        # Ключи кэша каталога, из которых собирается индекс (None - любой ключ)
+        self.catalog_keys = None if catalog_keys is None else frozenset(catalog_keys)
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        # combo -> кортеж карточек курсов (общие объекты из кэша каталога)
+        self._index = None
+        self._generation = 0
+
+        self.builds = 0
+        self.lookups = 0
+        self.fallbacks = 0
+
+    def invalidate(self, key=None):
+        """Помечает индекс устаревшим (подписывается на сброс кэша каталога)
+
+        Сбрасывается при сбросе всего каталога и ключей, из которых собран индекс, в том
+        числе по истечении их TTL. Сброс остальных ключей (итоги оценок после каждой
+        записи оценок) индекс не трогает, иначе под нагрузкой он пересобирался бы постоянно.
+        """
+        if key is not None and self.catalog_keys is not None and key not in self.catalog_keys:
+            return
+        with self._lock:
+            self._index = None
+            self._generation += 1
+
+    def build(self):
+        """Пересчитывает рекомендации для всех комбинаций ответов"""
+        with self._lock:
+            generation = self._generation
+        courses_by_role = self.load_courses_by_role()
+
+        index = {
+            combo: tuple(match_courses(courses_by_role, dict(zip(self.keys, combo))))
+            for combo in product(*self.options)
+        }
+
+        with self._lock:
+            # Если каталог поменялся во время сборки, результат уже устарел
+            if generation == self._generation:
+                self._index = index
+            self.builds += 1
+        logger.info(f"Индекс рекомендаций собран: {len(index)} комбинаций")
+        return index
+
+    def _snapshot(self):
+        with self._lock:
+            if self._index is not None:
+                return self._index
+        if in_async_context():
+            # Как и в кэше каталога, в асинхронном режиме не ждем блокировку в цикле событий
+            return self.build()
+        with self._build_lock:
+            with self._lock:
+                if self._index is not None:
+                    return self._index
+            return self.build()
+
+    def recommend(self, answers):
+        """Возвращает список рекомендованных курсов для ответов опроса"""
+        combo = tuple(answers.get(key) for key in self.keys)
+        index = self._snapshot()
+        with self._lock:
+            self.lookups += 1
+        courses = index.get(combo)
+        if courses is None:
+            # Неполные или устаревшие ответы: подбираем напрямую, как раньше
+            with self._lock:
+                self.fallbacks += 1
+            return match_courses(self.load_courses_by_role(), answers)
+        return list(courses)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'combinations': len(self._index) if self._index is not None else 0,
+                'builds': self.builds,
+                'lookups': self.lookups,
+                'fallbacks': self.fallbacks
+            }
@@ -0,0 +1,106 @@
+import logging
+import threading
+from collections import Counter, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Разобранная callback_data: namespace и action - зарегистрированный маршрут, args - остаток
+Callback = namedtuple('Callback', ['namespace', 'action', 'args', 'route'])
+
+
+class _Node:
+    __slots__ = ('children', 'handler', 'route')
+
+    def __init__(self):
+        self.children = {}
+        self.handler = None
+        self.route = None
+
+
+class CallbackRouter:
+    """Маршрутизатор callback-запросов
+
+    callback_data разбивается по разделителю один раз. Точные маршруты ищутся
+    в словаре, маршруты с аргументами - в префиксном дереве по токенам, поэтому
+    стоимость маршрутизации не растет с числом меню.
+    """
+
+    def __init__(self, separator='_'):
+        self.separator = separator
+        self._exact = {}
+        self._root = _Node()
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def _register(self, route, handler, exact):
+        if exact:
+            if route in self._exact:
+                raise ValueError(f"Маршрут {route} уже зарегистрирован")
+            self._exact[route] = handler
+            return
+        node = self._root
+        for token in route.split(self.separator):
+            node = node.children.setdefault(token, _Node())
+        if node.handler is not None:
+            raise ValueError(f"Маршрут {route}_* уже зарегистрирован")
+        node.handler = handler
+        node.route = route
+
+    def route(self, *routes):
+        """Декоратор: обработчик для точных значений callback_data"""
+        def decorator(handler):
+            for route in routes:
+                self._register(route, handler, exact=True)
+            return handler
+        return decorator
+
+    def prefix(self, *routes):
+        """Декоратор: обработчик для callback_data вида <route>_<аргументы>"""
+        def decorator(handler):
+            for route in routes:
+                self._register(route, handler, exact=False)
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        """Находит обработчик: (handler, Callback) или (None, None)"""
+        tokens = data.split(self.separator)
+        handler = self._exact.get(data)
+        if handler is not None:
+            return handler, Callback(tokens[0], self.separator.join(tokens[1:]), (), data)
+
+        # Самый длинный зарегистрированный префикс по токенам
+        node = self._root
+        found, depth = None, 0
+        for i, token in enumerate(tokens):
+            node = node.children.get(token)
+            if node is None:
+                break
+            if node.handler is not None:
+                found, depth = node, i + 1
+        if found is None:
+            return None, None
+        route_tokens = tokens[:depth]
+        return found.handler, Callback(
+            route_tokens[0], self.separator.join(route_tokens[1:]), tuple(tokens[depth:]), found.route
+        )
+
+    def route_name(self, data):
+        """Маршрут callback_data без вызова обработчика (для метрик)"""
+        _, callback = self.resolve(data or '')
+        return callback.route if callback else 'unmatched'
+
+    def dispatch(self, call):
+        """Вызывает обработчик; его результат (если есть) - текст ответа на callback"""
+        handler, callback = self.resolve(call.data or '')
+        route = callback.route if callback else 'unmatched'
+        with self._lock:
+            self.counts[route] += 1
+        if handler is None:
+            logger.warning(f"Нет обработчика для callback: {call.data}")
+            return None
+        return handler(call, callback)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
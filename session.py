@@ -0,0 +1,347 @@
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import Counter, OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+from aio import await_only, in_async_context
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class SessionStore:
+    """Хранилище пользовательских сессий
+
+    Каждая сессия - хэш по ключу "<prefix>:<id>", поля хэша - пространства имен
+    (состояние опроса, позиция в каталоге и т.д.), значения хранятся в JSON.
+    На время обработки одного апдейта открывается единица работы: сессия читается
+    одним запросом, изменения копятся в памяти и записываются одним пакетом в flush().
+    """
+
+    def __init__(self, ttl=7 * 24 * 3600):
+        self.ttl = ttl
+        self._ttls = {}
+        # Единица работы своя у каждого потока и у каждого greenlet асинхронного режима
+        self._uow = contextvars.ContextVar(f'session_uow_{id(self)}', default=None)
+
+    # --- Операции бэкенда ---
+
+    def _read(self, rkeys):
+        """Читает хэши целиком: список словарей поле -> JSON"""
+        raise NotImplementedError
+
+    def _write(self, changes, ttls):
+        """Записывает изменения {ключ: {поле: JSON или None для удаления}}"""
+        raise NotImplementedError
+
+    def _scan(self, prefix, field):
+        """Перечисляет id сессий с префиксом prefix, в которых есть поле field"""
+        raise NotImplementedError
+
+    def field_counts(self, prefix='session'):
+        """Сколько сессий с префиксом prefix содержат каждое поле (за один проход)"""
+        raise NotImplementedError
+
+    # --- Пространства имен ---
+
+    def namespace(self, name, prefix='session', ttl=None):
+        """Возвращает словарь-представление одного поля сессий"""
+        if ttl is not None:
+            self._ttls[prefix] = ttl
+        return SessionNamespace(self, name, prefix)
+
+    def _ttl_for(self, rkey):
+        return self._ttls.get(rkey.split(':', 1)[0], self.ttl)
+
+    # --- Единица работы ---
+
+    def begin(self):
+        """Начинает единицу работы в текущем потоке"""
+        self._uow.set({'loaded': {}, 'values': {}})
+
+    def prefetch(self, *keys):
+        """Заранее читает сессии одним пакетом: keys - пары (prefix, id)"""
+        uow = self._uow.get()
+        if uow is None:
+            return
+        rkeys = [f"{prefix}:{key}" for prefix, key in keys]
+        self._load(uow, [rkey for rkey in rkeys if rkey not in uow['loaded']])
+
+    def flush(self):
+        """Записывает накопленные изменения и закрывает единицу работы"""
+        uow = self._uow.get()
+        self._uow.set(None)
+        if not uow:
+            return
+        changes = {}
+        for (rkey, field), value in uow['values'].items():
+            raw = None if value is _MISSING else json.dumps(value, ensure_ascii=False)
+            loaded = uow['loaded'].get(rkey)
+            if loaded is not None and loaded.get(field) == raw:
+                continue
+            changes.setdefault(rkey, {})[field] = raw
+        if changes:
+            self._write(changes, {rkey: self._ttl_for(rkey) for rkey in changes})
+
+    def discard(self):
+        """Закрывает единицу работы без записи"""
+        self._uow.set(None)
+
+    @contextmanager
+    def unit_of_work(self):
+        self.begin()
+        try:
+            yield self
+        except Exception:
+            self.discard()
+            raise
+        self.flush()
+
+    def _load(self, uow, rkeys):
+        if rkeys:
+            for rkey, fields in zip(rkeys, self._read(rkeys)):
+                uow['loaded'][rkey] = fields or {}
+
+    # --- Доступ к полям ---
+
+    def get_field(self, rkey, field):
+        uow = self._uow.get()
+        if uow is None:
+            raw = self._read([rkey])[0].get(field)
+            return _MISSING if raw is None else json.loads(raw)
+        if (rkey, field) not in uow['values']:
+            if rkey not in uow['loaded']:
+                self._load(uow, [rkey])
+            raw = uow['loaded'][rkey].get(field)
+            # Сохраняем разобранный объект: изменения "на месте" попадут в flush()
+            uow['values'][(rkey, field)] = _MISSING if raw is None else json.loads(raw)
+        return uow['values'][(rkey, field)]
+
+    def set_field(self, rkey, field, value):
+        uow = self._uow.get()
+        if uow is None:
+            self._write({rkey: {field: json.dumps(value, ensure_ascii=False)}}, {rkey: self._ttl_for(rkey)})
+        else:
+            uow['values'][(rkey, field)] = value
+
+    def delete_field(self, rkey, field):
+        uow = self._uow.get()
+        if uow is None:
+            self._write({rkey: {field: None}}, {rkey: self._ttl_for(rkey)})
+        else:
+            uow['values'][(rkey, field)] = _MISSING
+
+
+class SessionNamespace(MutableMapping):
+    """Словарь id -> значение поверх одного поля сессий"""
+
+    def __init__(self, store, name, prefix):
+        self.store = store
+        self.name = name
+        self.prefix = prefix
+
+    def _rkey(self, key):
+        return f"{self.prefix}:{key}"
+
+    def __getitem__(self, key):
+        value = self.store.get_field(self._rkey(key), self.name)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store.set_field(self._rkey(key), self.name, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.store.delete_field(self._rkey(key), self.name)
+
+    def __contains__(self, key):
+        return self.store.get_field(self._rkey(key), self.name) is not _MISSING
+
+    def __iter__(self):
+        # id в ключах Redis - строки, а в коде бота - числа
+        for key in self.store._scan(self.prefix, self.name):
+            yield int(key) if key.lstrip('-').isdigit() else key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class RedisSessionStore(SessionStore):
+    """Сессии в хэшах Redis с TTL на ключ"""
+
+    def __init__(self, client, ttl=7 * 24 * 3600):
+        super().__init__(ttl)
+        self.client = client
+        # Клиент redis.asyncio для асинхронного режима
+        self.async_client = None
+
+    def use_async(self, async_client):
+        self.async_client = async_client
+
+    def _pipeline(self):
+        if self.async_client is not None and in_async_context():
+            return self.async_client.pipeline(transaction=False), True
+        return self.client.pipeline(transaction=False), False
+
+    def _execute(self, pipe, is_async):
+        return await_only(pipe.execute()) if is_async else pipe.execute()
+
+    def _read(self, rkeys):
+        pipe, is_async = self._pipeline()
+        for rkey in rkeys:
+            pipe.hgetall(rkey)
+        return self._execute(pipe, is_async)
+
+    def _write(self, changes, ttls):
+        pipe, is_async = self._pipeline()
+        for rkey, fields in changes.items():
+            to_set = {field: raw for field, raw in fields.items() if raw is not None}
+            to_delete = [field for field, raw in fields.items() if raw is None]
+            if to_set:
+                pipe.hset(rkey, mapping=to_set)
+                pipe.expire(rkey, ttls[rkey])
+            if to_delete:
+                pipe.hdel(rkey, *to_delete)
+        self._execute(pipe, is_async)
+
+    def _scan(self, prefix, field):
+        for rkey in self.client.scan_iter(match=f"{prefix}:*", count=500):
+            if self.client.hexists(rkey, field):
+                yield rkey.split(':', 1)[1]
+
+    def field_counts(self, prefix='session'):
+        counts = Counter()
+        batch = []
+        for rkey in self.client.scan_iter(match=f"{prefix}:*", count=500):
+            batch.append(rkey)
+            if len(batch) >= 500:
+                counts.update(self._batch_fields(batch))
+                batch = []
+        counts.update(self._batch_fields(batch))
+        return counts
+
+    def _batch_fields(self, rkeys):
+        pipe = self.client.pipeline(transaction=False)
+        for rkey in rkeys:
+            pipe.hkeys(rkey)
+        return [field for fields in pipe.execute() for field in fields]
+
+
+class MemorySessionStore(SessionStore):
+    """Сессии в памяти процесса (для тестов и локального запуска)
+
+    max_entries ограничивает число сессий: при переполнении вытесняются те, к
+    которым дольше всего не обращались (LRU). Просроченные по TTL сессии удаляются
+    не только при обращении, но и фоновой чисткой раз в sweep_interval секунд.
+    """
+
+    def __init__(self, ttl=7 * 24 * 3600, max_entries=None, sweep_interval=60.0):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        # ключ -> (поля, момент истечения); порядок - от давно использованных к недавним
+        self._data = OrderedDict()
+        self._next_sweep = time.monotonic() + sweep_interval
+        self.evicted = 0
+        self.expired = 0
+
+    def _alive(self, rkey, now):
+        entry = self._data.get(rkey)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._data[rkey]
+            self.expired += 1
+            return None
+        return entry[0]
+
+    def _touch(self, rkey, now):
+        fields = self._alive(rkey, now)
+        if fields is not None:
+            self._data.move_to_end(rkey)
+        return fields
+
+    def _sweep(self, now):
+        """Удаляет просроченные сессии и вытесняет лишние по LRU"""
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            for rkey in [rkey for rkey, entry in self._data.items() if entry[1] <= now]:
+                del self._data[rkey]
+                self.expired += 1
+        if self.max_entries is not None:
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evicted += 1
+
+    def _read(self, rkeys):
+        now = time.monotonic()
+        with self._lock:
+            return [dict(self._touch(rkey, now) or {}) for rkey in rkeys]
+
+    def _write(self, changes, ttls):
+        now = time.monotonic()
+        with self._lock:
+            for rkey, fields in changes.items():
+                current = self._touch(rkey, now) or {}
+                expires_at = self._data[rkey][1] if rkey in self._data else now + ttls[rkey]
+                for field, raw in fields.items():
+                    if raw is None:
+                        current.pop(field, None)
+                    else:
+                        current[field] = raw
+                        expires_at = now + ttls[rkey]
+                if current:
+                    self._data[rkey] = (current, expires_at)
+                    self._data.move_to_end(rkey)
+                else:
+                    self._data.pop(rkey, None)
+            self._sweep(now)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'max_entries': self.max_entries,
+                'evicted': self.evicted,
+                'expired': self.expired,
+            }
+
+    def _scan(self, prefix, field):
+        now = time.monotonic()
+        with self._lock:
+            return [
+                rkey.split(':', 1)[1]
+                for rkey in list(self._data)
+                if rkey.startswith(f"{prefix}:") and field in (self._alive(rkey, now) or {})
+            ]
+
+    def field_counts(self, prefix='session'):
+        now = time.monotonic()
+        counts = Counter()
+        with self._lock:
+            for rkey in list(self._data):
+                if rkey.startswith(f"{prefix}:"):
+                    counts.update((self._alive(rkey, now) or {}).keys())
+        return counts
+
+
+def create_session_store(backend, redis_client=None, ttl=7 * 24 * 3600, max_entries=None):
+    """Создает хранилище сессий: 'redis' или 'memory'
+
+    max_entries действует только для памяти; для Redis ограничение задается
+    политикой вытеснения самого Redis (maxmemory + allkeys-lru / volatile-lru).
+    """
+    if backend == 'memory':
+        return MemorySessionStore(ttl, max_entries)
+    if backend == 'redis':
+        return RedisSessionStore(redis_client, ttl)
+    raise ValueError(f"Неизвестное хранилище сессий: {backend}")
@@ -0,0 +1,422 @@
+"""Обработка апдейтов несколькими процессами с сохранением порядка внутри чата
+
+Диспетчер (BOT_MODE=dispatcher) получает апдейты long polling'ом или вебхуком и
+кладет каждый в поток Redis своего шарда: номер шарда - chat_id по модулю числа
+шардов. Обработчики (BOT_MODE=worker) берут шарды в аренду и читают каждый шард
+одним потоком по порядку, поэтому апдейты одного чата обрабатываются строго
+последовательно, а разные чаты - параллельно в разных процессах.
+
+Шардов больше, чем обработчиков: при запуске нового обработчика остальные
+дочитывают текущий апдейт, подтверждают его и отдают лишние шарды. Неподтвержденные
+апдейты (обработчик упал) остаются в списке ожидающих группы и дочитываются
+следующим владельцем шарда, так что апдейты не теряются, но в редком случае
+могут обработаться повторно. Аренда отданного шарда снимается только после того,
+как его поток чтения завершился; до тех пор обработчик продолжает ее продлевать.
+"""
+import os
+import json
+import math
+import time
+import uuid
+import random
+import socket
+import logging
+import threading
+
+import redis
+from telebot import apihelper
+
+logger = logging.getLogger(__name__)
+
+GROUP = 'workers'
+
+# Продление и снятие аренды только своим владельцем: проверка и изменение - одна операция в Redis
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Поля апдейта, в которых есть чат (или пользователь, если чата нет)
+CHAT_FIELDS = ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+               'my_chat_member', 'chat_member', 'chat_join_request')
+USER_FIELDS = ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query', 'poll_answer')
+
+
+def update_chat_id(update):
+    """Чат, к которому относится апдейт (словарь из Bot API); None, если чата нет"""
+    for field in CHAT_FIELDS:
+        if field in update:
+            return update[field]['chat']['id']
+    callback = update.get('callback_query')
+    if callback is not None:
+        message = callback.get('message')
+        return message['chat']['id'] if message else callback['from']['id']
+    for field in USER_FIELDS:
+        if field in update:
+            user = update[field].get('from') or update[field].get('user')
+            return user['id'] if user else None
+    return None
+
+
+class UpdateStreams:
+    """Потоки Redis с апдейтами, по одному на шард"""
+
+    def __init__(self, redis_client, shards=32, prefix='updates', maxlen=100000):
+        self.redis = redis_client
+        self.shards = shards
+        self.prefix = prefix
+        # Защита от бесконечного роста, если обработчики не запущены
+        self.maxlen = maxlen
+
+    @classmethod
+    def from_env(cls, redis_client):
+        return cls(
+            redis_client,
+            shards=int(os.getenv('SHARD_COUNT', 32)),
+            maxlen=int(os.getenv('SHARD_STREAM_MAXLEN', 100000))
+        )
+
+    def key(self, shard):
+        return f'{self.prefix}:{shard}'
+
+    def shard_of(self, update):
+        chat_id = update_chat_id(update)
+        # Апдейты без чата (опросы и т.п.) не требуют порядка
+        return (chat_id if chat_id is not None else update['update_id']) % self.shards
+
+    def publish(self, update):
+        """Добавляет апдейт в поток его шарда; возвращает номер шарда"""
+        shard = self.shard_of(update)
+        self.redis.xadd(
+            self.key(shard),
+            {'update': json.dumps(update, ensure_ascii=False)},
+            maxlen=self.maxlen,
+            approximate=True
+        )
+        return shard
+
+    def ensure_groups(self):
+        for shard in range(self.shards):
+            try:
+                self.redis.xgroup_create(self.key(shard), GROUP, id='0', mkstream=True)
+            except redis.ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+
+    def backlog(self):
+        """Необработанных апдейтов по шардам (обработанные удаляются из потока)"""
+        pipe = self.redis.pipeline(transaction=False)
+        for shard in range(self.shards):
+            pipe.xlen(self.key(shard))
+        return dict(enumerate(pipe.execute()))
+
+
+class UpdateDispatcher:
+    """Раскладывает апдейты по шардам; submit() совместим с пулом вебхука"""
+
+    def __init__(self, streams):
+        self.streams = streams
+        self._lock = threading.Lock()
+        self.published = 0
+        self.failed = 0
+
+    def submit(self, update):
+        """Публикует апдейт; False, если Redis недоступен (вебхук ответит 503, Telegram повторит)"""
+        try:
+            self.streams.publish(update)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.error(f"Не удалось передать апдейт {update.get('update_id')} обработчикам: {e}")
+            return False
+        with self._lock:
+            self.published += 1
+        return True
+
+    def poll(self, token, poll_timeout=20, stop_event=None):
+        """Long polling: offset сдвигается только после публикации, поэтому при сбое Redis
+        непереданные апдейты будут получены повторно"""
+        offset = None
+        while stop_event is None or not stop_event.is_set():
+            try:
+                updates = apihelper.get_updates(
+                    token, offset=offset, limit=100, timeout=poll_timeout + 5, long_polling_timeout=poll_timeout
+                )
+            except Exception as e:
+                logger.error(f"Ошибка получения апдейтов: {e}")
+                time.sleep(1)
+                continue
+            for update in updates:
+                if not self.submit(update):
+                    time.sleep(1)
+                    break
+                offset = update['update_id'] + 1
+
+    def stats(self):
+        with self._lock:
+            stats = {'published': self.published, 'failed': self.failed}
+        try:
+            stats['backlog'] = sum(self.streams.backlog().values())
+        except Exception as e:
+            logger.warning(f"Не удалось получить длину очередей апдейтов: {e}")
+        return stats
+
+
+class ShardWorker:
+    """Обработчик: держит аренду части шардов и обрабатывает апдейты каждого шарда по порядку
+
+    process(update) получает апдейт словарем из Bot API. Число шардов на обработчик -
+    поровну между живыми обработчиками (их список - сортированное множество в Redis).
+    """
+
+    def __init__(self, streams, process, lease_ttl=30, rebalance_interval=5.0, batch_size=100, block_ms=1000):
+        self.streams = streams
+        self.redis = streams.redis
+        self.process = process
+        self.lease_ttl = lease_ttl
+        self.rebalance_interval = rebalance_interval
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        # шард -> (событие остановки, поток)
+        self._shards = {}
+        # Отданные шарды, поток чтения которых еще дорабатывает апдейт: шард -> поток
+        self._draining = {}
+        # Шарды с потерянной арендой, поток чтения которых еще не завершился: шард -> поток
+        self._lost = {}
+
+        self.processed = 0
+        self.failed = 0
+        self.replayed = 0
+        self.acquired = 0
+        self.released = 0
+
+    @classmethod
+    def from_env(cls, streams, process):
+        return cls(
+            streams,
+            process,
+            lease_ttl=int(os.getenv('SHARD_LEASE_TTL', 30)),
+            rebalance_interval=float(os.getenv('SHARD_REBALANCE_INTERVAL', 5))
+        )
+
+    def _lease_key(self, shard):
+        return f'{self.streams.prefix}:lease:{shard}'
+
+    def _workers_key(self):
+        return f'{self.streams.prefix}:workers'
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    # --- Аренда шардов ---
+
+    def _claim(self, shard):
+        return bool(self.redis.set(self._lease_key(shard), self.owner, nx=True, ex=self.lease_ttl))
+
+    def _renew(self, shard):
+        return bool(self.redis.eval(RENEW_SCRIPT, 1, self._lease_key(shard), self.owner, self.lease_ttl))
+
+    def _release(self, shard):
+        return bool(self.redis.eval(RELEASE_SCRIPT, 1, self._lease_key(shard), self.owner))
+
+    def _alive_workers(self):
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zadd(self._workers_key(), {self.owner: now})
+        pipe.zremrangebyscore(self._workers_key(), '-inf', now - self.lease_ttl)
+        pipe.zcard(self._workers_key())
+        return max(pipe.execute()[-1], 1)
+
+    def rebalance(self):
+        """Продлевает аренду своих шардов, отдает лишние и забирает свободные"""
+        target = math.ceil(self.streams.shards / self._alive_workers())
+        self._settle_draining()
+
+        for shard, (stop, thread) in list(self._shards.items()):
+            if not thread.is_alive() or not self._renew(shard):
+                logger.warning(f"Шард {shard} больше не принадлежит обработчику {self.owner}")
+                # Поток дорабатывает текущий апдейт и больше ничего не читает;
+                # пока он жив, шард не берется снова
+                self._lost[shard] = self._drop(shard, timeout=0)
+
+        # Лишние шарды отдаются после подтверждения текущего апдейта
+        for shard in sorted(self._shards)[target:]:
+            self._hand_over(shard)
+
+        if len(self._shards) < target:
+            # Случайный порядок: обработчики, стартовавшие одновременно, не спорят за одни шарды
+            free = [
+                shard for shard in range(self.streams.shards)
+                if shard not in self._shards and shard not in self._draining and shard not in self._lost
+            ]
+            random.shuffle(free)
+            for shard in free:
+                if len(self._shards) >= target:
+                    break
+                if self._claim(shard):
+                    self._take(shard)
+
+    def _take(self, shard):
+        stop = threading.Event()
+        thread = threading.Thread(target=self._consume, args=(shard, stop), name=f'shard-{shard}', daemon=True)
+        self._shards[shard] = (stop, thread)
+        thread.start()
+        self._count('acquired')
+        logger.info(f"Обработчик {self.owner} взял шард {shard}")
+
+    def _drop(self, shard, timeout=None):
+        """Останавливает чтение шарда; возвращает поток чтения"""
+        stop, thread = self._shards.pop(shard)
+        stop.set()
+        thread.join(timeout if timeout is not None else self.block_ms / 1000)
+        return thread
+
+    def _hand_over(self, shard, timeout=None):
+        """Отдает шард: аренда снимается, только когда поток чтения завершился"""
+        self._draining[shard] = self._drop(shard, timeout)
+        self._settle_draining()
+
+    def _settle_draining(self):
+        """Снимает аренду с отданных шардов, чтение которых завершилось, остальным продлевает ее"""
+        for shard, thread in list(self._lost.items()):
+            if not thread.is_alive():
+                del self._lost[shard]
+        for shard, thread in list(self._draining.items()):
+            if not thread.is_alive():
+                del self._draining[shard]
+                self._release(shard)
+                self._count('released')
+            elif not self._renew(shard):
+                del self._draining[shard]
+                logger.warning(f"Аренда шарда {shard} истекла до завершения его обработки")
+
+    # --- Чтение шарда ---
+
+    def _consume(self, shard, stop):
+        key = self.streams.key(shard)
+        # Имя потребителя привязано к шарду: новый владелец видит неподтвержденные апдейты прежнего
+        consumer = f'shard-{shard}'
+        # Сначала дочитываем то, что прежний владелец получил, но не подтвердил
+        last_id = '0'
+        while not stop.is_set() and not self._stop.is_set():
+            try:
+                if self.redis.get(self._lease_key(shard)) != self.owner:
+                    logger.warning(f"Аренда шарда {shard} потеряна, чтение остановлено")
+                    return
+                response = self.redis.xreadgroup(
+                    GROUP, consumer, {key: last_id}, count=self.batch_size,
+                    block=None if last_id == '0' else self.block_ms
+                )
+            except Exception as e:
+                logger.error(f"Ошибка чтения шарда {shard}: {e}")
+                stop.wait(1)
+                continue
+            entries = response[0][1] if response else []
+            if last_id == '0':
+                if not entries:
+                    last_id = '>'
+                    continue
+                self._count('replayed', len(entries))
+            for entry_id, fields in entries:
+                if fields:
+                    self._handle(shard, fields)
+                # Подтвержденный апдейт удаляется: длина потока - очередь шарда.
+                # Аренда проверяется в том же запросе, перед следующим апдейтом
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.xack(key, GROUP, entry_id)
+                pipe.xdel(key, entry_id)
+                pipe.get(self._lease_key(shard))
+                if pipe.execute()[-1] != self.owner:
+                    logger.warning(f"Аренда шарда {shard} потеряна, чтение остановлено")
+                    return
+                if stop.is_set():
+                    # Шард отдают другому обработчику: оставшиеся апдейты прочитает он
+                    break
+
+    def _handle(self, shard, fields):
+        try:
+            self.process(json.loads(fields['update']))
+            self._count('processed')
+        except Exception as e:
+            # Апдейт, на котором падает обработчик, не должен навсегда блокировать чат
+            self._count('failed')
+            logger.error(f"Ошибка обработки апдейта из шарда {shard}: {e}")
+
+    # --- Жизненный цикл ---
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.rebalance()
+            except Exception as e:
+                logger.error(f"Ошибка распределения шардов: {e}")
+            self._stop.wait(self.rebalance_interval)
+
+    def start(self):
+        self.streams.ensure_groups()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='shard-balancer', daemon=True)
+        self._thread.start()
+
+    def run_forever(self):
+        self.start()
+        try:
+            while self._thread.is_alive():
+                self._thread.join(1)
+        finally:
+            self.stop()
+
+    def stop(self, timeout=30.0):
+        """Дорабатывает текущие апдейты и отдает все шарды"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        deadline = time.monotonic() + timeout
+        for shard in list(self._shards):
+            self._draining[shard] = self._drop(shard, timeout=0)
+        while True:
+            try:
+                self._settle_draining()
+            except Exception as e:
+                logger.warning(f"Не удалось освободить шарды {sorted(self._draining)}: {e}")
+                break
+            remaining = deadline - time.monotonic()
+            if not self._draining or remaining <= 0:
+                break
+            # Ждем потоки чтения, продлевая аренду раз в секунду
+            next(iter(self._draining.values())).join(min(remaining, 1.0))
+        if self._draining:
+            logger.warning(f"Шарды {sorted(self._draining)} не дочитаны, аренда истечет через {self.lease_ttl} с")
+        for thread in list(self._lost.values()):
+            thread.join(max(deadline - time.monotonic(), 0))
+        try:
+            self.redis.zrem(self._workers_key(), self.owner)
+        except Exception as e:
+            logger.warning(f"Не удалось снять обработчик {self.owner} с учета: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'owner': self.owner,
+                'shards': sorted(self._shards),
+                'draining': sorted(self._draining),
+                'lost': sorted(self._lost),
+                'processed': self.processed,
+                'failed': self.failed,
+                'replayed': self.replayed,
+                'acquired': self.acquired,
+                'released': self.released
+            }
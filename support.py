@@ -0,0 +1,528 @@
+"""Заявки в поддержку с несколькими агентами
+
+Заявка сначала записывается в Postgres (support_tickets), затем ее id попадает в
+очередь Redis. Фоновый поток любой реплики забирает заявки из очереди и
+назначает агенту (чату поддержки) по кругу или наименее загруженному. Агент
+получает не сообщение на каждый вопрос, а дайджест раз в digest_interval секунд
+(или когда набралось digest_max заявок) с кнопками "Взять". Взятая заявка
+приходит агенту отдельным сообщением; ответ на него (reply) отправляется
+пользователю. Сообщения с заявками записываются в support_ticket_messages,
+поэтому ответ находит заявку и после перезапуска бота. Срок ответа (SLA)
+отслеживается в Redis: просроченная заявка помечается в БД, о ней сообщается
+в чат эскалации, а невзятая заявка переназначается другому агенту.
+
+Запросы из обработчиков (создание, взятие и ответ) идут через connect и клиент
+Redis, переданный снаружи: в асинхронном режиме это asyncpg и redis.asyncio, чтобы
+не останавливать цикл событий. Фоновый поток работает с синхронным пулом.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+OPEN = 'open'
+CLAIMED = 'claimed'
+ANSWERED = 'answered'
+
+ROUND_ROBIN = 'round_robin'
+LEAST_LOADED = 'least_loaded'
+
+# Длина вопроса в строке дайджеста
+DIGEST_PREVIEW = 200
+
+TICKET_COLUMNS = "ticket_id, user_chat_id, username, question, status, agent_chat_id, claimed_by"
+
+
+def ticket_from_row(row):
+    return dict(zip(('ticket_id', 'user_chat_id', 'username', 'question', 'status',
+                     'agent_chat_id', 'claimed_by'), row))
+
+
+def preview(text, limit=DIGEST_PREVIEW):
+    text = ' '.join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+
+class SupportDesk:
+    """Заявки в поддержку: Postgres - хранилище, Redis - очередь назначения, дайджесты и SLA"""
+
+    def __init__(self, redis_client, pool, send, claim_data, agents, strategy=LEAST_LOADED,
+                 sla_seconds=4 * 3600, digest_interval=60.0, digest_max=10, escalation_chat_id=None,
+                 prefix='support', poll_interval=1.0, lock_ttl=30, connect=None):
+        if not agents:
+            raise ValueError("Не задан ни один агент поддержки")
+        if strategy not in (ROUND_ROBIN, LEAST_LOADED):
+            raise ValueError(f"Неизвестная стратегия назначения: {strategy}")
+        self.redis = redis_client
+        self.pool = pool
+        # Соединение для запросов из обработчиков (в асинхронном режиме - asyncpg)
+        self.connect = connect or pool.connection
+        # send(chat_id, text, reply_markup=None) -> отправленное сообщение
+        self.send = send
+        # claim_data(ticket_id) -> callback_data кнопки "Взять"
+        self.claim_data = claim_data
+        self.agents = list(agents)
+        self.strategy = strategy
+        self.sla_seconds = sla_seconds
+        self.digest_interval = digest_interval
+        self.digest_max = digest_max
+        self.escalation_chat_id = escalation_chat_id if escalation_chat_id is not None else self.agents[0]
+        self.prefix = prefix
+        self.poll_interval = poll_interval
+        self.lock_ttl = lock_ttl
+        self.owner = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.assigned = 0
+        self.digests = 0
+        self.claimed = 0
+        self.answered = 0
+        self.sla_breached = 0
+        self.reassigned = 0
+
+    @classmethod
+    def from_env(cls, redis_client, pool, send, claim_data, default_agent, connect=None):
+        """Создает службу поддержки по переменным окружения"""
+        agents = [int(chat_id) for chat_id in os.getenv('SUPPORT_AGENTS', '').split(',') if chat_id.strip()]
+        escalation = os.getenv('SUPPORT_ESCALATION_CHAT_ID')
+        return cls(
+            redis_client,
+            pool,
+            send,
+            claim_data,
+            agents or [default_agent],
+            strategy=os.getenv('SUPPORT_STRATEGY', LEAST_LOADED),
+            sla_seconds=int(os.getenv('SUPPORT_SLA_SECONDS', 4 * 3600)),
+            digest_interval=float(os.getenv('SUPPORT_DIGEST_INTERVAL', 60)),
+            digest_max=int(os.getenv('SUPPORT_DIGEST_MAX', 10)),
+            escalation_chat_id=int(escalation) if escalation else None,
+            connect=connect
+        )
+
+    def _key(self, *parts):
+        return ':'.join((self.prefix,) + tuple(str(part) for part in parts))
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    # --- Заявки ---
+
+    def create_ticket(self, user_chat_id, username, question):
+        """Сохраняет заявку и ставит ее в очередь назначения; возвращает номер"""
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO support_tickets (user_chat_id, username, question, sla_due)
+                    VALUES (%s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+                    RETURNING ticket_id
+                """, (user_chat_id, username, question, float(self.sla_seconds)))
+                ticket_id = cur.fetchone()[0]
+        self._count('created')
+        try:
+            pipe = self.redis.pipeline()
+            pipe.lpush(self._key('queue'), ticket_id)
+            pipe.zadd(self._key('sla'), {ticket_id: time.time() + self.sla_seconds})
+            pipe.execute()
+        except Exception as e:
+            # Заявка уже в БД: recover() поставит ее в очередь при следующем запуске
+            logger.error(f"Заявка #{ticket_id} не поставлена в очередь: {e}")
+        return ticket_id
+
+    def find_ticket(self, chat_id, message_id):
+        """Номер заявки по сообщению агенту (на которое отвечают reply)"""
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT ticket_id FROM support_ticket_messages WHERE chat_id = %s AND message_id = %s",
+                    (chat_id, message_id)
+                )
+                row = cur.fetchone()
+        return row[0] if row else None
+
+    def _remember_message(self, chat_id, message_id, ticket_id):
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO support_ticket_messages (chat_id, message_id, ticket_id)
+                    VALUES (%s, %s, %s) ON CONFLICT DO NOTHING
+                """, (chat_id, message_id, ticket_id))
+
+    def claim(self, ticket_id, agent_user_id, chat_id):
+        """Агент берет заявку: (заявка, None) или (None, причина отказа)
+
+        Взять можно только открытую заявку; условие в UPDATE не дает двум агентам
+        взять одну заявку. Текст заявки приходит агенту отдельным сообщением; если
+        отправить его не удалось, заявка снова становится открытой.
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE support_tickets
+                    SET status = %s, claimed_by = %s, claimed_at = CURRENT_TIMESTAMP,
+                        agent_chat_id = %s
+                    WHERE ticket_id = %s AND status = %s
+                    RETURNING {TICKET_COLUMNS}
+                """, (CLAIMED, agent_user_id, chat_id, ticket_id, OPEN))
+                row = cur.fetchone()
+                if row is None:
+                    cur.execute("SELECT status, claimed_by FROM support_tickets WHERE ticket_id = %s", (ticket_id,))
+                    current = cur.fetchone()
+        if row is None:
+            if current is None:
+                return None, f"Заявка #{ticket_id} не найдена"
+            if current[0] == ANSWERED:
+                return None, f"На заявку #{ticket_id} уже ответили"
+            return None, f"Заявку #{ticket_id} уже взял другой агент"
+        ticket = ticket_from_row(row)
+        try:
+            # Чтение message_id дожидается отправки
+            message_id = self.send(
+                chat_id,
+                f"🎫 Заявка #{ticket_id} от @{ticket['username'] or 'Без ника'}:\n\n{ticket['question']}\n\n"
+                f"Ответьте на это сообщение, чтобы ответ ушел пользователю."
+            ).message_id
+        except Exception as e:
+            logger.error(f"Заявка #{ticket_id} не отправлена агенту {agent_user_id}: {e}")
+            self._release_claim(ticket_id, agent_user_id)
+            return None, f"Не удалось отправить заявку #{ticket_id}, попробуйте еще раз"
+        self._count('claimed')
+        self._remember_message(chat_id, message_id, ticket_id)
+        return ticket, None
+
+    def _release_claim(self, ticket_id, agent_user_id):
+        """Возвращает заявку в открытые, если ее все еще держит этот агент"""
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE support_tickets SET status = %s, claimed_by = NULL, claimed_at = NULL
+                    WHERE ticket_id = %s AND status = %s AND claimed_by = %s
+                """, (OPEN, ticket_id, CLAIMED, agent_user_id))
+
+    def answer(self, ticket_id, agent_user_id, text):
+        """Закрывает заявку ответом; None, если на нее уже ответили"""
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE support_tickets
+                    SET status = %s, answer = %s, answered_by = %s, answered_at = CURRENT_TIMESTAMP,
+                        claimed_by = COALESCE(claimed_by, %s)
+                    WHERE ticket_id = %s AND status <> %s
+                    RETURNING {TICKET_COLUMNS}
+                """, (ANSWERED, text, agent_user_id, agent_user_id, ticket_id, ANSWERED))
+                row = cur.fetchone()
+        if row is None:
+            return None
+        self._count('answered')
+        try:
+            self.redis.zrem(self._key('sla'), ticket_id)
+        except Exception as e:
+            logger.warning(f"Не удалось снять таймер SLA заявки #{ticket_id}: {e}")
+        return ticket_from_row(row)
+
+    def status_counts(self):
+        """Число заявок по статусам (для метрик)"""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT status, count(*) FROM support_tickets GROUP BY status")
+                counts = dict(cur.fetchall())
+        return {status: counts.get(status, 0) for status in (OPEN, CLAIMED, ANSWERED)}
+
+    # --- Назначение ---
+
+    def _loads(self):
+        """Незакрытые заявки по агентам"""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT agent_chat_id, count(*) FROM support_tickets
+                    WHERE status <> %s AND agent_chat_id = ANY(%s)
+                    GROUP BY agent_chat_id
+                """, (ANSWERED, self.agents))
+                return dict(cur.fetchall())
+
+    def pick_agent(self, exclude=()):
+        """Агент для новой заявки по стратегии; None, если выбирать не из кого"""
+        candidates = [agent for agent in self.agents if agent not in exclude]
+        if not candidates:
+            return None
+        # Счетчик в Redis общий для всех реплик: круг не сбивается при нескольких процессах
+        turn = self.redis.incr(self._key('turn'))
+        rotated = candidates[turn % len(candidates):] + candidates[:turn % len(candidates)]
+        if self.strategy == ROUND_ROBIN:
+            return rotated[0]
+        loads = self._loads()
+        # При равной загрузке - по кругу
+        return min(rotated, key=lambda agent: loads.get(agent, 0))
+
+    def _assign(self, ticket_id, exclude=()):
+        agent = self.pick_agent(exclude)
+        if agent is None:
+            return None
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE support_tickets
+                    SET agent_chat_id = %s, assigned_at = CURRENT_TIMESTAMP, notified_at = NULL
+                    WHERE ticket_id = %s AND status = %s
+                      AND (agent_chat_id IS NULL OR agent_chat_id = ANY(%s))
+                    RETURNING ticket_id
+                """, (agent, ticket_id, OPEN, list(exclude)))
+                if cur.fetchone() is None:
+                    # Уже назначена (повтор из recover()) или уже взята
+                    return None
+        pipe = self.redis.pipeline()
+        pipe.rpush(self._key('digest', agent), ticket_id)
+        # Время первой заявки в дайджесте: от него отсчитывается digest_interval
+        pipe.set(self._key('digest', agent, 'since'), time.time(), nx=True)
+        pipe.execute()
+        self._count('assigned')
+        return agent
+
+    def _drain_queue(self):
+        while not self._stop.is_set():
+            ticket_id = self.redis.rpop(self._key('queue'))
+            if ticket_id is None:
+                return
+            try:
+                self._assign(int(ticket_id))
+            except Exception:
+                # Возвращаем заявку в очередь, чтобы не потерять ее при сбое БД
+                self.redis.rpush(self._key('queue'), ticket_id)
+                raise
+
+    def recover(self):
+        """Восстанавливает очередь, дайджесты и таймеры SLA из БД (например, после потери данных Redis)
+
+        Назначенные заявки, о которых агент так и не получил дайджест, возвращаются
+        в дайджест своего агента.
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT ticket_id, extract(epoch FROM sla_due) FROM support_tickets
+                    WHERE status <> %s AND NOT sla_breached
+                """, (ANSWERED,))
+                rows = cur.fetchall()
+                cur.execute(
+                    "SELECT ticket_id FROM support_tickets WHERE status = %s AND agent_chat_id IS NULL",
+                    (OPEN,)
+                )
+                unassigned = [ticket_id for (ticket_id,) in cur.fetchall()]
+                cur.execute("""
+                    SELECT agent_chat_id, ticket_id FROM support_tickets
+                    WHERE status = %s AND agent_chat_id IS NOT NULL AND notified_at IS NULL
+                    ORDER BY ticket_id
+                """, (OPEN,))
+                unnotified = {}
+                for agent, ticket_id in cur.fetchall():
+                    unnotified.setdefault(agent, []).append(ticket_id)
+        pipe = self.redis.pipeline()
+        for ticket_id, due in rows:
+            pipe.zadd(self._key('sla'), {ticket_id: float(due)}, nx=True)
+        for ticket_id in unassigned:
+            pipe.lpush(self._key('queue'), ticket_id)
+        pipe.execute()
+        if unassigned:
+            logger.info(f"Поддержка: в очередь возвращено заявок: {len(unassigned)}")
+
+        restored = 0
+        for agent, ticket_ids in unnotified.items():
+            # Заявки, которые еще ждут дайджеста в Redis, второй раз не добавляем
+            pending = {int(ticket_id) for ticket_id in self.redis.lrange(self._key('digest', agent), 0, -1)}
+            missing = [ticket_id for ticket_id in ticket_ids if ticket_id not in pending]
+            if missing:
+                pipe = self.redis.pipeline()
+                pipe.rpush(self._key('digest', agent), *missing)
+                pipe.set(self._key('digest', agent, 'since'), time.time(), nx=True)
+                pipe.execute()
+                restored += len(missing)
+        if restored:
+            logger.info(f"Поддержка: в дайджесты возвращено заявок без уведомления: {restored}")
+
+    # --- Дайджесты ---
+
+    def _claim_lock(self, name):
+        return bool(self.redis.set(self._key(name, 'lock'), self.owner, nx=True, ex=self.lock_ttl))
+
+    def _release_lock(self, name):
+        lock_key = self._key(name, 'lock')
+        if self.redis.get(lock_key) == self.owner:
+            self.redis.delete(lock_key)
+
+    def _flush_digests(self):
+        now = time.time()
+        for agent in self.agents:
+            digest_key, since_key = self._key('digest', agent), self._key('digest', agent, 'since')
+            size = self.redis.llen(digest_key)
+            if not size:
+                continue
+            since = self.redis.get(since_key)
+            if since is None:
+                # Список остался после предыдущего дайджеста: отсчет интервала начинается сейчас
+                self.redis.set(since_key, now, nx=True)
+                continue
+            if size < self.digest_max and now - float(since) < self.digest_interval:
+                continue
+            if not self._claim_lock(f'digest:{agent}'):
+                continue
+            try:
+                ticket_ids = self.redis.lrange(digest_key, 0, -1)
+                # Список чистится только после отправки: при сбое Telegram или БД
+                # дайджест повторится на следующем проходе
+                self.send_digest(agent, [int(ticket_id) for ticket_id in ticket_ids])
+                pipe = self.redis.pipeline()
+                # Заявки, добавленные во время отправки, остаются до следующего дайджеста
+                pipe.ltrim(digest_key, len(ticket_ids), -1)
+                pipe.delete(since_key)
+                pipe.execute()
+            finally:
+                self._release_lock(f'digest:{agent}')
+
+    def send_digest(self, agent, ticket_ids):
+        """Одно сообщение агенту со всеми еще открытыми заявками из списка"""
+        if not ticket_ids:
+            return
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT {TICKET_COLUMNS} FROM support_tickets
+                    WHERE ticket_id = ANY(%s) AND status = %s AND agent_chat_id = %s
+                    ORDER BY ticket_id
+                """, (ticket_ids, OPEN, agent))
+                tickets = [ticket_from_row(row) for row in cur.fetchall()]
+        if not tickets:
+            return
+        lines = [f"📥 Новые вопросы ({len(tickets)}):", ""]
+        keyboard = types.InlineKeyboardMarkup()
+        for ticket in tickets:
+            lines.append(f"#{ticket['ticket_id']} @{ticket['username'] or 'Без ника'}: {preview(ticket['question'])}")
+            keyboard.add(types.InlineKeyboardButton(
+                f"✋ Взять #{ticket['ticket_id']}", callback_data=self.claim_data(ticket['ticket_id'])
+            ))
+        lines.append("")
+        lines.append("Нажмите «Взять», чтобы получить вопрос для ответа."
+                     if len(tickets) > 1 else "Ответьте на это сообщение или нажмите «Взять».")
+        # Чтение message_id дожидается отправки: ошибка оставит заявки в списке дайджеста
+        message_id = self.send(agent, '\n'.join(lines), reply_markup=keyboard).message_id
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE support_tickets SET notified_at = CURRENT_TIMESTAMP WHERE ticket_id = ANY(%s)",
+                    ([ticket['ticket_id'] for ticket in tickets],)
+                )
+        if len(tickets) == 1:
+            # На дайджест с одной заявкой можно ответить сразу
+            self._remember_message(agent, message_id, tickets[0]['ticket_id'])
+        self._count('digests')
+
+    # --- SLA ---
+
+    def _check_sla(self):
+        due = self.redis.zrangebyscore(self._key('sla'), 0, time.time())
+        for ticket_id in due:
+            # Просроченную заявку обрабатывает одна реплика
+            if not self._claim_lock(f'sla:{ticket_id}'):
+                continue
+            try:
+                self._breach(int(ticket_id))
+            finally:
+                self._release_lock(f'sla:{ticket_id}')
+
+    def _breach(self, ticket_id):
+        """Помечает заявку просроченной, переназначает невзятую и сообщает в чат эскалации
+
+        Таймер снимается только после записи в БД: при сбое БД заявка проверится на
+        следующем проходе. Переназначенная заявка получает новый срок ответа.
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    UPDATE support_tickets SET sla_breached = TRUE
+                    WHERE ticket_id = %s AND status <> %s AND NOT sla_breached
+                    RETURNING {TICKET_COLUMNS}
+                """, (ticket_id, ANSWERED))
+                row = cur.fetchone()
+        if row is None:
+            # Уже отвечена или уже обработана
+            self.redis.zrem(self._key('sla'), ticket_id)
+            return
+        ticket = ticket_from_row(row)
+        self._count('sla_breached')
+        agent = None
+        if ticket['status'] == OPEN and len(self.agents) > 1:
+            agent = self._assign(ticket_id, exclude=[ticket['agent_chat_id']])
+        if agent is None:
+            self.redis.zrem(self._key('sla'), ticket_id)
+            note = ''
+        else:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        UPDATE support_tickets
+                        SET sla_due = CURRENT_TIMESTAMP + make_interval(secs => %s), sla_breached = FALSE
+                        WHERE ticket_id = %s
+                    """, (float(self.sla_seconds), ticket_id))
+            self.redis.zadd(self._key('sla'), {ticket_id: time.time() + self.sla_seconds})
+            self._count('reassigned')
+            note = f"\nПереназначена агенту {agent}."
+        holder = f"взята {ticket['claimed_by']}" if ticket['status'] == CLAIMED else "никто не взял"
+        self.send(
+            self.escalation_chat_id,
+            f"⏰ Просрочен ответ на заявку #{ticket_id} ({holder}): "
+            f"{preview(ticket['question'])}{note}"
+        )
+
+    # --- Фоновый поток ---
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        try:
+            self.recover()
+        except Exception as e:
+            logger.error(f"Не удалось восстановить очередь заявок: {e}")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='support', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._drain_queue()
+                self._flush_digests()
+                self._check_sla()
+            except Exception as e:
+                logger.error(f"Ошибка обработки заявок поддержки: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'created': self.created,
+                'assigned': self.assigned,
+                'digests': self.digests,
+                'claimed': self.claimed,
+                'answered': self.answered,
+                'sla_breached': self.sla_breached,
+                'reassigned': self.reassigned,
+            }
+        try:
+            stats['queued'] = self.redis.llen(self._key('queue'))
+        except Exception:
+            stats['queued'] = None
+        return stats
@@ -0,0 +1,145 @@
+import time
+import asyncio
+import logging
+import threading
+
+from aio import await_only, in_async_context
+from outbound import EDIT, INTERACTIVE, BULK
+
+logger = logging.getLogger(__name__)
+
+# Вызовы, на которые действуют лимиты Telegram на отправку сообщений
+RATE_LIMITED = {
+    'send_message', 'send_photo', 'send_document', 'send_media_group',
+    'forward_message', 'copy_message',
+    'edit_message_text', 'edit_message_reply_markup', 'edit_message_caption', 'edit_message_media'
+}
+
+
+class PendingResult:
+    """Результат вызова из очереди исходящих, который еще может быть не выполнен
+
+    Обработчик не ждет отправки: вызов уходит в очередь, а ожидание начинается только
+    при обращении к результату (msg.message_id и т.п.). Ошибка вызова поднимается там же;
+    если результат так никто и не прочитал, ошибка пишется в лог.
+    """
+
+    __slots__ = ('_future', '_wait', '_consumed', '_lock')
+
+    def __init__(self, future, wait=None):
+        self._future = future
+        # wait() -> результат: в асинхронном режиме ожидание не блокирует цикл событий
+        self._wait = wait or future.result
+        self._consumed = False
+        self._lock = threading.Lock()
+        future.add_done_callback(self._log_unread_error)
+
+    def _log_unread_error(self, future):
+        with self._lock:
+            consumed = self._consumed
+        if not consumed and future.exception() is not None:
+            logger.error(f"Ошибка вызова Bot API: {future.exception()}")
+
+    def result(self):
+        with self._lock:
+            self._consumed = True
+        return self._wait()
+
+    def __getattr__(self, name):
+        return getattr(self.result(), name)
+
+    def __bool__(self):
+        return bool(self.result())
+
+
+def resolve(result):
+    """Дожидается результата вызова: PendingResult - до выполнения, остальное - как есть
+
+    Нужен там, где ошибку вызова надо обработать на месте (например, отправить новое
+    сообщение вместо неудавшегося редактирования), а не только записать в лог.
+    """
+    return result.result() if isinstance(result, PendingResult) else result
+
+
+class TelegramApi:
+    """Исходящие вызовы Bot API
+
+    По умолчанию вызовы идут через синхронный TeleBot. В асинхронном режиме
+    (use_async) вызовы из обработчиков выполняет AsyncTeleBot. Если подключена
+    очередь исходящих вызовов (use_dispatcher), отправка и редактирование
+    сообщений идут через нее с учетом лимитов Telegram и сразу возвращают
+    PendingResult: обработчик не ждет, пока очередь пропустит сообщение в чат.
+    Наблюдатель (use_observer) получает время каждого вызова: observe(метод, секунды, ошибка).
+    """
+
+    def __init__(self, bot, priority=INTERACTIVE):
+        self.bot = bot
+        self.async_bot = None
+        self.dispatcher = None
+        self.observe = None
+        self.priority = priority
+
+    def use_async(self, async_bot):
+        self.async_bot = async_bot
+
+    def use_dispatcher(self, dispatcher):
+        self.dispatcher = dispatcher
+
+    def use_observer(self, observe):
+        self.observe = observe
+
+    @property
+    def bulk(self):
+        """Тот же API с низким приоритетом - для рассылок"""
+        api = TelegramApi.__new__(TelegramApi)
+        api.__dict__.update(self.__dict__)
+        api.priority = BULK
+        return api
+
+    def __getattr__(self, name):
+        if self.dispatcher is not None and self.dispatcher.running and name in RATE_LIMITED:
+            return lambda *args, **kwargs: self._dispatch(name, args, kwargs)
+        if self.async_bot is not None and in_async_context():
+            method = getattr(self.async_bot, name)
+            return self._timed(name, lambda *args, **kwargs: await_only(method(*args, **kwargs)))
+        return self._timed(name, getattr(self.bot, name))
+
+    def submit(self, name, *args, **kwargs):
+        """Ставит вызов в очередь исходящих и сразу возвращает Future (для рассылок)"""
+        chat_id = kwargs.get('chat_id', args[0] if args else None)
+        method = self._timed(name, getattr(self.bot, name))
+        return self.dispatcher.submit(chat_id, lambda: method(*args, **kwargs), self.priority)
+
+    def _timed(self, name, method):
+        """Оборачивает вызов замером времени, если подключен наблюдатель"""
+        observe = self.observe
+        if observe is None or not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            failed = False
+            try:
+                return method(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                observe(name, time.perf_counter() - started, failed)
+        return call
+
+    def _dispatch(self, name, args, kwargs):
+        chat_id = kwargs.get('chat_id', args[0] if args else None)
+        priority = EDIT if name.startswith('edit_') and self.priority != BULK else self.priority
+
+        if self.async_bot is not None and in_async_context():
+            # Вызов выполняет AsyncTeleBot в цикле событий; результат, если он нужен, ожидается без блокировки цикла
+            loop = asyncio.get_running_loop()
+            method = getattr(self.async_bot, name)
+            # Время замеряется в потоке очереди: ожидание в очереди в него не входит
+            call = self._timed(name, lambda: asyncio.run_coroutine_threadsafe(method(*args, **kwargs), loop).result())
+            future = self.dispatcher.submit(chat_id, call, priority)
+            return PendingResult(future, lambda: await_only(asyncio.wrap_future(future, loop=loop)))
+
+        method = self._timed(name, getattr(self.bot, name))
+        return PendingResult(self.dispatcher.submit(chat_id, lambda: method(*args, **kwargs), priority))
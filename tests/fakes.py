@@ -0,0 +1,306 @@
+"""Redis и пул БД в памяти для тестов: только команды, которые использует бот"""
+import time
+import asyncio
+import threading
+import itertools
+from contextlib import contextmanager
+
+
+class FakeRedis:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.values = {}
+        self.expires = {}
+        self.lists = {}
+        self.zsets = {}
+        self.hashes = {}
+        self.streams = {}
+        self.groups = {}
+        self._ids = itertools.count(1)
+
+    def _expire_key(self, key):
+        if key in self.expires and self.expires[key] <= time.time():
+            self.values.pop(key, None)
+            self.expires.pop(key, None)
+
+    # --- Строки ---
+
+    def get(self, key):
+        with self._cond:
+            self._expire_key(key)
+            return self.values.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        with self._cond:
+            self._expire_key(key)
+            if nx and key in self.values:
+                return None
+            self.values[key] = str(value)
+            if ex is not None:
+                self.expires[key] = time.time() + ex
+            else:
+                self.expires.pop(key, None)
+            return True
+
+    def expire(self, key, seconds):
+        with self._cond:
+            if key not in self.values:
+                return False
+            self.expires[key] = time.time() + seconds
+            return True
+
+    def incr(self, key):
+        with self._cond:
+            value = int(self.values.get(key, 0)) + 1
+            self.values[key] = str(value)
+            return value
+
+    def delete(self, *keys):
+        with self._cond:
+            removed = 0
+            for key in keys:
+                for store in (self.values, self.lists, self.zsets, self.hashes, self.streams):
+                    if store.pop(key, None) is not None:
+                        removed += 1
+            return removed
+
+    def eval(self, script, numkeys, *args):
+        """Скрипты сравнения владельца (compare-and-expire / compare-and-delete)"""
+        key, owner = args[0], args[1]
+        with self._cond:
+            self._expire_key(key)
+            if self.values.get(key) != owner:
+                return 0
+            if 'expire' in script.lower():
+                self.expires[key] = time.time() + int(args[2])
+            else:
+                self.values.pop(key, None)
+                self.expires.pop(key, None)
+            return 1
+
+    # --- Хэши ---
+
+    def hset(self, key, field, value):
+        with self._cond:
+            fields = self.hashes.setdefault(key, {})
+            added = str(field) not in fields
+            fields[str(field)] = str(value)
+            return int(added)
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(str(field))
+
+    def hdel(self, key, *fields):
+        with self._cond:
+            stored = self.hashes.get(key, {})
+            return sum(stored.pop(str(field), None) is not None for field in fields)
+
+    def hincrby(self, key, field, amount=1):
+        with self._cond:
+            fields = self.hashes.setdefault(key, {})
+            fields[str(field)] = str(int(fields.get(str(field), 0)) + amount)
+            return int(fields[str(field)])
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    # --- Списки ---
+
+    def rpush(self, key, *values):
+        with self._cond:
+            self.lists.setdefault(key, []).extend(str(value) for value in values)
+            return len(self.lists[key])
+
+    def lpush(self, key, *values):
+        with self._cond:
+            items = self.lists.setdefault(key, [])
+            for value in values:
+                items.insert(0, str(value))
+            return len(items)
+
+    def rpop(self, key):
+        with self._cond:
+            items = self.lists.get(key)
+            return items.pop() if items else None
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def lrange(self, key, start, end):
+        items = self.lists.get(key, [])
+        return list(items[start:] if end == -1 else items[start:end + 1])
+
+    def ltrim(self, key, start, end):
+        with self._cond:
+            items = self.lists.get(key, [])
+            self.lists[key] = items[start:] if end == -1 else items[start:end + 1]
+
+    # --- Сортированные множества ---
+
+    def zadd(self, key, mapping, nx=False):
+        with self._cond:
+            zset = self.zsets.setdefault(key, {})
+            for member, score in mapping.items():
+                if not (nx and str(member) in zset):
+                    zset[str(member)] = float(score)
+
+    def zrem(self, key, *members):
+        with self._cond:
+            zset = self.zsets.get(key, {})
+            return sum(zset.pop(str(member), None) is not None for member in members)
+
+    def zremrangebyscore(self, key, low, high):
+        with self._cond:
+            zset = self.zsets.get(key, {})
+            high = float(high)
+            for member in [m for m, score in zset.items() if score <= high]:
+                del zset[member]
+
+    def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    def zrangebyscore(self, key, low, high):
+        return [m for m, score in sorted(self.zsets.get(key, {}).items(), key=lambda i: i[1])
+                if float(low) <= score <= float(high)]
+
+    # --- Потоки ---
+
+    def xadd(self, key, fields, maxlen=None, approximate=True):
+        with self._cond:
+            entry_id = f'{next(self._ids)}-0'
+            self.streams.setdefault(key, []).append((entry_id, dict(fields)))
+            self._cond.notify_all()
+            return entry_id
+
+    def xgroup_create(self, key, group, id='0', mkstream=False):
+        import redis
+        with self._cond:
+            self.streams.setdefault(key, [])
+            if (key, group) in self.groups:
+                raise redis.ResponseError('BUSYGROUP Consumer Group name already exists')
+            self.groups[(key, group)] = {'last': 0, 'pending': {}}
+
+    def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        (key, last_id), = streams.items()
+        deadline = time.time() + (block or 0) / 1000
+        with self._cond:
+            while True:
+                state = self.groups[(key, group)]
+                entries = dict(self.streams.get(key, []))
+                if last_id == '0':
+                    ids = [i for i, owner in state['pending'].items() if owner == consumer][:count]
+                    return [[key, [(i, entries.get(i)) for i in ids]]]
+                new = [(i, f) for i, f in self.streams.get(key, []) if int(i.split('-')[0]) > state['last']][:count]
+                if new:
+                    for entry_id, _ in new:
+                        state['pending'][entry_id] = consumer
+                    state['last'] = int(new[-1][0].split('-')[0])
+                    return [[key, new]]
+                if block is None or time.time() >= deadline:
+                    return []
+                self._cond.wait(deadline - time.time())
+
+    def xack(self, key, group, *ids):
+        with self._cond:
+            pending = self.groups[(key, group)]['pending']
+            return sum(pending.pop(i, None) is not None for i in ids)
+
+    def xdel(self, key, *ids):
+        with self._cond:
+            self.streams[key] = [entry for entry in self.streams.get(key, []) if entry[0] not in ids]
+
+    def xlen(self, key):
+        return len(self.streams.get(key, []))
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class AsyncFakeRedis:
+    """redis.asyncio поверх FakeRedis: каждая команда - корутина"""
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        async def command(*args, **kwargs):
+            self.calls.append(name)
+            await asyncio.sleep(0)
+            return getattr(self.client, name)(*args, **kwargs)
+        return command
+
+    def pipeline(self, transaction=True):
+        client = self
+
+        class Pipeline:
+            def __init__(self):
+                self.pipe = client.client.pipeline(transaction)
+
+            def __getattr__(self, name):
+                getattr(self.pipe, name)
+                return lambda *args, **kwargs: getattr(self.pipe, name)(*args, **kwargs) and self
+
+            async def execute(self):
+                client.calls.append('execute')
+                return self.pipe.execute()
+        return Pipeline()
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+
+class FakeCursor:
+    def __init__(self, pool):
+        self.pool = pool
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        self.pool.queries.append((' '.join(sql.split()), params))
+        self._rows = list(self.pool.results.pop(0)) if self.pool.results else []
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self):
+        return FakeCursor(self.pool)
+
+
+class FakePool:
+    """Пул БД: каждый execute() получает следующий набор строк из results"""
+
+    def __init__(self, results=()):
+        self.results = list(results)
+        self.queries = []
+
+    @contextmanager
+    def connection(self):
+        yield FakeConnection(self)
@@ -0,0 +1,31 @@
+import asyncio
+
+from aio import AsyncAwareClient, greenlet_spawn, in_async_context
+from fakes import AsyncFakeRedis, FakeRedis
+
+
+def test_sync_calls_outside_async_context():
+    redis_client = FakeRedis()
+    bridge = AsyncAwareClient(redis_client)
+    bridge.use_async(AsyncFakeRedis(redis_client))
+    bridge.set('a', '1')
+    assert bridge.get('a') == '1'
+    assert bridge.async_client.calls == []
+
+
+def test_async_context_goes_through_async_client():
+    redis_client = FakeRedis()
+    async_client = AsyncFakeRedis(redis_client)
+    bridge = AsyncAwareClient(redis_client)
+    bridge.use_async(async_client)
+
+    def handler():
+        assert in_async_context()
+        bridge.set('a', '1')
+        pipe = bridge.pipeline()
+        pipe.incr('n')
+        pipe.get('a')
+        return bridge.get('a'), pipe.execute()
+
+    assert asyncio.run(greenlet_spawn(handler)) == ('1', [1, '1'])
+    assert async_client.calls == ['set', 'get', 'execute']
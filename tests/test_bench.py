@@ -0,0 +1,62 @@
+import json
+import types
+
+import pytest
+
+from tools import bench
+
+
+def run_file(tmp_path, name, results, courses=40):
+    path = tmp_path / name
+    meta = {'revision': name, 'courses': courses, 'ratings': 100, 'date': '2026-01-01'}
+    path.write_text(json.dumps({'meta': meta, 'results': {
+        key: {'median_ms': median} for key, median in results.items()
+    }}))
+    return str(path)
+
+
+def compare(tmp_path, before, after, threshold=10.0, min_delta_ms=0.01):
+    args = types.SimpleNamespace(
+        before=run_file(tmp_path, 'before.json', before),
+        after=run_file(tmp_path, 'after.json', after),
+        threshold=threshold,
+        min_delta_ms=min_delta_ms
+    )
+    bench.compare(args)
+
+
+def test_measure_reports_ordered_statistics():
+    result = bench.measure(lambda: None, iterations=50, warmup=2)
+    assert result['iterations'] == 50
+    assert result['min_ms'] <= result['median_ms'] <= result['p95_ms']
+
+
+def test_compare_flags_regression_above_threshold(tmp_path, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        compare(tmp_path, {'survey': 1.0, 'menu': 1.0}, {'survey': 1.2, 'menu': 1.05})
+    assert exit_info.value.code == 1
+    output = capsys.readouterr().out
+    assert '+20.0%  РЕГРЕССИЯ' in output
+    assert 'Регрессии (медиана хуже более чем на 10.0%): survey' in output
+
+
+def test_compare_ignores_timer_noise_and_reports_improvements(tmp_path, capsys):
+    # +100%, но всего на 0.005 мс - меньше min_delta_ms
+    compare(tmp_path, {'tiny': 0.005, 'card': 2.0}, {'tiny': 0.01, 'card': 1.0})
+    output = capsys.readouterr().out
+    assert 'РЕГРЕССИЯ' not in output
+    assert '-50.0%  лучше' in output
+
+
+def test_compare_lists_benchmarks_missing_from_one_run(tmp_path, capsys):
+    compare(tmp_path, {'old': 1.0, 'same': 0.0}, {'new': 1.0, 'same': 0.0})
+    output = capsys.readouterr().out
+    assert 'нет во втором прогоне' in output
+    assert 'нет в первом прогоне' in output
+    assert '+0.0%' in output
+
+
+def test_compare_flags_growth_from_zero_baseline(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        compare(tmp_path, {'cached': 0.0}, {'cached': 0.5})
+    assert 'РЕГРЕССИЯ' in capsys.readouterr().out
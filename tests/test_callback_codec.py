@@ -0,0 +1,68 @@
+import pytest
+
+from callback_codec import CallbackCodec, Choice, Digits, Int, from_base36, to_base36
+
+
+@pytest.fixture
+def codec():
+    codec = CallbackCodec(version=1)
+    codec.register('course_next', 'cn', filter=Choice(['finance', 'pps', 'search']), position=Int(), course_id=Int())
+    codec.register('survey', 's', answers=Digits())
+    return codec
+
+
+def test_base36_round_trip():
+    for value in (0, 1, 35, 36, 123456789):
+        assert from_base36(to_base36(value)) == value
+    assert to_base36(36) == '10'
+
+
+@pytest.mark.parametrize('text', ['', '-1', ' 1', 'A', '1_'])
+def test_from_base36_rejects_malformed_text(text):
+    with pytest.raises(ValueError):
+        from_base36(text)
+
+
+def test_negative_numbers_cannot_be_encoded():
+    with pytest.raises(ValueError):
+        to_base36(-1)
+
+
+def test_encode_and_decode(codec):
+    data = codec.encode('course_next', filter='pps', position=37, course_id=1000)
+    assert data == '1cn_1_11_rs'
+    token, *args = data.split('_')
+    assert token == codec.token('course_next')
+    assert codec.decode('course_next', args) == {'filter': 'pps', 'position': 37, 'course_id': 1000}
+
+
+def test_digits_encode_one_char_per_answer(codec):
+    assert codec.encode('survey', answers=(0, 2, 1)) == '1s_021'
+    assert codec.decode('survey', ['021']) == {'answers': (0, 2, 1)}
+    assert codec.decode('survey', ['']) == {'answers': ()}
+
+
+def test_decode_rejects_wrong_arguments(codec):
+    with pytest.raises(ValueError):
+        codec.decode('course_next', ['1', '2'])
+    with pytest.raises(ValueError):
+        codec.decode('course_next', ['9', '0', '0'])
+    with pytest.raises(ValueError):
+        codec.decode('course_next', ['0', '-1', '0'])
+
+
+def test_unknown_choice_value_is_rejected(codec):
+    with pytest.raises(ValueError):
+        codec.encode('course_next', filter='unknown', position=0, course_id=1)
+
+
+def test_duplicate_code_is_rejected(codec):
+    with pytest.raises(ValueError):
+        codec.register('other', 'cn')
+
+
+def test_callback_data_limit_is_enforced():
+    codec = CallbackCodec()
+    codec.register('long', 'l', answers=Digits())
+    with pytest.raises(ValueError):
+        codec.encode('long', answers=[1] * 70)
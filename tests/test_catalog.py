@@ -0,0 +1,91 @@
+import threading
+
+from catalog import CatalogCache
+
+
+def test_get_caches_loaded_value():
+    cache = CatalogCache(ttl=60)
+    calls = []
+    loader = lambda: calls.append(1) or ['course']
+    assert cache.get(('category', 'finance'), loader) == ['course']
+    assert cache.get(('category', 'finance'), loader) == ['course']
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_invalidate_key_drops_only_that_key():
+    cache = CatalogCache(ttl=60)
+    cache.get('a', lambda: 1)
+    cache.get('b', lambda: 2)
+    cache.invalidate('a')
+    assert cache.get('a', lambda: 10) == 10
+    assert cache.get('b', lambda: 20) == 2
+
+
+def test_key_invalidation_during_load_discards_stale_result():
+    cache = CatalogCache(ttl=60)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_loader():
+        started.set()
+        release.wait(5)
+        return 'stale'
+
+    thread = threading.Thread(target=cache.get, args=('a', slow_loader))
+    thread.start()
+    started.wait(5)
+    cache.invalidate('a')
+    release.set()
+    thread.join(5)
+
+    assert cache.get('a', lambda: 'fresh') == 'fresh'
+
+
+def test_invalidate_notifies_subscribers():
+    cache = CatalogCache(ttl=60)
+    seen = []
+    cache.on_invalidate(seen.append)
+    cache.invalidate()
+    cache.invalidate('a')
+    assert seen == [None, 'a']
+
+
+def test_other_key_invalidation_keeps_running_load():
+    cache = CatalogCache(ttl=60)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_loader():
+        started.set()
+        release.wait(5)
+        return 'courses'
+
+    thread = threading.Thread(target=cache.get, args=(('category', 'pps'), slow_loader))
+    thread.start()
+    started.wait(5)
+    # Запись оценок сбрасывает только свой ключ - загрузка курсов сохраняется
+    cache.invalidate(('ratings', 'course'))
+    release.set()
+    thread.join(5)
+
+    assert cache.get(('category', 'pps'), lambda: 'reloaded') == 'courses'
+    assert cache.stats()['misses'] == 1
+
+
+def test_full_invalidation_during_load_discards_result():
+    cache = CatalogCache(ttl=60)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_loader():
+        started.set()
+        release.wait(5)
+        return 'stale'
+
+    thread = threading.Thread(target=cache.get, args=('a', slow_loader))
+    thread.start()
+    started.wait(5)
+    cache.invalidate()
+    release.set()
+    thread.join(5)
+
+    assert cache.get('a', lambda: 'fresh') == 'fresh'
@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+from aio import AsyncAwareClient, greenlet_spawn
+from fakes import AsyncFakeRedis, FakePool, FakeRedis
+from faq import (DEFLECTED, EXPIRED, QUESTION, SUGGESTED, DeflectionStats, FaqIndex, PendingQuestions,
+                 load_faq, stem, tokenize)
+
+ENTRIES = [
+    {'faq_id': 1, 'topic': 'Оплата', 'question': 'Как оплатить курс?',
+     'answer': 'Оплатить курс можно картой на сайте.'},
+    {'faq_id': 2, 'topic': 'Оплата', 'question': 'Можно ли вернуть деньги?',
+     'answer': 'Возврат денег возможен в течение 14 дней.'},
+    {'faq_id': 3, 'topic': 'Обучение', 'question': 'Где найти расписание занятий?',
+     'answer': 'Расписание занятий есть в личном кабинете.'},
+]
+
+
+def test_tokenize_drops_stop_words_and_stems():
+    assert tokenize('Подскажите, пожалуйста, где расписание?') == ['где', stem('расписание')]
+    assert stem('курсами') == stem('курсы') == 'курс'
+    assert tokenize('Ёлка') == tokenize('елка')
+
+
+def test_search_ranks_best_entry_first():
+    index = FaqIndex(ENTRIES)
+    matches = index.search('как вернуть деньги за курс', limit=3, min_score=0.0)
+    assert matches[0][1]['faq_id'] == 2
+    assert [score for score, _ in matches] == sorted((score for score, _ in matches), reverse=True)
+
+
+def test_search_tolerates_other_word_forms_and_typos():
+    index = FaqIndex(ENTRIES)
+    assert index.search('расписанием занятиях', min_score=0.2)[0][1]['faq_id'] == 3
+    assert index.search('распесание', min_score=0.1)[0][1]['faq_id'] == 3
+
+
+def test_search_without_known_words_returns_nothing():
+    index = FaqIndex(ENTRIES)
+    assert index.search('зачем?') == []
+    assert index.search('оплата', limit=3, min_score=1.01) == []
+    assert index.topics['Оплата'] == ENTRIES[:2]
+
+
+def test_deflection_stats_counts_rates():
+    stats = DeflectionStats(FakeRedis())
+    for event in (QUESTION, QUESTION, SUGGESTED, SUGGESTED, DEFLECTED, EXPIRED):
+        stats.record(event)
+    result = stats.stats()
+    assert result[QUESTION] == 2 and result[EXPIRED] == 1
+    assert result['deflection_rate'] == 0.5
+    assert result['suggestion_success'] == 0.5
+
+
+def test_pending_question_is_taken_once():
+    escalated = []
+    pending = PendingQuestions(FakeRedis(), lambda *question: escalated.append(question), timeout=60)
+    pending.hold(5, 'ann', 'Как оплатить?')
+    assert pending.take(5) == ('ann', 'Как оплатить?')
+    assert pending.take(5) is None
+    pending.escalate_expired()
+    assert escalated == []
+
+
+def test_unanswered_question_escalates_after_timeout():
+    escalated = []
+    redis_client = FakeRedis()
+    pending = PendingQuestions(redis_client, lambda *question: escalated.append(question), timeout=60)
+    pending.hold(5, 'ann', 'Как оплатить?')
+    pending.hold(6, 'bob', 'Где расписание?')
+    pending.escalate_expired()
+    assert escalated == []
+
+    redis_client.zadd('faq:pending:due', {5: time.time() - 1})
+    pending.escalate_expired()
+    assert escalated == [(5, 'ann', 'Как оплатить?')]
+    # Кнопка после таймаута уже ничего не отправит повторно
+    assert pending.take(5) is None
+    assert pending.take(6) == ('bob', 'Где расписание?')
+
+
+def test_load_faq_uses_given_connection():
+    pool = FakePool([[(1, 'Оплата', 'Как оплатить?', 'Картой')]])
+    assert load_faq(pool.connection) == [
+        {'faq_id': 1, 'topic': 'Оплата', 'question': 'Как оплатить?', 'answer': 'Картой'}
+    ]
+    assert 'FROM faq_entries' in pool.queries[0][0]
+
+
+def test_handler_counters_go_through_async_redis():
+    redis_client = FakeRedis()
+    async_client = AsyncFakeRedis(redis_client)
+    bridge = AsyncAwareClient(redis_client)
+    bridge.use_async(async_client)
+    stats = DeflectionStats(bridge)
+    asyncio.run(greenlet_spawn(stats.record, QUESTION))
+    assert async_client.calls == ['hincrby']
+    assert stats.stats()[QUESTION] == 1
+
+
+def test_second_question_does_not_replace_pending_one():
+    escalated = []
+    pending = PendingQuestions(FakeRedis(), lambda *question: escalated.append(question), timeout=60)
+    pending.hold(5, 'ann', 'Как оплатить?')
+    pending.hold(5, 'ann', 'Где расписание?')
+    assert escalated == [(5, 'ann', 'Как оплатить?')]
+    assert pending.take(5) == ('ann', 'Где расписание?')
+
+
+def test_escalate_pending_sends_question_once():
+    escalated = []
+    pending = PendingQuestions(FakeRedis(), lambda *question: escalated.append(question), timeout=60)
+    assert not pending.escalate_pending(5)
+    pending.hold(5, 'ann', 'Как оплатить?')
+    assert pending.escalate_pending(5)
+    assert not pending.escalate_pending(5)
+    assert escalated == [(5, 'ann', 'Как оплатить?')]
@@ -0,0 +1,55 @@
+import time
+
+from inline import InlineResultCache, normalize_query
+
+
+def test_normalize_query_ignores_case_and_spaces():
+    assert normalize_query('  Финансы   ДЛЯ  всех ') == 'финансы для всех'
+    assert normalize_query(None) == ''
+
+
+def test_results_are_shared_by_normalized_query():
+    built = []
+    cache = InlineResultCache(lambda query: built.append(query) or [query], max_entries=10)
+    assert cache.get('Финансы') == ('финансы',)
+    assert cache.get(' финансы ') == ('финансы',)
+    assert built == ['финансы']
+    assert cache.stats()['hits'] == 1
+
+
+def test_least_recently_used_query_is_evicted():
+    built = []
+    cache = InlineResultCache(lambda query: built.append(query) or [query], max_entries=2)
+    cache.get('a')
+    cache.get('b')
+    cache.get('a')
+    cache.get('c')
+    assert cache.stats()['entries'] == 2
+    cache.get('a')
+    cache.get('b')
+    assert built == ['a', 'b', 'c', 'b']
+
+
+def test_expired_results_are_rebuilt():
+    built = []
+    cache = InlineResultCache(lambda query: built.append(query) or [query], ttl=0.01)
+    cache.get('a')
+    time.sleep(0.02)
+    cache.get('a')
+    assert built == ['a', 'a']
+
+
+def test_catalog_invalidation_clears_cache():
+    cache = InlineResultCache(lambda query: [query])
+    cache.get('a')
+    cache.invalidate(('ratings', 'course'))
+    assert cache.stats()['entries'] == 1
+    cache.invalidate()
+    assert cache.stats()['entries'] == 0
+
+
+def test_page_returns_next_offset():
+    cache = InlineResultCache(lambda query: list(range(5)), page_size=2)
+    assert cache.page('q') == ((0, 1), '2')
+    assert cache.page('q', '4') == ((4,), '')
+    assert cache.page('q', 'bad') == ((0, 1), '2')
@@ -0,0 +1,44 @@
+import json
+
+from menus import MenuRegistry
+
+
+def buttons(menu_or_markup):
+    markup = getattr(menu_or_markup, 'markup', menu_or_markup)
+    return [
+        [(button['text'], button.get('callback_data') or button.get('url')) for button in row]
+        for row in json.loads(markup.to_json())['inline_keyboard']
+    ]
+
+
+def test_menu_adds_back_and_main_menu_rows():
+    registry = MenuRegistry()
+    menu = registry.menu('courses', 'Курсы', [('Финансы', 'finance')], back='main_menu_alt')
+    assert menu.text == 'Курсы' and menu.back == 'main_menu_alt'
+    assert buttons(menu) == [
+        [('Финансы', 'finance')],
+        [('🔙 Назад', 'main_menu_alt')],
+        [('🏠 Главное меню', 'main_menu')]
+    ]
+    assert 'courses' in registry and registry.keys() == ['courses']
+
+
+def test_menu_navigation_in_one_row_and_url_buttons():
+    registry = MenuRegistry()
+    menu = registry.menu(
+        'links', 'Ссылки', [[('Сайт', {'url': 'https://example.org'}), ('Ок', 'ok')]],
+        back='courses', nav_in_row=True, back_text='⬅️'
+    )
+    assert buttons(menu) == [
+        [('Сайт', 'https://example.org'), ('Ок', 'ok')],
+        [('⬅️', 'courses'), ('🏠 Главное меню', 'main_menu')]
+    ]
+
+
+def test_markup_json_is_built_once():
+    registry = MenuRegistry()
+    keyboard = registry.keyboard('stars', [[('⭐', 'rate_1'), ('⭐⭐', 'rate_2')]])
+    assert registry.get_keyboard('stars') is keyboard
+    assert keyboard.to_json() is keyboard.to_json()
+    assert registry.get('missing') is None
+    assert buttons(registry.menu('bare', 'Без навигации', [], main_menu=False)) == []
@@ -0,0 +1,66 @@
+import pytest
+
+from metrics import MetricsRegistry, cached, timing_observer
+
+
+def test_render_counters_gauges_and_callbacks():
+    registry = MetricsRegistry(prefix='bot_')
+    updates = registry.counter('updates_total', 'Апдейты', ['kind'])
+    registry.gauge('queue', 'Очередь').set(3)
+    registry.callback('cache_entries', 'Записи кэша', lambda: {'catalog': 2, 'search': 1}, ['cache'])
+    updates.inc(kind='message')
+    updates.inc(2, kind='message')
+    lines = registry.render().splitlines()
+    assert '# TYPE bot_updates_total counter' in lines
+    assert 'bot_updates_total{kind="message"} 3' in lines
+    assert 'bot_queue 3' in lines
+    assert 'bot_cache_entries{cache="catalog"} 2' in lines
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram('latency_seconds', 'Время', ['route'], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value, route='menu')
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{route="menu",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="menu",le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{route="menu",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{route="menu"} 3' in lines
+
+
+def test_labels_are_checked_and_escaped():
+    registry = MetricsRegistry()
+    counter = registry.counter('errors_total', 'Ошибки', ['route'])
+    with pytest.raises(ValueError):
+        counter.inc(kind='x')
+    with pytest.raises(ValueError):
+        registry.counter('errors_total', 'Повтор')
+    counter.inc(route='a"b\nc')
+    assert 'errors_total{route="a\\"b\\nc"} 1' in registry.render()
+
+
+def test_failing_collector_is_skipped():
+    registry = MetricsRegistry()
+    registry.callback('broken', 'Сломана', lambda: 1 / 0)
+    registry.gauge('ok', 'Работает').set(1)
+    assert registry.render().splitlines()[-1] == 'ok 1'
+    assert registry.collect_errors == 1
+
+
+def test_cached_and_timing_observer():
+    calls = []
+    collect = cached(lambda: calls.append(1) or len(calls), interval=60)
+    assert collect() == collect() == 1
+
+    registry = MetricsRegistry()
+    observe = timing_observer(
+        registry.histogram('redis_seconds', 'Redis', ['command']),
+        registry.counter('redis_errors_total', 'Ошибки Redis', ['command']),
+        'command'
+    )
+    observe('GET', 0.002)
+    observe('GET', 0.003, failed=True)
+    output = registry.render()
+    assert 'redis_seconds_count{command="GET"} 2' in output
+    assert 'redis_errors_total{command="GET"} 1' in output
@@ -0,0 +1,40 @@
+import time
+
+from navstate import NavState, NavigationStore
+from session import MemorySessionStore
+
+
+def store(ttl=None):
+    return NavigationStore(MemorySessionStore().namespace('course_position'), ttl)
+
+
+def test_state_round_trips_through_session():
+    positions = store()
+    positions.set(1, NavState('finance', 3, 17, 100))
+    state = positions.get(1)
+    assert (state.key, state.position, state.course_id, state.message_id) == ('finance', 3, 17, 100)
+    assert state.touched is not None
+    assert 1 in positions
+
+
+def test_legacy_dict_record_is_dropped():
+    positions = store()
+    # Словарь старого формата с не более чем пятью ключами не должен распаковаться в NavState
+    positions.namespace[1] = {'courses': [], 'position': 0, 'saved_answers': {}, 'saved_question': 3}
+    assert positions.get(1) is None
+    assert 1 not in positions.namespace
+
+
+def test_idle_state_expires():
+    positions = store(ttl=60)
+    positions.set(1, NavState('finance'))
+    positions.namespace[1] = NavState('finance', touched=int(time.time()) - 120).to_list()
+    assert positions.get(1) is None
+    assert 1 not in positions.namespace
+
+
+def test_pop_returns_and_removes_state():
+    positions = store()
+    positions.set(1, NavState('pps', 2))
+    assert positions.pop(1).position == 2
+    assert positions.get(1) is None
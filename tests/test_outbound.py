@@ -0,0 +1,134 @@
+import threading
+import time
+
+import pytest
+
+from outbound import BULK, EDIT, INTERACTIVE, OutboundDispatcher, TokenBucket
+from telegram_api import PendingResult, resolve
+
+
+class RateLimited(Exception):
+    error_code = 429
+    result_json = {'parameters': {'retry_after': 0.05}}
+
+
+def test_token_bucket_allows_burst_then_paces():
+    bucket = TokenBucket(rate=1.0, capacity=3, now=0.0)
+    for _ in range(3):
+        assert bucket.wait_time(0.0) == 0.0
+        bucket.consume(0.0)
+    assert bucket.wait_time(0.0) == pytest.approx(1.0)
+    assert bucket.wait_time(0.5) == pytest.approx(0.5)
+    assert bucket.wait_time(1.0) == 0.0
+
+
+def test_token_bucket_refill_is_capped():
+    bucket = TokenBucket(rate=1.0, capacity=3, now=0.0)
+    bucket.consume(0.0)
+    assert not bucket.is_full(0.5)
+    assert bucket.is_full(100.0)
+    assert bucket.tokens == 3
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = OutboundDispatcher(global_rate=1000, chat_rate=1, chat_burst=1, workers=4)
+    dispatcher.start()
+    yield dispatcher
+    dispatcher.stop(timeout=5)
+
+
+def test_calls_to_one_chat_run_in_order(dispatcher):
+    done = []
+    futures = [dispatcher.submit(1, lambda i=i: done.append(i), EDIT) for i in range(20)]
+    for future in futures:
+        future.result(5)
+    assert done == list(range(20))
+
+
+def test_edits_do_not_wait_for_chat_bucket(dispatcher):
+    dispatcher.submit(1, lambda: None, INTERACTIVE).result(5)
+    started = time.monotonic()
+    dispatcher.submit(1, lambda: None, EDIT).result(5)
+    assert time.monotonic() - started < 0.5
+
+
+def test_paced_chat_does_not_block_other_chats(dispatcher):
+    dispatcher.submit(1, lambda: None, INTERACTIVE).result(5)
+    slow = dispatcher.submit(1, lambda: None, INTERACTIVE)
+    started = time.monotonic()
+    dispatcher.submit(2, lambda: None, INTERACTIVE).result(5)
+    assert time.monotonic() - started < 0.5
+    assert not slow.done()
+    slow.result(5)
+
+
+def test_interactive_call_overtakes_bulk_for_same_chat(dispatcher):
+    release, done = threading.Event(), []
+    first = dispatcher.submit(1, lambda: release.wait(5) and done.append('first'), EDIT)
+    bulk = [dispatcher.submit(1, lambda i=i: done.append(f'bulk{i}'), BULK) for i in range(2)]
+    reply = dispatcher.submit(1, lambda: done.append('reply'), INTERACTIVE)
+    edit = dispatcher.submit(1, lambda: done.append('edit'), EDIT)
+    release.set()
+    for future in [first, edit, reply] + bulk:
+        future.result(10)
+    assert done == ['first', 'edit', 'reply', 'bulk0', 'bulk1']
+
+
+def test_rate_limited_call_is_retried_in_order(dispatcher):
+    attempts, done = [], []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RateLimited()
+        done.append('first')
+
+    first = dispatcher.submit(1, flaky, EDIT)
+    second = dispatcher.submit(1, lambda: done.append('second'), EDIT)
+    second.result(5)
+    first.result(5)
+    assert done == ['first', 'second']
+    assert dispatcher.stats()['retried_429'] == 1
+
+
+def test_expired_pauses_are_pruned():
+    dispatcher = OutboundDispatcher()
+    dispatcher._paused = {1: 10.0, 2: 1000.0}
+    dispatcher._last_prune = 0.0
+    dispatcher._prune(100.0)
+    assert dispatcher._paused == {2: 1000.0}
+
+
+def test_stats_count_calls_waiting_behind_their_chat():
+    dispatcher = OutboundDispatcher()
+    dispatcher.submit(1, lambda: None, INTERACTIVE)
+    dispatcher.submit(1, lambda: None, BULK)
+    assert dispatcher.stats()['queued'] == {'edit': 0, 'interactive': 1, 'bulk': 1}
+
+
+def test_pending_result_waits_only_when_read(dispatcher):
+    release = threading.Event()
+    pending = PendingResult(dispatcher.submit(1, lambda: release.wait(5) and 'message', EDIT))
+    assert not pending._future.done()
+    release.set()
+    assert pending.result() == 'message'
+    assert pending.upper() == 'MESSAGE'
+
+
+def test_pending_result_raises_error_on_read(dispatcher):
+    def fail():
+        raise ValueError('bad request')
+
+    pending = PendingResult(dispatcher.submit(1, fail, EDIT))
+    with pytest.raises(ValueError):
+        pending.message_id
+
+
+def test_resolve_raises_error_of_pending_call(dispatcher):
+    def fail():
+        raise ValueError('message to edit not found')
+
+    with pytest.raises(ValueError):
+        resolve(PendingResult(dispatcher.submit(1, fail, EDIT)))
+    assert resolve('message') == 'message'
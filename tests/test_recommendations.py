@@ -0,0 +1,81 @@
+import time
+
+from catalog import CatalogCache
+from recommendations import RecommendationIndex, match_courses
+
+QUESTIONS = [
+    {'key': 'role', 'options': ['Студент', 'ППС']},
+    {'key': 'direction', 'options': ['Финансы', 'Педагогика']},
+    {'key': 'time', 'options': ['1-4 недели', 'Более 8 недель']},
+    {'key': 'budget', 'options': ['До 10 000 руб.', 'Более 20 000 руб.']},
+]
+
+
+def course(title, direction='finance', price=5000, duration=2):
+    return {'title': title, 'direction': direction, 'price': price, 'duration': duration}
+
+
+ANSWERS = {'role': 'Студент', 'direction': 'Финансы', 'time': '1-4 недели', 'budget': 'До 10 000 руб.'}
+
+
+def test_match_courses_filters_and_deduplicates():
+    courses = {'students': [
+        course('A'), course('A'), course('B', price=50000), course('C', direction='pedagogy'), course('D', duration=12)
+    ]}
+    assert [c['title'] for c in match_courses(courses, ANSWERS)] == ['A']
+
+
+def test_index_matches_direct_filter():
+    catalog = {'students': [course('A'), course('B', price=30000, duration=10)], 'pps': [course('P')]}
+    index = RecommendationIndex(QUESTIONS, lambda: catalog)
+    assert index.recommend(ANSWERS) == match_courses(catalog, ANSWERS)
+    assert index.stats()['combinations'] == 16
+
+
+def test_unknown_answers_fall_back_to_filter():
+    index = RecommendationIndex(QUESTIONS, lambda: {'students': [course('A')]})
+    answers = dict(ANSWERS, budget='Любой')
+    assert [c['title'] for c in index.recommend(answers)] == ['A']
+    assert index.stats()['fallbacks'] == 1
+
+
+def test_key_invalidation_rebuilds_index():
+    catalog = {'students': [course('A')]}
+    index = RecommendationIndex(QUESTIONS, lambda: catalog)
+    index.recommend(ANSWERS)
+    catalog['students'] = [course('New')]
+    index.invalidate(('category', 'students'))
+    assert [c['title'] for c in index.recommend(ANSWERS)] == ['New']
+
+
+def test_catalog_ttl_expiry_drops_index():
+    cache = CatalogCache(ttl=0.01)
+    versions = iter([[course('A')], [course('B')]])
+    index = RecommendationIndex(QUESTIONS, lambda: {'students': cache.get(('category', 'students'), lambda: next(versions))})
+    cache.on_invalidate(index.invalidate)
+    assert [c['title'] for c in index.recommend(ANSWERS)] == ['A']
+
+    time.sleep(0.02)
+    # Чтение истекшей записи (как при следующем запросе каталога) сбрасывает индекс
+    assert cache.get(('category', 'students'), lambda: [course('B')])[0]['title'] == 'B'
+    assert cache.stats()['expirations'] == 1
+    assert [c['title'] for c in index.recommend(ANSWERS)] == ['B']
+
+
+def test_unrelated_key_invalidation_keeps_index():
+    builds = []
+    catalog = {'students': [course('A')]}
+    index = RecommendationIndex(
+        QUESTIONS, lambda: builds.append(1) or catalog, catalog_keys=[('category', 'students'), ('category', 'pps')]
+    )
+    index.recommend(ANSWERS)
+    index.invalidate(('ratings', 'course'))
+    index.invalidate(('category', 'top'))
+    index.recommend(ANSWERS)
+    assert len(builds) == 1
+
+    index.invalidate(('category', 'pps'))
+    index.recommend(ANSWERS)
+    index.invalidate()
+    index.recommend(ANSWERS)
+    assert len(builds) == 3
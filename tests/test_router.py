@@ -0,0 +1,65 @@
+import types
+
+import pytest
+
+from router import CallbackRouter
+
+
+@pytest.fixture
+def router():
+    router = CallbackRouter()
+
+    @router.route('main_menu', 'back_to_main')
+    def main_menu(call, callback):
+        return f'main:{callback.route}'
+
+    @router.prefix('course')
+    def course(call, callback):
+        return ('course', callback.args)
+
+    @router.prefix('course_next')
+    def course_next(call, callback):
+        return ('next', callback.args)
+
+    return router
+
+
+def call(data):
+    return types.SimpleNamespace(data=data)
+
+
+def test_exact_route_wins_over_prefix(router):
+    router.route('course_list')(lambda call, callback: 'list')
+    assert router.dispatch(call('course_list')) == 'list'
+    assert router.dispatch(call('course_list_2')) == ('course', ('list', '2'))
+
+
+def test_dispatch_exact_and_prefix_routes(router):
+    assert router.dispatch(call('back_to_main')) == 'main:back_to_main'
+    assert router.dispatch(call('course_12')) == ('course', ('12',))
+    # Самый длинный префикс: course_next, а не course с аргументом next
+    assert router.dispatch(call('course_next_3_7')) == ('next', ('3', '7'))
+
+
+def test_resolve_splits_namespace_action_and_args(router):
+    _, callback = router.resolve('course_next_3')
+    assert callback.namespace == 'course'
+    assert callback.action == 'next'
+    assert callback.args == ('3',)
+    assert callback.route == 'course_next'
+
+
+def test_unknown_data_is_counted_as_unmatched(router):
+    assert router.dispatch(call('nothing_here')) is None
+    assert router.dispatch(call(None)) is None
+    router.dispatch(call('main_menu'))
+    assert router.stats() == {'unmatched': 2, 'main_menu': 1}
+    assert router.route_name('course_1') == 'course'
+    assert router.route_name('zzz') == 'unmatched'
+
+
+def test_duplicate_routes_are_rejected(router):
+    with pytest.raises(ValueError):
+        router.route('main_menu')(lambda call, callback: None)
+    with pytest.raises(ValueError):
+        router.prefix('course')(lambda call, callback: None)
@@ -0,0 +1,57 @@
+import time
+
+from session import MemorySessionStore, create_session_store
+
+
+def test_namespaces_share_one_session():
+    sessions = MemorySessionStore()
+    states, positions = sessions.namespace('state'), sessions.namespace('position')
+    states[1] = 'survey'
+    positions[1] = [1, 2]
+    assert states[1] == 'survey'
+    assert positions.get(1) == [1, 2]
+    states[2] = 'rating'
+    assert sessions.field_counts() == {'state': 2, 'position': 1}
+    del states[1]
+    assert states.get(1) is None
+    assert positions.get(1) == [1, 2]
+
+
+def test_unit_of_work_writes_on_exit():
+    sessions = MemorySessionStore()
+    states = sessions.namespace('state')
+    with sessions.unit_of_work():
+        states[1] = 'a'
+        assert states[1] == 'a'
+        assert sessions.stats()['entries'] == 0
+    assert sessions.stats()['entries'] == 1
+
+
+def test_least_recently_used_session_is_evicted():
+    sessions = MemorySessionStore(max_entries=2)
+    states = sessions.namespace('state')
+    states[1] = 'a'
+    states[2] = 'b'
+    assert states[1] == 'a'
+    states[3] = 'c'
+    assert states.get(2) is None
+    assert states[1] == 'a' and states[3] == 'c'
+    assert sessions.stats()['evicted'] == 1
+
+
+def test_expired_sessions_are_swept_without_access():
+    sessions = MemorySessionStore(ttl=0.01, sweep_interval=0.01)
+    states = sessions.namespace('state')
+    for user_id in range(10):
+        states[user_id] = 'a'
+    time.sleep(0.03)
+    states[100] = 'b'
+    stats = sessions.stats()
+    assert stats['entries'] == 1
+    assert stats['expired'] == 10
+
+
+def test_create_session_store_limits_memory_backend():
+    sessions = create_session_store('memory', ttl=60, max_entries=5)
+    assert isinstance(sessions, MemorySessionStore)
+    assert sessions.stats()['max_entries'] == 5
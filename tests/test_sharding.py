@@ -0,0 +1,135 @@
+import threading
+import time
+
+from fakes import FakeRedis
+from sharding import ShardWorker, UpdateStreams, update_chat_id
+
+
+def message(update_id, chat_id, text='hi'):
+    return {'update_id': update_id, 'message': {'chat': {'id': chat_id}, 'text': text}}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'условие не выполнилось'
+        time.sleep(0.01)
+
+
+def test_update_chat_id_covers_messages_callbacks_and_users():
+    assert update_chat_id(message(1, -100)) == -100
+    assert update_chat_id({'callback_query': {'from': {'id': 7}, 'message': {'chat': {'id': 5}}}}) == 5
+    assert update_chat_id({'callback_query': {'from': {'id': 7}}}) == 7
+    assert update_chat_id({'inline_query': {'from': {'id': 8}}}) == 8
+    assert update_chat_id({'poll_answer': {'user': {'id': 9}}}) == 9
+    assert update_chat_id({'poll': {'id': 'x'}}) is None
+
+
+def test_shard_of_keeps_chat_together_and_falls_back_to_update_id():
+    streams = UpdateStreams(FakeRedis(), shards=4)
+    assert streams.shard_of(message(1, 6)) == streams.shard_of(message(2, 6)) == 2
+    # Отрицательные id групп тоже попадают в 0..shards-1
+    assert streams.shard_of(message(3, -1001)) == -1001 % 4
+    assert streams.shard_of({'update_id': 13, 'poll': {'id': 'x'}}) == 1
+
+
+def worker(redis_client, process, shards=2, **kwargs):
+    streams = UpdateStreams(redis_client, shards=shards)
+    streams.ensure_groups()
+    return ShardWorker(streams, process, lease_ttl=30, block_ms=50, **kwargs)
+
+
+def test_lease_scripts_only_touch_own_lease():
+    redis_client = FakeRedis()
+    first, second = worker(redis_client, print), worker(redis_client, print)
+    assert first._claim(0)
+    assert not second._claim(0)
+    assert not second._renew(0)
+    assert not second._release(0)
+    assert redis_client.get('updates:lease:0') == first.owner
+    assert first._renew(0)
+    assert first._release(0)
+    assert second._claim(0)
+
+
+def test_worker_processes_chat_updates_in_order():
+    redis_client = FakeRedis()
+    seen = []
+    shard_worker = worker(redis_client, lambda update: seen.append(update['message']['text']))
+    for i in range(20):
+        shard_worker.streams.publish(message(i, 4, text=str(i)))
+    shard_worker.rebalance()
+    try:
+        wait_for(lambda: len(seen) == 20)
+        assert seen == [str(i) for i in range(20)]
+        assert shard_worker.streams.backlog()[0] == 0
+    finally:
+        shard_worker.stop(timeout=5)
+    assert redis_client.get('updates:lease:0') is None
+
+
+def test_surplus_shard_lease_is_kept_until_reader_finishes():
+    redis_client = FakeRedis()
+    started, finish = threading.Event(), threading.Event()
+
+    def slow(update):
+        started.set()
+        finish.wait(5)
+
+    first = worker(redis_client, slow)
+    first.rebalance()
+    assert sorted(first._shards) == [0, 1]
+    first.streams.publish(message(1, 1))
+    assert started.wait(5)
+
+    # Второй обработчик: первый отдает шард 1, но его поток еще обрабатывает апдейт
+    second = worker(redis_client, print)
+    second._alive_workers()
+    first.rebalance()
+    assert first.stats()['draining'] == [1]
+    assert redis_client.get('updates:lease:1') == first.owner
+    second.rebalance()
+    assert 1 not in second._shards
+
+    finish.set()
+    wait_for(lambda: not first._draining[1].is_alive())
+    first.rebalance()
+    assert first.stats()['draining'] == []
+    assert redis_client.get('updates:lease:1') is None
+    second.rebalance()
+    assert 1 in second._shards
+    first.stop(timeout=5)
+    second.stop(timeout=5)
+
+
+def test_lost_lease_stops_reader_after_current_update():
+    redis_client = FakeRedis()
+    started, finish, seen = threading.Event(), threading.Event(), []
+
+    def slow(update):
+        seen.append(update['update_id'])
+        started.set()
+        finish.wait(5)
+
+    shard_worker = worker(redis_client, slow, shards=1)
+    shard_worker.rebalance()
+    shard_worker.streams.publish(message(1, 1))
+    shard_worker.streams.publish(message(2, 1))
+    assert started.wait(5)
+
+    # Аренда истекла и досталась другому обработчику, пока апдейт еще обрабатывается
+    redis_client.set('updates:lease:0', 'other')
+    shard_worker.rebalance()
+    assert shard_worker.stats()['lost'] == [0]
+    redis_client.delete('updates:lease:0')
+    shard_worker.rebalance()
+    assert shard_worker._shards == {}
+
+    finish.set()
+    wait_for(lambda: not shard_worker._lost[0].is_alive())
+    assert seen == [1]
+    shard_worker.rebalance()
+    assert shard_worker.stats()['lost'] == []
+    assert 0 in shard_worker._shards
+    wait_for(lambda: seen == [1, 2])
+    shard_worker.stop(timeout=5)
@@ -0,0 +1,166 @@
+import time
+import types
+
+import pytest
+
+from fakes import FakePool, FakeRedis
+from support import LEAST_LOADED, ROUND_ROBIN, SupportDesk, preview
+
+
+def desk(pool=None, redis_client=None, send=None, **kwargs):
+    return SupportDesk(
+        redis_client or FakeRedis(),
+        pool or FakePool(),
+        send or (lambda chat_id, text, reply_markup=None: types.SimpleNamespace(message_id=1)),
+        claim_data=lambda ticket_id: f'tc_{ticket_id}',
+        agents=[10, 20, 30],
+        **kwargs
+    )
+
+
+def test_preview_collapses_whitespace_and_truncates():
+    assert preview('a  b\nc') == 'a b c'
+    assert preview('x' * 10, limit=5) == 'xxxx…'
+
+
+def test_round_robin_takes_agents_in_turn():
+    support = desk(strategy=ROUND_ROBIN)
+    assert [support.pick_agent() for _ in range(4)] == [20, 30, 10, 20]
+    assert support.pick_agent(exclude=[10, 20, 30]) is None
+
+
+def test_least_loaded_prefers_idle_agent(monkeypatch):
+    support = desk(strategy=LEAST_LOADED)
+    monkeypatch.setattr(support, '_loads', lambda: {10: 2, 20: 0, 30: 1})
+    assert support.pick_agent() == 20
+    assert support.pick_agent(exclude=[20]) == 30
+
+
+def queue_digest(redis_client, agent, *ticket_ids, since=0):
+    redis_client.rpush(f'support:digest:{agent}', *ticket_ids)
+    redis_client.set(f'support:digest:{agent}:since', since)
+
+
+def test_failed_digest_keeps_tickets_for_retry(monkeypatch):
+    redis_client = FakeRedis()
+    support = desk(redis_client=redis_client, digest_interval=0)
+    queue_digest(redis_client, 10, 1, 2)
+
+    def fail(agent, ticket_ids):
+        raise RuntimeError('Telegram недоступен')
+
+    monkeypatch.setattr(support, 'send_digest', fail)
+    with pytest.raises(RuntimeError):
+        support._flush_digests()
+    assert redis_client.lrange('support:digest:10', 0, -1) == ['1', '2']
+    # Блокировка дайджеста снята - следующий проход повторит отправку
+    assert redis_client.get('support:digest:10:lock') is None
+
+
+def test_sent_digest_keeps_tickets_added_during_send(monkeypatch):
+    redis_client = FakeRedis()
+    support = desk(redis_client=redis_client, digest_interval=0)
+    queue_digest(redis_client, 10, 1, 2)
+    sent = []
+
+    def send_digest(agent, ticket_ids):
+        sent.append((agent, ticket_ids))
+        redis_client.rpush('support:digest:10', 3)
+
+    monkeypatch.setattr(support, 'send_digest', send_digest)
+    support._flush_digests()
+    assert sent == [(10, [1, 2])]
+    assert redis_client.lrange('support:digest:10', 0, -1) == ['3']
+
+    # Оставшаяся заявка получает новый отсчет интервала и уходит следующим дайджестом
+    support._flush_digests()
+    support._flush_digests()
+    assert sent == [(10, [1, 2]), (10, [3])]
+
+
+def test_digest_marks_tickets_notified():
+    pool = FakePool(results=[[(1, 5, 'user', 'Вопрос', 'open', 10, None)]])
+    messages = []
+    support = desk(pool=pool, send=lambda chat_id, text, reply_markup=None: messages.append(text) or
+                   types.SimpleNamespace(message_id=77))
+    support.send_digest(10, [1])
+    assert '#1 @user: Вопрос' in messages[0]
+    assert any(sql.startswith('UPDATE support_tickets SET notified_at') for sql, _ in pool.queries)
+    assert pool.queries[-1][1] == (10, 77, 1)
+
+
+def test_recover_returns_unnotified_tickets_to_digest():
+    redis_client = FakeRedis()
+    redis_client.rpush('support:digest:10', 4)
+    pool = FakePool(results=[
+        [(4, 1000.0), (5, 2000.0)],
+        [(6,)],
+        [(10, 4), (10, 5), (20, 7)],
+    ])
+    desk(pool=pool, redis_client=redis_client).recover()
+    assert redis_client.lrange('support:queue', 0, -1) == ['6']
+    assert redis_client.lrange('support:digest:10', 0, -1) == ['4', '5']
+    assert redis_client.lrange('support:digest:20', 0, -1) == ['7']
+    assert redis_client.get('support:digest:20:since') is not None
+    assert redis_client.zcard('support:sla') == 2
+
+
+def test_handler_queries_use_connect():
+    handler_pool, background_pool = FakePool([[(7,)], [(7,)]]), FakePool()
+    support = desk(pool=background_pool, connect=handler_pool.connection)
+    assert support.create_ticket(1, 'ann', 'Вопрос') == 7
+    assert support.find_ticket(10, 5) == 7
+    assert len(handler_pool.queries) == 2
+    assert background_pool.queries == []
+
+
+TICKET = (1, 5, 'user', 'Вопрос', 'open', 10, None)
+
+
+def test_failed_send_releases_claim():
+    def send(chat_id, text, reply_markup=None):
+        raise RuntimeError('Telegram недоступен')
+
+    pool = FakePool(results=[[(1, 5, 'user', 'Вопрос', 'claimed', 10, 42)], []])
+    ticket, reason = desk(pool=pool, send=send).claim(1, 42, 10)
+    assert ticket is None and 'попробуйте еще раз' in reason
+    sql, params = pool.queries[-1]
+    assert sql.startswith('UPDATE support_tickets SET status = %s, claimed_by = NULL')
+    assert params == ('open', 1, 'claimed', 42)
+
+
+def test_sla_timer_survives_db_failure(monkeypatch):
+    redis_client = FakeRedis()
+    support = desk(redis_client=redis_client)
+    redis_client.zadd('support:sla', {1: time.time() - 1})
+
+    def fail():
+        raise RuntimeError('БД недоступна')
+
+    monkeypatch.setattr(support.pool, 'connection', fail)
+    with pytest.raises(RuntimeError):
+        support._check_sla()
+    assert redis_client.zcard('support:sla') == 1
+    assert redis_client.get('support:sla:1:lock') is None
+
+
+def test_reassigned_ticket_gets_new_deadline():
+    redis_client = FakeRedis()
+    pool = FakePool(results=[[TICKET], [(1,)], []])
+    messages = []
+    support = desk(pool=pool, redis_client=redis_client, strategy=ROUND_ROBIN,
+                   send=lambda chat_id, text, reply_markup=None: messages.append(text))
+    redis_client.zadd('support:sla', {1: time.time() - 1})
+    support._check_sla()
+    assert redis_client.zrangebyscore('support:sla', time.time(), '+inf') == ['1']
+    assert pool.queries[-1][1] == (float(support.sla_seconds), 1)
+    assert 'Переназначена агенту' in messages[0]
+
+
+def test_breached_claimed_ticket_drops_timer():
+    redis_client = FakeRedis()
+    pool = FakePool(results=[[(1, 5, 'user', 'Вопрос', 'claimed', 10, 42)]])
+    support = desk(pool=pool, redis_client=redis_client, send=lambda chat_id, text, reply_markup=None: None)
+    redis_client.zadd('support:sla', {1: time.time() - 1})
+    support._check_sla()
+    assert redis_client.zcard('support:sla') == 0
@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from webhook import SECRET_HEADER, UpdateWorkerPool, WebhookServer
+
+
+def test_pool_rejects_when_queue_is_full_and_drains_accepted():
+    release = threading.Event()
+    seen = []
+    pool = UpdateWorkerPool(lambda update: release.wait(5) and seen.append(update), workers=1, queue_size=1)
+    assert not pool.submit(0)
+    pool.start()
+    assert pool.submit(1)
+    # Единственный поток занят или очередь заполнена: один из двух апдейтов не поместится
+    results = [pool.submit(2), pool.submit(3)]
+    assert False in results
+    release.set()
+    pool.drain(timeout=5)
+    stats = pool.stats()
+    assert stats['accepted'] == 1 + results.count(True)
+    assert stats['rejected'] == results.count(False)
+    assert seen[0] == 1 and len(seen) == stats['processed']
+    assert not pool.submit(4)
+
+
+def test_pool_counts_failed_updates():
+    pool = UpdateWorkerPool(lambda update: 1 / 0, workers=2)
+    pool.start()
+    pool.submit({'update_id': 1})
+    pool.drain(timeout=5)
+    assert pool.stats()['failed'] == 1
+
+
+
+def test_drain_respects_timeout_when_queue_is_full():
+    release = threading.Event()
+    started = threading.Event()
+    pool = UpdateWorkerPool(lambda update: started.set() or release.wait(5), workers=1, queue_size=1)
+    pool.start()
+    pool.submit(1)
+    assert started.wait(5)
+    assert pool.submit(2)
+    began = time.monotonic()
+    pool.drain(timeout=0.2)
+    assert time.monotonic() - began < 2
+    release.set()
+
+
+@pytest.fixture
+def server():
+    received = []
+
+    class Pool:
+        accept = True
+
+        def submit(self, update):
+            received.append(update)
+            return self.accept
+
+        def stats(self):
+            return {'queue_depth': 0}
+
+    webhook = WebhookServer(Pool(), host='127.0.0.1', port=0, secret_token='s3', parse=json.loads)
+    thread = threading.Thread(target=webhook.serve_forever, daemon=True)
+    thread.start()
+    webhook.received = received
+    yield webhook
+    webhook.httpd.shutdown()
+    webhook.close()
+
+
+def post(server, path='/webhook', body=b'{"update_id": 1}', secret='s3'):
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{server.httpd.server_address[1]}{path}', data=body,
+        headers={SECRET_HEADER: secret} if secret else {}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_webhook_checks_path_secret_and_body(server):
+    assert post(server) == 200
+    assert server.received == [{'update_id': 1}]
+    assert post(server, path='/other') == 404
+    assert post(server, secret='wrong') == 403
+    assert post(server, body=b'not json') == 400
+
+
+def test_webhook_asks_telegram_to_retry_when_pool_is_full(server):
+    server.pool.accept = False
+    assert post(server) == 503
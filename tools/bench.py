@@ -0,0 +1,320 @@
+"""Микробенчмарки доступа к данным и сборки карточек
+
+Бенчмарки работают на отдельной базе (BENCH_DB_NAME, по умолчанию
+education_bot_bench) с детерминированным набором данных: схема и курсы из
+init_db.sql плюс синтетические курсы, пользователи и оценки до заданного объема.
+Замеряются функции бота как есть (bot.py импортируется с сессиями в памяти).
+
+Примеры:
+    python tools/bench.py seed --courses 100000 --ratings 1000000
+    python tools/bench.py run --json before.json
+    python tools/bench.py compare before.json after.json --threshold 10
+"""
+import os
+import io
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import itertools
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DIRECTIONS = ('finance', 'management', 'pedagogy')
+ROLES = ('ППС', 'АУП', 'Руководство', 'Студент')
+# Категория курса по направлению (course_categories из init_db.sql)
+DIRECTION_CATEGORY = {'finance': 1, 'management': 2, 'pedagogy': 3}
+WORDS = (
+    'финансы', 'управление', 'педагогика', 'бюджет', 'методика', 'проект', 'анализ', 'цифровой',
+    'лидерство', 'оценка', 'наука', 'грант', 'студент', 'практикум', 'стратегия', 'качество'
+)
+
+
+def bench_env():
+    """Переменные окружения для бенчмарка: отдельная база и сессии в памяти"""
+    env = {
+        'DB_NAME': os.getenv('BENCH_DB_NAME', 'education_bot_bench'),
+        'SESSION_BACKEND': 'memory',
+        'TELEGRAM_TOKEN': os.getenv('TELEGRAM_TOKEN', '1:bench'),
+        'SUPPORT_CHAT_ID': os.getenv('SUPPORT_CHAT_ID', '1'),
+        'METRICS_PORT': '0'
+    }
+    os.environ.update(env)
+    return env
+
+
+def connect(dbname):
+    import psycopg2
+    return psycopg2.connect(
+        dbname=dbname,
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        host=os.getenv('DB_HOST')
+    )
+
+
+def copy_rows(cur, table, columns, rows):
+    """Загружает строки через COPY (в разы быстрее INSERT на миллионах строк)"""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join('\\N' if value is None else str(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def seed(args):
+    """Пересоздает базу бенчмарка и заполняет ее синтетическими данными"""
+    dbname = bench_env()['DB_NAME']
+    admin = connect(os.getenv('BENCH_ADMIN_DB', 'postgres'))
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{dbname}"')
+        cur.execute(f'CREATE DATABASE "{dbname}"')
+    admin.close()
+
+    rng = random.Random(args.seed)
+    conn = connect(dbname)
+    with conn, conn.cursor() as cur:
+        with open(os.path.join(ROOT, 'init_db.sql')) as f:
+            cur.execute(f.read())
+        cur.execute("SELECT count(*) FROM courses")
+        existing = cur.fetchone()[0]
+
+        started = time.monotonic()
+        courses = []
+        for i in range(max(args.courses - existing, 0)):
+            direction = rng.choice(DIRECTIONS)
+            title = ' '.join(rng.choice(WORDS) for _ in range(3)).capitalize() + f' {i}'
+            courses.append((
+                DIRECTION_CATEGORY[direction],
+                title,
+                ' '.join(rng.choice(WORDS) for _ in range(12)),
+                rng.randint(1, 16),
+                rng.randrange(5000, 40000, 500),
+                f'https://example.com/course/{i}',
+                rng.choice(('open', 'limited')),
+                direction,
+                rng.choice(ROLES)
+            ))
+        copy_rows(cur, 'courses', (
+            'category_id', 'title', 'description', 'duration', 'price', 'url', 'access', 'direction', 'role'
+        ), courses)
+
+        users = [(1000000 + i, f'user{i}', f'Пользователь {i}', rng.choice(ROLES)) for i in range(args.users)]
+        copy_rows(cur, 'users', ('telegram_id', 'username', 'full_name', 'position'), users)
+
+        cur.execute("SELECT title FROM courses")
+        titles = [row[0] for row in cur.fetchall()]
+        # Популярные курсы оценивают чаще: оценки распределены неравномерно
+        weights = [1 / (rank + 1) for rank in range(len(titles))]
+        targets = rng.choices(titles, weights=weights, k=args.ratings)
+        ratings = (
+            (users[rng.randrange(len(users))][0], 'course', target, rng.randint(1, 5))
+            for target in targets
+        )
+        copy_rows(cur, 'ratings', ('user_id', 'rating_type', 'target', 'rating'), ratings)
+        cur.execute("ANALYZE")
+    conn.close()
+    print(f"База {dbname}: {args.courses} курсов, {args.users} пользователей, {args.ratings} оценок "
+          f"за {time.monotonic() - started:.1f} с")
+
+
+def measure(fn, iterations, warmup, setup=None):
+    """Время одного вызова fn по iterations замерам (setup не входит в замер)"""
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+    timings = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'mean_ms': round(statistics.fmean(timings) * 1000, 4),
+        'median_ms': round(statistics.median(timings) * 1000, 4),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 4),
+        'min_ms': round(timings[0] * 1000, 4),
+        'ops_per_s': round(1 / statistics.fmean(timings), 1) if statistics.fmean(timings) else 0.0
+    }
+
+
+def cases(bot):
+    """Бенчмарки: имя -> (функция, подготовка перед каждым замером или None)"""
+    from recommendations import match_courses, ROLE_CATEGORIES
+
+    rng = random.Random(1)
+    invalidate = bot.catalog_cache.invalidate
+    answers = [
+        {question['key']: rng.choice(question['options']).replace(',', '') for question in bot.survey_questions}
+        for _ in range(100)
+    ]
+    answers_cycle = itertools.cycle(answers)
+    courses_by_role = {role: bot.get_courses_by_category(role) for role in ROLE_CATEGORIES.values()}
+    finance = bot.get_courses_by_category('finance')
+    card_course = finance[len(finance) // 2] if finance else None
+    new_users = itertools.count(5000000)
+    faq_questions = itertools.cycle([
+        'Как получить сертификат после курса?',
+        'сколько стоит обучение и можно ли оплатить частями',
+        'не могу зайти в личный кабинет',
+        'когда начинаются занятия по финансам',
+    ])
+
+    def flush_tracker():
+        bot.activity_tracker.flush()
+
+    def save_ratings_batch():
+        writer = bot.rating_writer
+        writer.start()
+        for i in range(100):
+            writer.submit(1000000 + i, 'course', card_course['title'] if card_course else 'bench', 1 + i % 5)
+        writer.stop()
+
+    return {
+        # Загрузка из БД (кэш каталога сброшен) и чтение из кэша
+        'get_courses_by_category.cold': (lambda: bot.get_courses_by_category('finance'), invalidate),
+        'get_courses_by_category.warm': (lambda: bot.get_courses_by_category('finance'), None),
+        'get_all_courses.cold': (bot.get_all_courses, invalidate),
+        'get_all_courses.warm': (bot.get_all_courses, None),
+        'filter_courses_by_direction': (lambda: bot.filter_courses_by_direction('Финансы'), None),
+        # Подбор курсов в process_survey_answer: индекс и полный перебор
+        'survey.recommend_index': (lambda: bot.recommendation_index.recommend(next(answers_cycle)), None),
+        'survey.match_courses': (lambda: match_courses(courses_by_role, next(answers_cycle)), None),
+        # Новый пользователь пишется сразу, повторный визит - в памяти до пакетной записи
+        'save_user.new': (lambda: bot.save_user(next(new_users), 'bench', 'Бенчмарк'), None),
+        'save_user.returning': (lambda: bot.save_user(1000000, 'user0', 'Пользователь 0'), None),
+        'save_user.flush': (flush_tracker, lambda: [
+            bot.save_user(1000000 + i, f'user{i}', f'Пользователь {i}') for i in range(100)
+        ]),
+        # Подсказки из FAQ перед отправкой вопроса в поддержку
+        'faq.match': (lambda: bot.get_faq_index().search(next(faq_questions)), None),
+        'save_rating.direct': (lambda: bot.save_rating(1000000, 'course', 'bench', 5), None),
+        'save_rating.batch_100': (save_ratings_batch, None),
+        'render_course_card': (
+            lambda: bot.render_course_card(card_course, 'finance', len(finance) // 2, len(finance)),
+            None
+        ) if card_course else None
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    bench_env()
+    sys.path.insert(0, ROOT)
+    import bot
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with bot.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT (SELECT count(*) FROM courses), (SELECT count(*) FROM ratings)")
+            courses, ratings = cur.fetchone()
+
+    selected = set(args.only.split(',')) if args.only else None
+    results = {}
+    for name, case in cases(bot).items():
+        if case is None or (selected and name not in selected and name.split('.')[0] not in selected):
+            continue
+        fn, setup = case
+        results[name] = measure(fn, args.iterations, args.warmup, setup)
+        print(f"{name:32} median {results[name]['median_ms']:>10.4f} ms   p95 {results[name]['p95_ms']:>10.4f} ms")
+    bot.activity_tracker.flush()
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'courses': courses,
+            'ratings': ratings,
+            'iterations': args.iterations
+        },
+        'results': results
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+def compare(args):
+    """Сравнивает два прогона; код возврата 1, если есть регрессии"""
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    for side in (before, after):
+        meta = side['meta']
+        print(f"{meta.get('revision')}: {meta['courses']} курсов, {meta['ratings']} оценок, {meta['date']}")
+    if (before['meta']['courses'], before['meta']['ratings']) != (after['meta']['courses'], after['meta']['ratings']):
+        print("Внимание: прогоны на разных объемах данных")
+
+    regressions = []
+    for name in sorted(set(before['results']) | set(after['results'])):
+        old, new = before['results'].get(name), after['results'].get(name)
+        if old is None or new is None:
+            print(f"{name:32} {('нет в первом' if old is None else 'нет во втором') + ' прогоне':>40}")
+            continue
+        delta = new['median_ms'] - old['median_ms']
+        if old['median_ms']:
+            change = delta / old['median_ms'] * 100
+        else:
+            # Медиана до изменения округлилась до нуля: любой рост - бесконечно большой в процентах
+            change = math.inf if delta > 0 else 0.0
+        # Изменения меньше min_delta_ms - шум таймера, даже если в процентах они большие
+        regressed = change > args.threshold and delta > args.min_delta_ms
+        if regressed:
+            regressions.append(name)
+        mark = 'РЕГРЕССИЯ' if regressed else ('лучше' if change < -args.threshold else '')
+        print(f"{name:32} {old['median_ms']:>10.4f} -> {new['median_ms']:>10.4f} ms  {change:+7.1f}%  {mark}")
+    if regressions:
+        print(f"Регрессии (медиана хуже более чем на {args.threshold}%): {', '.join(regressions)}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='пересоздать базу бенчмарка')
+    seed_parser.add_argument('--courses', type=int, default=40, help='всего курсов (от 40 из init_db.sql)')
+    seed_parser.add_argument('--users', type=int, default=10000)
+    seed_parser.add_argument('--ratings', type=int, default=10000)
+    seed_parser.add_argument('--seed', type=int, default=1)
+
+    run_parser = commands.add_parser('run', help='выполнить бенчмарки')
+    run_parser.add_argument('--iterations', type=int, default=200)
+    run_parser.add_argument('--warmup', type=int, default=10)
+    run_parser.add_argument('--only', help='бенчмарки или группы через запятую (например, survey,save_user.new)')
+    run_parser.add_argument('--json', help='сохранить результаты в файл')
+
+    compare_parser = commands.add_parser('compare', help='сравнить два прогона')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=10.0, help='допустимое ухудшение медианы, %%')
+    compare_parser.add_argument('--min-delta-ms', type=float, default=0.01)
+
+    args = parser.parse_args()
+    {'seed': seed, 'run': run, 'compare': compare}[args.command](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""Локальная имитация Telegram Bot API для проверки бота без Telegram
+
+Принимает вызовы вида /bot<token>/<method>, отвечает правдоподобными объектами
+и, как настоящий Telegram, возвращает 429 с retry_after при превышении лимитов
+(глобального и на чат). getUpdates отдает апдейты, поставленные через
+push_update() или POST /updates. Счетчики и время вызовов доступны по GET /stats.
+
+Пример:
+    python tools/fake_bot_api.py --port 8081 --latency 50
+    TELEGRAM_API_URL=http://localhost:8081 python bot.py
+"""
+import json
+import time
+import argparse
+import itertools
+import threading
+from collections import Counter, defaultdict, deque
+from urllib.parse import parse_qsl, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+
+# Вызовы, на которые действуют лимиты на отправку сообщений
+LIMITED = {
+    'sendmessage', 'sendphoto', 'senddocument', 'sendmediagroup', 'forwardmessage', 'copymessage',
+    'editmessagetext', 'editmessagereplymarkup', 'editmessagecaption', 'editmessagemedia'
+}
+
+
+class FakeTelegram:
+    """Состояние имитации: лимиты, счетчики, номера сообщений"""
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, group_per_minute=20, latency=0.0, limits=True):
+        self.limits = limits
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_per_minute = group_per_minute
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+        self._global = deque()
+        self._chats = defaultdict(deque)
+        self.calls = Counter()
+        self.limited = Counter()
+        self.max_global_rate = 0
+        self.started = time.monotonic()
+        # Метод -> [вызовов, суммарное время, максимальное время]
+        self.timing = defaultdict(lambda: [0, 0.0, 0.0])
+        # Очередь апдейтов для getUpdates
+        self._updates = deque()
+        self._update_ids = itertools.count(1)
+        self._updates_ready = threading.Condition()
+        # listener(method, params, result) вызывается после каждого успешного вызова
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+        return listener
+
+    def push_update(self, update):
+        """Ставит апдейт в очередь getUpdates; возвращает его update_id"""
+        with self._updates_ready:
+            update = dict(update, update_id=next(self._update_ids))
+            self._updates.append(update)
+            self._updates_ready.notify_all()
+        return update['update_id']
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + float(params.get('timeout') or 0)
+        with self._updates_ready:
+            # Апдейты до offset бот уже подтвердил
+            while self._updates and self._updates[0]['update_id'] < offset:
+                self._updates.popleft()
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_ready.wait(remaining)
+            return list(itertools.islice(self._updates, limit))
+
+    def _record(self, method, elapsed):
+        with self._lock:
+            timing = self.timing[method]
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+
+    def _check_limits(self, chat_id):
+        """Возвращает retry_after, если вызов нарушает лимиты, иначе None"""
+        now = time.monotonic()
+        with self._lock:
+            window = self._global
+            while window and now - window[0] >= 1:
+                window.popleft()
+            if len(window) >= self.global_rate:
+                return 1
+
+            chat_window = self._chats[chat_id]
+            group = str(chat_id).startswith('-')
+            period = 60 if group else 1
+            limit = self.group_per_minute if group else self.chat_rate
+            while chat_window and now - chat_window[0] >= period:
+                chat_window.popleft()
+            # Короткий всплеск в личном чате Telegram пропускает
+            if len(chat_window) >= limit + (0 if group else self.chat_burst - 1):
+                return max(1, int(period - (now - chat_window[0])) + 1)
+
+            window.append(now)
+            chat_window.append(now)
+            self.max_global_rate = max(self.max_global_rate, len(window))
+        return None
+
+    def handle(self, method, params):
+        method = method.lower()
+        if method == 'getupdates':
+            with self._lock:
+                self.calls[method] += 1
+            return 200, {'ok': True, 'result': self._get_updates(params)}
+
+        started = time.monotonic()
+        status, payload = self._handle(method, params)
+        self._record(method, time.monotonic() - started)
+        if status == 200:
+            for listener in self._listeners:
+                listener(method, params, payload['result'])
+        return status, payload
+
+    def _handle(self, method, params):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[method] += 1
+
+        chat_id = params.get('chat_id')
+        if self.limits and method in LIMITED and chat_id is not None:
+            retry_after = self._check_limits(chat_id)
+            if retry_after is not None:
+                with self._lock:
+                    self.limited[method] += 1
+                return 429, {
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f'Too Many Requests: retry after {retry_after}',
+                    'parameters': {'retry_after': retry_after}
+                }
+
+        if method == 'getme':
+            return 200, {'ok': True, 'result': BOT_USER}
+        if method in LIMITED:
+            try:
+                chat = {'id': int(chat_id), 'type': 'private'}
+            except (TypeError, ValueError):
+                chat = {'id': 0, 'type': 'private'}
+            message_id = params.get('message_id')
+            return 200, {'ok': True, 'result': {
+                'message_id': int(message_id) if message_id else next(self._message_ids),
+                'from': BOT_USER,
+                'chat': chat,
+                'date': int(time.time()),
+                'text': params.get('text', '')
+            }}
+        return 200, {'ok': True, 'result': True}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'uptime_s': round(time.monotonic() - self.started, 1),
+                'calls': dict(self.calls),
+                'rate_limited': dict(self.limited),
+                'max_global_rate': self.max_global_rate,
+                'timing_ms': {
+                    method: {
+                        'avg': round(total / count * 1000, 2),
+                        'max': round(longest * 1000, 2)
+                    }
+                    for method, (count, total, longest) in self.timing.items()
+                },
+                'pending_updates': len(self._updates)
+            }
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        def _params(self):
+            url = urlparse(self.path)
+            params = dict(parse_qsl(url.query))
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                body = self.rfile.read(length)
+                content_type = self.headers.get('Content-Type', '')
+                if 'json' in content_type:
+                    params.update(json.loads(body or b'{}'))
+                elif 'multipart' not in content_type:
+                    params.update(parse_qsl(body.decode()))
+            return url.path, params
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _dispatch(self):
+            path, params = self._params()
+            if path == '/stats':
+                self._reply(200, fake.stats())
+                return
+            if path == '/updates' and self.command == 'POST':
+                self._reply(200, {'ok': True, 'update_id': fake.push_update(params)})
+                return
+            parts = path.strip('/').split('/')
+            if len(parts) != 2 or not parts[0].startswith('bot'):
+                self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+                return
+            self._reply(*fake.handle(parts[1], params))
+
+        do_GET = _dispatch
+        do_POST = _dispatch
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0, help='задержка ответа, мс')
+    parser.add_argument('--global-rate', type=int, default=30, help='сообщений в секунду на бота')
+    parser.add_argument('--chat-rate', type=int, default=1, help='сообщений в секунду на личный чат')
+    parser.add_argument('--no-limits', action='store_true', help='не возвращать 429')
+    args = parser.parse_args()
+
+    fake = FakeTelegram(
+        global_rate=args.global_rate,
+        chat_rate=args.chat_rate,
+        latency=args.latency / 1000,
+        limits=not args.no_limits
+    )
+    server = _HTTPServer((args.host, args.port), make_handler(fake))
+    print(f"Имитация Bot API слушает http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(fake.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Имитация Telegram: отправляет синтетические апдейты на вебхук бота
+
+Пример:
+    python tools/fake_webhook_client.py --url http://localhost:8443/webhook --users 50 --updates 2000
+"""
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Нажатия, которые встречаются при обычной работе с ботом
+CALLBACKS = [
+    'main_menu', 'catalog', 'direction', 'post', 'availability',
+    'finance', 'management', 'pedagogy', 'pps', 'students', 'open',
+    'course_next_finance_0', 'course_prev_finance_1', 'questions', 'feedback'
+]
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1000)
+
+
+def make_message(user_id, text):
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+    return {
+        'update_id': next(_update_ids),
+        'message': {
+            'message_id': next(_message_ids),
+            'from': user,
+            'chat': {'id': user_id, 'type': 'private'},
+            'date': int(time.time()),
+            'text': text
+        }
+    }
+
+
+def make_callback(user_id, data):
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+    return {
+        'update_id': next(_update_ids),
+        'callback_query': {
+            'id': str(next(_update_ids)),
+            'from': user,
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': 1,
+                'chat': {'id': user_id, 'type': 'private'},
+                'date': int(time.time()),
+                'text': 'menu'
+            }
+        }
+    }
+
+
+def random_update(user_id):
+    if random.random() < 0.1:
+        return make_message(user_id, 'Привет')
+    return make_callback(user_id, random.choice(CALLBACKS))
+
+
+def post(url, secret, update):
+    request = urllib.request.Request(url, data=json.dumps(update).encode('utf-8'), method='POST')
+    request.add_header('Content-Type', 'application/json')
+    if secret:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', secret)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 'error'
+    return status, time.perf_counter() - started
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8443/webhook')
+    parser.add_argument('--secret', default=None, help='значение WEBHOOK_SECRET бота')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--updates', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    statuses = {}
+    latencies = []
+    lock = threading.Lock()
+
+    def send(_):
+        status, elapsed = post(args.url, args.secret, random_update(random.randint(1, args.users)))
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(send, range(args.updates)))
+    elapsed = time.perf_counter() - started
+
+    print(f"Отправлено апдейтов: {args.updates} за {elapsed:.2f} с ({args.updates / elapsed:.1f} апд/с)")
+    print(f"Ответы вебхука: {statuses}")
+    print("Время ответа, мс: p50={:.1f} p95={:.1f} p99={:.1f}".format(
+        percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000, percentile(latencies, 99) * 1000
+    ))
+
+
+if __name__ == '__main__':
+    main()
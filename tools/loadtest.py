@@ -0,0 +1,373 @@
+"""Нагрузочный тест бота на имитации Bot API
+
+Поднимает tools/fake_bot_api.py в этом же процессе, запускает бота с
+TELEGRAM_API_URL на имитацию (или подключается к уже запущенному, --no-spawn)
+и ведет тысячи синтетических пользователей по типичным сценариям. Пользователь
+нажимает кнопки из клавиатур, которые прислал бот, поэтому сценарии проходят
+по настоящим меню. Шаг завершается, когда бот прислал сообщение с клавиатурой.
+
+По каждому сценарию печатаются апдейты в секунду, задержка ответа p50/p95/p99
+и число запросов к БД (из метрик бота, GET /metrics).
+
+Пример (PostgreSQL и Redis из docker-compose.loadtest.yml):
+    docker compose -f docker-compose.yml -f docker-compose.loadtest.yml up -d postgres redis
+    DB_HOST=localhost REDIS_HOST=localhost python tools/loadtest.py --users 2000 --course-next 5
+"""
+import os
+import re
+import sys
+import json
+import time
+import heapq
+import random
+import signal
+import argparse
+import itertools
+import threading
+import subprocess
+import urllib.request
+from collections import Counter
+
+from fake_bot_api import FakeTelegram, make_handler, _HTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Синтетические пользователи получают id из отдельного диапазона
+USER_ID_BASE = 7_000_000_000
+
+DIRECTIONS = ('finance', 'management', 'pedagogy')
+
+
+# --- Сценарии: генератор отдает действие и получает callback_data кнопок из ответа бота ---
+
+def text(value):
+    return ('text', value)
+
+
+def click(data):
+    return ('click', data)
+
+
+def catalog_scenario(rng, course_next=5):
+    """Главное меню -> каталог -> направление -> листание курсов"""
+    yield text('Привет')
+    yield click('catalog')
+    yield click('direction')
+    buttons = yield click(rng.choice(DIRECTIONS))
+    for _ in range(course_next):
+        # Кнопка "вперед" в формате callback_codec: <версия>cn_<категория>_<позиция>_<id курса>
+        next_buttons = [data for data in buttons if re.match(r'\d+cn_', data)]
+        if not next_buttons:
+            return
+        buttons = yield click(next_buttons[0])
+
+
+def survey_scenario(rng, **_):
+    """Полный опрос подбора курса со случайными ответами"""
+    yield text('Привет')
+    buttons = yield click('courses')
+    answered = ''
+    while True:
+        # <версия>s_<ответы>: вариант ответа несет на один ответ больше, чем уже дано
+        # ("Назад" и "Назад к опросу" - меньше, поэтому опрос не зацикливается)
+        options = [data for data in buttons if re.match(r'\d+s_', data) and len(data) > len(answered)]
+        if not options:
+            return
+        answered = rng.choice(options)
+        buttons = yield click(answered)
+
+
+def rating_scenario(rng, **_):
+    """Обратная связь -> оценка случайного курса"""
+    yield text('Привет')
+    yield click('feedback')
+    yield click('rate')
+    buttons = yield click('rate_course')
+    courses = [data for data in buttons if data.startswith('select_course_')]
+    if not courses:
+        return
+    buttons = yield click(rng.choice(courses))
+    stars = [data for data in buttons if data.startswith('rating_course_')]
+    if stars:
+        yield click(rng.choice(stars))
+
+
+SCENARIOS = {
+    'catalog': catalog_scenario,
+    'survey': survey_scenario,
+    'rating': rating_scenario,
+}
+
+
+def markup_buttons(params):
+    """callback_data всех кнопок из reply_markup вызова Bot API (None - клавиатуры нет)"""
+    markup = params.get('reply_markup')
+    if not markup:
+        return None
+    if isinstance(markup, str):
+        markup = json.loads(markup)
+    rows = markup.get('inline_keyboard')
+    if rows is None:
+        return None
+    return [button['callback_data'] for row in rows for button in row if 'callback_data' in button]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class _User:
+    __slots__ = ('chat_id', 'steps', 'message_id', 'sent_at', 'waiting', 'timer')
+
+    def __init__(self, chat_id, steps):
+        self.chat_id = chat_id
+        self.steps = steps
+        self.message_id = None
+        self.sent_at = None
+        self.waiting = False
+        self.timer = None
+
+
+class LoadDriver:
+    """Ведет пользователей по сценарию: следующий шаг - после ответа бота на предыдущий"""
+
+    def __init__(self, fake, think_time=1.0, step_timeout=15.0, seed=1):
+        self.fake = fake
+        self.think_time = think_time
+        self.step_timeout = step_timeout
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._users = {}
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        # Отложенные действия: (время, порядковый номер, функция)
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._wakeup = threading.Condition(self._lock)
+        self._done = threading.Event()
+        self._stopped = False
+        self.latencies = []
+        self.updates = 0
+        self.timeouts = 0
+        self.finished = 0
+        fake.add_listener(self._on_call)
+        threading.Thread(target=self._run_timers, name='loadtest-timers', daemon=True).start()
+
+    # --- Планировщик ---
+
+    def _schedule(self, delay, action):
+        # Вызывается под self._lock
+        heapq.heappush(self._timers, (time.monotonic() + delay, next(self._timer_seq), action))
+        self._wakeup.notify()
+
+    def _run_timers(self):
+        with self._lock:
+            while not self._stopped:
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    _, _, action = heapq.heappop(self._timers)
+                    action()
+                self._wakeup.wait(self._timers[0][0] - now if self._timers else None)
+
+    # --- Пользователи ---
+
+    def run(self, scenario, users, ramp_up=0.0, **options):
+        """Запускает users пользователей сценария и ждет, пока все закончат"""
+        self._done.clear()
+        with self._lock:
+            self.latencies, self.updates, self.timeouts, self.finished = [], 0, 0, 0
+            self._users = {}
+            for i in range(users):
+                chat_id = USER_ID_BASE + i
+                steps = SCENARIOS[scenario](random.Random(self.rng.random()), **options)
+                user = self._users[chat_id] = _User(chat_id, steps)
+                self._schedule(ramp_up * i / users, lambda user=user: self._advance(user, None))
+        started = time.monotonic()
+        self._done.wait()
+        return time.monotonic() - started
+
+    def _advance(self, user, buttons):
+        # Вызывается под self._lock
+        try:
+            action = user.steps.send(buttons) if user.sent_at is not None else next(user.steps)
+        except StopIteration:
+            self._finish(user)
+            return
+        kind, value = action
+        update = self._update(user, kind, value)
+        user.sent_at = time.monotonic()
+        user.waiting = True
+        self.updates += 1
+        user.timer = next(self._timer_seq)
+        timer = user.timer
+        self._schedule(self.step_timeout, lambda: self._timeout(user, timer))
+        self.fake.push_update(update)
+
+    def _update(self, user, kind, value):
+        person = {'id': user.chat_id, 'is_bot': False, 'first_name': 'Load', 'username': f'load{user.chat_id}'}
+        chat = {'id': user.chat_id, 'type': 'private', 'first_name': 'Load'}
+        if kind == 'text':
+            return {'message': {
+                'message_id': next(self._message_ids), 'date': int(time.time()),
+                'chat': chat, 'from': person, 'text': value
+            }}
+        return {'callback_query': {
+            'id': str(next(self._update_ids)), 'from': person, 'chat_instance': str(user.chat_id), 'data': value,
+            'message': {
+                'message_id': user.message_id or 0, 'date': int(time.time()),
+                'chat': chat, 'from': {'id': 1, 'is_bot': True, 'first_name': 'FakeBot'}, 'text': ''
+            }
+        }}
+
+    def _timeout(self, user, timer):
+        if user.waiting and user.timer == timer:
+            self.timeouts += 1
+            user.waiting = False
+            self._finish(user)
+
+    def _finish(self, user):
+        if self._users.pop(user.chat_id, None) is not None:
+            self.finished += 1
+            if not self._users:
+                self._done.set()
+
+    def _on_call(self, method, params, result):
+        if method not in ('sendmessage', 'editmessagetext', 'editmessagereplymarkup'):
+            return
+        buttons = markup_buttons(params)
+        if buttons is None:
+            return
+        try:
+            chat_id = int(params.get('chat_id'))
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            user = self._users.get(chat_id)
+            if user is None or not user.waiting:
+                return
+            user.waiting = False
+            self.latencies.append(time.monotonic() - user.sent_at)
+            if isinstance(result, dict):
+                user.message_id = result.get('message_id')
+            think = self.think_time * (0.5 + self.rng.random()) if self.think_time else 0
+            self._schedule(think, lambda: self._advance(user, buttons))
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._wakeup.notify()
+
+
+def scrape_db_queries(url):
+    """Число запросов к БД по типам из метрик бота; None, если метрики недоступны"""
+    try:
+        body = urllib.request.urlopen(url, timeout=5).read().decode()
+    except Exception:
+        return None
+    counts = Counter()
+    for line in body.splitlines():
+        match = re.match(r'educationbot_db_query_duration_seconds_count\{operation="(\w+)"\} (\S+)', line)
+        if match:
+            counts[match.group(1)] = int(float(match.group(2)))
+    return counts
+
+
+def wait_for_bot(fake, timeout=60.0):
+    """Ждет первого getUpdates: бот запустился и опрашивает апдейты"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if fake.stats()['calls'].get('getupdates'):
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='сценарии через запятую')
+    parser.add_argument('--users', type=int, default=1000, help='пользователей на сценарий')
+    parser.add_argument('--course-next', type=int, default=5, help='сколько раз листать курсы в сценарии catalog')
+    parser.add_argument('--think', type=float, default=1.0, help='среднее время на раздумье между шагами, с')
+    parser.add_argument('--ramp-up', type=float, default=10.0, help='за сколько секунд подключаются все пользователи')
+    parser.add_argument('--step-timeout', type=float, default=15.0, help='сколько ждать ответа бота на шаг, с')
+    parser.add_argument('--latency', type=float, default=0, help='задержка ответа имитации Bot API, мс')
+    parser.add_argument('--unlimited', action='store_true',
+                        help='без лимитов Telegram: имитация не отвечает 429, бот запускается с OUTBOUND_LIMITS=0')
+    parser.add_argument('--port', type=int, default=8081, help='порт имитации Bot API')
+    parser.add_argument('--metrics-url', default='http://127.0.0.1:8000/metrics')
+    parser.add_argument('--no-spawn', action='store_true', help='бот уже запущен с TELEGRAM_API_URL на имитацию')
+    parser.add_argument('--json', help='сохранить результаты в файл')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    fake = FakeTelegram(latency=args.latency / 1000, limits=not args.unlimited)
+    server = _HTTPServer(('127.0.0.1', args.port), make_handler(fake))
+    threading.Thread(target=server.serve_forever, name='fake-bot-api', daemon=True).start()
+    driver = LoadDriver(fake, think_time=args.think, step_timeout=args.step_timeout, seed=args.seed)
+
+    bot_process = None
+    if not args.no_spawn:
+        env = dict(os.environ, TELEGRAM_API_URL=f'http://127.0.0.1:{args.port}', BOT_MODE='polling')
+        env.setdefault('TELEGRAM_TOKEN', '1:loadtest')
+        env.setdefault('METRICS_PORT', args.metrics_url.rsplit(':', 1)[1].split('/')[0])
+        if args.unlimited:
+            env['OUTBOUND_LIMITS'] = '0'
+        bot_process = subprocess.Popen([sys.executable, 'bot.py'], cwd=ROOT, env=env)
+    if not wait_for_bot(fake):
+        print("Бот не начал опрашивать апдейты", file=sys.stderr)
+        sys.exit(1)
+
+    results = {}
+    try:
+        for scenario in args.scenarios.split(','):
+            db_before = scrape_db_queries(args.metrics_url)
+            calls_before = Counter(fake.stats()['calls'])
+            elapsed = driver.run(scenario, args.users, ramp_up=args.ramp_up, course_next=args.course_next)
+            db_after = scrape_db_queries(args.metrics_url)
+            calls = Counter(fake.stats()['calls'])
+            calls.subtract(calls_before)
+            calls.pop('getupdates', None)
+
+            latencies = driver.latencies
+            db_queries = None
+            if db_before is not None and db_after is not None:
+                db_after.subtract(db_before)
+                db_queries = dict(db_after, total=sum(db_after.values()))
+            results[scenario] = {
+                'users': args.users,
+                'updates': driver.updates,
+                'timeouts': driver.timeouts,
+                'duration_s': round(elapsed, 2),
+                # Апдейты ограничены временем на раздумье: с --think 0 это пропускная способность бота
+                'updates_per_s': round(driver.updates / elapsed, 1) if elapsed else 0.0,
+                'latency_ms': {
+                    f'p{q}': round(percentile(latencies, q) * 1000, 1) for q in (50, 95, 99)
+                },
+                'db_queries': db_queries,
+                'db_queries_per_update': round(db_queries['total'] / driver.updates, 2)
+                if db_queries and driver.updates else None,
+                'bot_api_calls': {method: count for method, count in calls.items() if count}
+            }
+            print(f"{scenario}: {json.dumps(results[scenario], ensure_ascii=False)}")
+    finally:
+        driver.stop()
+        if bot_process is not None:
+            bot_process.send_signal(signal.SIGINT)
+            try:
+                bot_process.wait(30)
+            except subprocess.TimeoutExpired:
+                bot_process.kill()
+        server.shutdown()
+
+    report = {'scenarios': results, 'bot_api': fake.stats()}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report['bot_api']['timing_ms'], ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
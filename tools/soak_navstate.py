@@ -0,0 +1,179 @@
+"""Длительный прогон состояния навигации: память не должна расти
+
+Имитирует обработку апдейтов большого числа разных пользователей (по умолчанию
+миллион сессий) так же, как бот: единица работы сессий, позиция листания каталога
+и id сообщения меню. Опрос и рекомендации, как и в боте, хранят состояние только
+в callback_data кнопок (CallbackCodec), поэтому в сессии от них ничего не остается. Сессии хранятся в памяти с ограничением
+SESSION_MAX_ENTRIES, поэтому после заполнения емкости память процесса должна
+оставаться на одном уровне. Каждые --every сессий выводятся число живых объектов
+Python (sys.getallocatedblocks) и резидентная память (RSS). Если после прогрева
+объектов стало больше чем на --tolerance процентов или RSS выросла больше чем на
+--rss-tolerance процентов, скрипт завершается с кодом 1. Допуск по RSS шире:
+распределитель памяти не сразу отдает освободившиеся страницы системе.
+
+--legacy хранит рекомендации по-старому (список карточек курсов и ответы опроса
+в каждой сессии) и без ограничения емкости - для сравнения.
+
+Примеры:
+    python tools/soak_navstate.py
+    python tools/soak_navstate.py --sessions 200000 --capacity 20000 --ttl 5
+    python tools/soak_navstate.py --legacy --sessions 200000
+"""
+import os
+import sys
+import gc
+import time
+import random
+import argparse
+import resource
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from session import MemorySessionStore
+from navstate import NavState, NavigationStore
+from callback_codec import CallbackCodec, Choice, Digits, Int
+
+# Вопросы и варианты ответов опроса (как survey_questions в bot.py)
+SURVEY = [
+    ('role', ['Студент', 'АУП', 'Руководство', 'ППС']),
+    ('direction', ['Финансы', 'Управление', 'Педагогика']),
+    ('time', ['1-4 недели', '5-8 недель', 'Более 8 недель']),
+    ('budget', ['До 10 000 руб.', '10-20 000 руб.', 'Более 20 000 руб.']),
+]
+FILTERS = ('finance', 'management', 'pedagogy', 'pps', 'aup', 'students', 'open', 'limited')
+
+# Маршруты кнопок, как в bot.py
+codec = CallbackCodec(version=1)
+codec.register('course_next', 'cn', filter=Choice(FILTERS), position=Int(), course_id=Int())
+codec.register('survey', 's', answers=Digits())
+codec.register('recommended', 'r', answers=Digits(), position=Int())
+
+
+def rss_bytes():
+    """Текущая резидентная память процесса (или пиковая, если /proc недоступен)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def fake_courses(rng, count):
+    """Карточки курсов, как их возвращал подбор рекомендаций (для --legacy)"""
+    return [
+        {
+            'course_id': rng.randrange(1, 10 ** 6),
+            'title': f"Курс {rng.randrange(10 ** 6)}",
+            'description': 'Описание курса ' * 8,
+            'week': '2 недели',
+            'price': rng.randrange(0, 30000),
+            'access': 'open',
+            'url': 'https://example.com/course',
+        }
+        for _ in range(count)
+    ]
+
+
+def simulate(args):
+    rng = random.Random(args.seed)
+    store = MemorySessionStore(
+        ttl=args.ttl, max_entries=None if args.legacy else args.capacity, sweep_interval=min(60.0, args.ttl)
+    )
+    menu_messages = store.namespace('menu_message')
+    regular = NavigationStore(store.namespace('course_position'), args.nav_ttl)
+    legacy_recommended = store.namespace('recommended_position')
+    # Байты callback_data созданных кнопок: состояние, которое теперь живет в кнопках, а не в сессиях
+    callback_bytes = 0
+
+    baseline = None
+    checkpoints = []
+    started = time.monotonic()
+    for user_id in range(1, args.sessions + 1):
+        with store.unit_of_work():
+            store.prefetch(('session', user_id))
+            message_id = rng.randrange(1, 10 ** 6)
+            menu_messages[user_id] = message_id
+            state = NavState(rng.choice(FILTERS), rng.randrange(40), rng.randrange(1, 10 ** 5), message_id)
+            regular.set(user_id, state)
+            callback_bytes += len(codec.encode('course_next', filter=state.key, position=state.position + 1,
+                                        course_id=state.course_id))
+            if rng.random() < args.survey_share:
+                indices = [rng.randrange(len(options)) for _, options in SURVEY]
+                if args.legacy:
+                    legacy_recommended[user_id] = {
+                        'courses': fake_courses(rng, args.courses),
+                        'position': 0,
+                        'saved_answers': {key: options[i] for (key, options), i in zip(SURVEY, indices)},
+                        'saved_question': len(SURVEY) - 1
+                    }
+                else:
+                    # Ответы опроса уходят в кнопки и на сервере не хранятся
+                    for answered in range(len(SURVEY)):
+                        callback_bytes += len(codec.encode('survey', answers=indices[:answered]))
+                    callback_bytes += len(codec.encode('recommended', answers=indices, position=1))
+            # Часть пользователей возвращается и листает дальше
+            if user_id > 1 and rng.random() < args.revisit_share:
+                other = rng.randrange(max(1, user_id - 1000), user_id)
+                state = regular.get(other)
+                if state is not None:
+                    state.position += 1
+                    regular.set(other, state)
+
+        if user_id % args.every == 0:
+            gc.collect()
+            blocks = sys.getallocatedblocks()
+            rss = rss_bytes()
+            stats = store.stats()
+            if baseline is None and user_id >= args.warmup:
+                baseline = (blocks, rss)
+            checkpoints.append((user_id, blocks, rss))
+            print(f"{user_id:>10} сессий  объектов {blocks:>10}  RSS {rss / 2 ** 20:8.1f} МБ  "
+                  f"в памяти {stats['entries']:>9}  "
+                  f"вытеснено {stats['evicted']:>9}  истекло {stats['expired']:>9}  "
+                  f"{time.monotonic() - started:6.1f} с", flush=True)
+    return baseline, checkpoints, callback_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=1000000)
+    parser.add_argument('--capacity', type=int, default=int(os.getenv('SESSION_MAX_ENTRIES', 100000)))
+    parser.add_argument('--ttl', type=float, default=7 * 24 * 3600, help='TTL сессии, с')
+    parser.add_argument('--nav-ttl', type=float, default=24 * 3600, help='TTL позиции листания, с')
+    parser.add_argument('--survey-share', type=float, default=0.3, help='доля пользователей, прошедших опрос')
+    parser.add_argument('--revisit-share', type=float, default=0.2, help='доля апдейтов от вернувшихся пользователей')
+    parser.add_argument('--courses', type=int, default=12, help='курсов в наборе рекомендаций (--legacy)')
+    parser.add_argument('--every', type=int, default=50000, help='как часто замерять память')
+    parser.add_argument('--warmup', type=int, default=None, help='сессий до базового замера (по умолчанию 2 x емкость)')
+    parser.add_argument('--tolerance', type=float, default=5.0, help='допустимый рост числа объектов после прогрева, %%')
+    parser.add_argument('--rss-tolerance', type=float, default=25.0, help='допустимый рост RSS после прогрева, %%')
+    parser.add_argument('--legacy', action='store_true', help='старый формат рекомендаций без ограничения емкости')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if args.warmup is None:
+        args.warmup = min(args.sessions, 2 * args.capacity)
+
+    baseline, checkpoints, callback_bytes = simulate(args)
+    if baseline is None or not checkpoints:
+        print("Слишком короткий прогон: нет замера после прогрева")
+        return 1
+    _, final_blocks, final_rss = checkpoints[-1]
+    blocks_growth = (final_blocks - baseline[0]) / baseline[0] * 100
+    rss_growth = (final_rss - baseline[1]) / baseline[1] * 100
+    peak = max(rss for _, _, rss in checkpoints)
+    print(f"\nПосле прогрева: объектов {baseline[0]}, RSS {baseline[1] / 2 ** 20:.1f} МБ")
+    print(f"В конце: объектов {final_blocks} ({blocks_growth:+.1f}%), "
+          f"RSS {final_rss / 2 ** 20:.1f} МБ ({rss_growth:+.1f}%), пик RSS {peak / 2 ** 20:.1f} МБ")
+    if not args.legacy:
+        print(f"callback_data на сессию: {callback_bytes / args.sessions:.0f} байт (в кнопках, не в памяти бота)")
+    if blocks_growth > args.tolerance or rss_growth > args.rss_tolerance:
+        print("Память растет")
+        return 1
+    print("Память стабильна")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+import json
+import time
+import queue
+import signal
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передает secret_token из setWebhook
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class UpdateWorkerPool:
+    """Ограниченный пул потоков, обрабатывающих апдейты из очереди"""
+
+    def __init__(self, process, workers=8, queue_size=1000):
+        self.process = process
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._accepting = False
+        self._lock = threading.Lock()
+
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def start(self):
+        self._accepting = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'update-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, update):
+        """Ставит апдейт в очередь; False, если очередь переполнена"""
+        if not self._accepting:
+            return False
+        try:
+            self._queue.put_nowait((update, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.accepted += 1
+        return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            update, queued_at = item
+            waited = time.monotonic() - queued_at
+            with self._lock:
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            try:
+                self.process(update)
+                with self._lock:
+                    self.processed += 1
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logger.error(f"Ошибка обработки апдейта: {e}")
+            finally:
+                self._queue.task_done()
+
+    def drain(self, timeout=30.0):
+        """Перестает принимать апдейты и дожидается обработки очереди"""
+        self._accepting = False
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            # Маркеры остановки встают в конец очереди, после уже принятых апдейтов.
+            # Полная очередь ждет не дольше общего срока: зависший обработчик не держит остановку
+            try:
+                self._queue.put(None, timeout=max(deadline - time.monotonic(), 0))
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        left = self._queue.qsize()
+        if left:
+            logger.warning(f"Не обработано апдейтов при остановке: {left}")
+        self._threads = []
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self._queue.qsize(),
+                'queue_size': self._queue.maxsize,
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'processed': self.processed,
+                'failed': self.failed,
+                'queue_wait_avg_ms': self._wait_total / (self.processed + self.failed) * 1000
+                if self.processed + self.failed else 0.0,
+                'queue_wait_max_ms': self._wait_max * 1000
+            }
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Telegram открывает до max_connections соединений одновременно
+    request_queue_size = 128
+
+
+class WebhookServer:
+    """HTTP-сервер для вебхука Telegram: принимает апдейт, сразу отвечает и отдает его в пул"""
+
+    def __init__(self, pool, host='0.0.0.0', port=8443, path='/webhook', secret_token=None,
+                 parse=types.Update.de_json):
+        self.pool = pool
+        # Диспетчеру шардов нужен апдейт словарем из Bot API, пулу потоков - объект Update
+        self.parse = parse
+        self.path = path
+        self.secret_token = secret_token
+        self.httpd = _HTTPServer((host, port), self._make_handler())
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    return self._reply(404)
+                if server.secret_token and self.headers.get(SECRET_HEADER) != server.secret_token:
+                    return self._reply(403)
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    update = server.parse(self.rfile.read(length).decode('utf-8'))
+                except Exception as e:
+                    logger.error(f"Некорректный апдейт от Telegram: {e}")
+                    return self._reply(400)
+                if not server.pool.submit(update):
+                    # Telegram повторит доставку позже - так работает обратное давление
+                    return self._reply(503, headers={'Retry-After': '1'})
+                self._reply(200)
+
+            def do_GET(self):
+                if self.path != '/healthz':
+                    return self._reply(404)
+                self._reply(200, json.dumps(server.pool.stats()).encode('utf-8'), 'application/json')
+
+            def _reply(self, status, body=b'', content_type='text/plain', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if body:
+                    self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def close(self):
+        self.httpd.server_close()
+
+
+def run_webhook(bot, url, host='0.0.0.0', port=8443, path='/webhook', secret_token=None,
+                workers=8, queue_size=1000, drain_timeout=30.0, dispatcher=None):
+    """Регистрирует вебхук и обрабатывает апдейты до остановки процесса
+
+    С dispatcher (sharding.UpdateDispatcher) апдейты не обрабатываются здесь,
+    а передаются процессам-обработчикам через шарды.
+    """
+    if dispatcher is None:
+        # Конкурентность задает пул вебхука, поэтому свой пул потоков TeleBot не нужен
+        bot.threaded = False
+        pool = UpdateWorkerPool(lambda update: bot.process_new_updates([update]), workers, queue_size)
+        server = WebhookServer(pool, host, port, path, secret_token)
+        pool.start()
+    else:
+        pool = dispatcher
+        server = WebhookServer(pool, host, port, path, secret_token, parse=json.loads)
+
+    if url:
+        bot.remove_webhook()
+        bot.set_webhook(url=url.rstrip('/') + path, secret_token=secret_token, max_connections=workers)
+    logger.info(f"Вебхук слушает {host}:{port}{path}, обработчиков: {workers}")
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    # docker stop шлет SIGTERM - завершаемся так же аккуратно, как по Ctrl+C
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("Останавливаем вебхук, дорабатываем очередь апдейтов")
+        server.close()
+        if dispatcher is None:
+            pool.drain(drain_timeout)
+        logger.info(f"Статистика вебхука: {pool.stats()}")